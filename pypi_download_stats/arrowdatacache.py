@@ -0,0 +1,796 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import logging
+import os
+import re
+import json
+import threading
+import time
+import uuid
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+from pypi_download_stats.diskdatacache import DiskDataCache
+
+logger = logging.getLogger(__name__)
+
+
+class ArrowDataCache(DiskDataCache):
+    """
+    Alternative to :py:class:`~.DiskDataCache` that stores each project's
+    cached data in columnar Arrow IPC files, in a per-project directory under
+    the cache directory, instead of one JSON file per project per day.
+
+    Each :py:meth:`~.set_many` call appends one immutable *fragment* to each
+    project's directory, made up of files named
+    ``<sequence>.<generation>.<table>.arrow``:
+
+    * one table per breakdown (``by_version`` etc.) with ``date``,
+      dictionary-encoded ``key`` (and ``subkey``, for two-column breakdowns)
+      and ``count`` columns, one row per count, in date order;
+    * a ``records`` table with one row per date, holding the JSON
+      ``cache_metadata``, the names of the record's breakdowns and any other
+      (i.e. ``cube``) record data. It is written last, and fragments without
+      one (i.e. from an interrupted write) are ignored.
+
+    Each date's record is read from the newest fragment that has it. After
+    each write, the two newest fragments are merged while the older of them
+    has no more dates than the newer (see :py:meth:`~._compact`), so the
+    number of fragments stays logarithmic in the number of dates, and a
+    day-by-day backfill rewrites each date about ``log2(days)`` times rather
+    than once per later day.
+
+    Fragments are memory-mapped when first seen (they never change), and
+    records are built from slices of their columns when requested, so reading
+    a project's history is one read per file rather than one ``json.loads``
+    per day. Non-project state is stored as JSON files, as by
+    :py:class:`~.DiskDataCache`, so both can share one cache directory.
+
+    Requires ``pyarrow``.
+    """
+
+    # name of each fragment's table of record metadata
+    _RECORDS_TABLE = 'records'
+
+    # fragment file names: sequence (ordered by write time), generation
+    # (incremented by each merge) and table name
+    _fragment_re = re.compile(r'^([0-9a-f]{24})\.([0-9]{4})\.(\w+)\.arrow$')
+
+    # files of incomplete fragments (i.e. from a crashed writer) are removed
+    # by _compact() once they are this many seconds old
+    _ORPHAN_AGE = 3600
+
+    def __init__(self, cache_path):
+        """
+        Initialize the Arrow data cache.
+
+        :param cache_path: absolute path to the cache directory
+        :type cache_path: str
+        """
+        if pa is None:
+            raise Exception('ERROR: the Arrow cache requires pyarrow; '
+                            'please "pip install pyarrow"')
+        super(ArrowDataCache, self).__init__(cache_path)
+        # project name => 2-tuple of (tuple of the project's fragment names,
+        # dict as returned by _load)
+        self._loaded = {}
+        self._lock = threading.RLock()
+        self._last_usec = 0
+
+    def _path_for_project(self, project_name):
+        """
+        Generate the path on disk for a project's directory of Arrow files.
+
+        :param project_name: the PyPI project name for the data
+        :type project_name: str
+        :return: path to the project's directory
+        :rtype: str
+        """
+        return os.path.join(self.cache_path, project_name)
+
+    @staticmethod
+    def _path_for_table(pdir, fragment, table):
+        """
+        Generate the path on disk of one of a fragment's tables.
+
+        :param pdir: project directory
+        :type pdir: str
+        :param fragment: 2-tuple of fragment (sequence, generation)
+        :type fragment: tuple
+        :param table: table name
+        :type table: str
+        :return: path to the table's file
+        :rtype: str
+        """
+        return os.path.join(
+            pdir, '%s.%s.%s.arrow' % (fragment[0], fragment[1], table)
+        )
+
+    def _new_fragment(self):
+        """
+        Return the name of a new fragment, ordered after every fragment
+        written before it.
+
+        :return: 2-tuple of fragment (sequence, generation)
+        :rtype: tuple
+        """
+        usec = max(int(time.time() * 1000000), self._last_usec + 1)
+        self._last_usec = usec
+        return '%016x%s' % (usec, uuid.uuid4().hex[:8]), '0000'
+
+    def _list_fragments(self, pdir):
+        """
+        List the fragments in a project directory.
+
+        :param pdir: project directory
+        :type pdir: str
+        :return: 2-tuple of (sorted list of complete fragments, dict of every
+          fragment to the list of its tables); fragments are 2-tuples of
+          (sequence, generation)
+        :rtype: tuple
+        """
+        tables = {}
+        try:
+            fnames = os.listdir(pdir)
+        except OSError:
+            return [], {}
+        for fname in fnames:
+            m = self._fragment_re.match(fname)
+            if m is not None:
+                tables.setdefault(
+                    (m.group(1), m.group(2)), []
+                ).append(m.group(3))
+        complete = sorted([
+            frag for frag, names in tables.items()
+            if self._RECORDS_TABLE in names
+        ])
+        return complete, tables
+
+    @staticmethod
+    def _read_table(path):
+        """
+        Memory-map and read an Arrow IPC file.
+
+        :param path: path to the file
+        :type path: str
+        :return: the table
+        :rtype: ``pyarrow.Table``
+        """
+        with pa.memory_map(path, 'r') as source:
+            return pa.ipc.open_file(source).read_all()
+
+    @staticmethod
+    def _write_table(path, names, arrays):
+        """
+        Write an Arrow IPC file, via a temporary file and rename.
+
+        :param path: path to the file
+        :type path: str
+        :param names: column names
+        :type names: ``list``
+        :param arrays: column arrays, in the same order as ``names``
+        :type arrays: ``list``
+        """
+        table = pa.Table.from_arrays(arrays, names=names)
+        tmp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        try:
+            with pa.OSFile(tmp_path, 'wb') as sink:
+                writer = pa.ipc.new_file(sink, table.schema)
+                writer.write_table(table)
+                writer.close()
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _is_breakdown(name, value):
+        """
+        Return True if a cache record key holds breakdown data (i.e.
+        ``by_version``) that is stored in its own table.
+
+        :param name: cache record key
+        :type name: str
+        :param value: cache record value
+        :return: whether the key is a breakdown
+        :rtype: bool
+        """
+        return name.startswith('by_') and isinstance(value, dict)
+
+    def _read_fragment(self, pdir, fragment, tables):
+        """
+        Read one fragment: its records table, and the breakdown tables (left
+        memory-mapped) with the row range of each date in them.
+
+        :param pdir: project directory
+        :type pdir: str
+        :param fragment: 2-tuple of fragment (sequence, generation)
+        :type fragment: tuple
+        :param tables: names of the fragment's tables
+        :type tables: ``list``
+        :return: dict with ``name`` (the fragment), ``dates`` (list of the
+          dates of its records), ``metadata``, ``breakdowns`` and ``extra``
+          (lists of each record's JSON columns) and ``tables`` (dict of
+          breakdown name to 2-tuple of (table, dict of date to 2-tuple of
+          start and stop row)) keys
+        :rtype: dict
+        """
+        records = self._read_table(
+            self._path_for_table(pdir, fragment, self._RECORDS_TABLE)
+        )
+        result = {
+            name: records.column(name).to_pylist()
+            for name in ['metadata', 'breakdowns', 'extra']
+        }
+        result['name'] = fragment
+        result['dates'] = [
+            datetime(d.year, d.month, d.day)
+            for d in records.column('date').to_pylist()
+        ]
+        result['tables'] = {}
+        for name in tables:
+            if name == self._RECORDS_TABLE:
+                continue
+            table = self._read_table(
+                self._path_for_table(pdir, fragment, name)
+            )
+            offsets = {}
+            start = 0
+            counts = pc.value_counts(table.column('date'))
+            for d, num in zip(counts.field('values').to_pylist(),
+                              counts.field('counts').to_pylist()):
+                offsets[datetime(d.year, d.month, d.day)] = (
+                    start, start + num
+                )
+                start += num
+            result['tables'][name] = (table, offsets)
+        return result
+
+    def _load(self, project):
+        """
+        Return a project's fragments, reading any that were not read before,
+        and which fragment holds the newest record for each date.
+
+        :param project: project name
+        :type project: str
+        :return: dict with ``fragments`` (list of fragments, oldest first, as
+          returned by :py:meth:`~._read_fragment`) and ``dates`` (dict of
+          :py:class:`datetime.datetime` date to 2-tuple of (fragment, row
+          index in its records)) keys
+        :rtype: dict
+        """
+        pdir = self._path_for_project(project)
+        with self._lock:
+            while True:
+                complete, tables = self._list_fragments(pdir)
+                ident = tuple(complete)
+                old = {}
+                if project in self._loaded:
+                    if self._loaded[project][0] == ident:
+                        return self._loaded[project][1]
+                    old = dict([
+                        (f['name'], f)
+                        for f in self._loaded[project][1]['fragments']
+                    ])
+                logger.debug('Reading Arrow cache fragments for project %s '
+                             'from %s', project, pdir)
+                try:
+                    fragments = [
+                        old[frag] if frag in old else self._read_fragment(
+                            pdir, frag, tables[frag]
+                        ) for frag in complete
+                    ]
+                except (IOError, OSError):
+                    # removed by another writer's merge, after writing the
+                    # merged fragment; list them again
+                    logger.debug('Arrow cache fragment for project %s '
+                                 'removed while reading; retrying', project)
+                    continue
+                break
+            dates = {}
+            for frag in fragments:
+                for idx, dt in enumerate(frag['dates']):
+                    dates[dt] = (frag, idx)
+            state = {'fragments': fragments, 'dates': dates}
+            self._loaded[project] = (ident, state)
+            return state
+
+    def _build_records(self, fragment, indexes):
+        """
+        Build cache records, as stored (i.e. without converting their
+        ``cache_metadata``), from one fragment, reading each breakdown's
+        counts from one slice of its table. As in JSON cache files, ``None``
+        keys are read as the string ``null``.
+
+        :param fragment: fragment, as returned by :py:meth:`~._read_fragment`
+        :type fragment: dict
+        :param indexes: row indexes of the records to build, in the
+          fragment's records table
+        :type indexes: ``list``
+        :return: dict of :py:class:`datetime.datetime` date to cache record
+        :rtype: dict
+        """
+        records = {}
+        for idx in indexes:
+            rec = json.loads(fragment['extra'][idx])
+            rec['cache_metadata'] = json.loads(fragment['metadata'][idx])
+            for name in json.loads(fragment['breakdowns'][idx]):
+                rec[name] = {}
+            records[fragment['dates'][idx]] = rec
+        for name, (table, offsets) in fragment['tables'].items():
+            spans = [
+                offsets[dt] for dt in records
+                if dt in offsets and name in records[dt]
+            ]
+            if len(spans) == 0:
+                continue
+            start = min([s[0] for s in spans])
+            stop = max([s[1] for s in spans])
+            self._add_counts(
+                table.slice(start, stop - start), name, records
+            )
+        return records
+
+    @staticmethod
+    def _add_counts(table, name, records):
+        """
+        Add the counts in (a slice of) one breakdown's table to the records
+        for their dates, skipping dates not in ``records``.
+
+        :param table: breakdown table or slice of it
+        :type table: ``pyarrow.Table``
+        :param name: breakdown name
+        :type name: str
+        :param records: dict of date to cache record, to add counts to
+        :type records: dict
+        """
+        cols = dict([
+            (col, table.column(col).to_pylist())
+            for col in table.column_names
+        ])
+        keys = ['null' if k is None else k for k in cols['key']]
+        subkeys = cols.get('subkey', None)
+        breakdowns = {}
+        for idx, d in enumerate(cols['date']):
+            if d not in breakdowns:
+                dt = datetime(d.year, d.month, d.day)
+                breakdowns[d] = records[dt][name] if dt in records else None
+            breakdown = breakdowns[d]
+            if breakdown is None:
+                continue
+            if subkeys is None:
+                breakdown[keys[idx]] = cols['count'][idx]
+                continue
+            sub = 'null' if subkeys[idx] is None else subkeys[idx]
+            breakdown.setdefault(keys[idx], {})[sub] = cols['count'][idx]
+
+    def _get_records(self, project, dates):
+        """
+        Return a project's newest cache records for the specified dates, as
+        stored, building them from each fragment at once.
+
+        :param project: project name
+        :type project: str
+        :param dates: dates to return records for
+        :type dates: iterable
+        :return: dict of :py:class:`datetime.datetime` date to cache record,
+          for each of ``dates`` that is in the cache
+        :rtype: dict
+        """
+        with self._lock:
+            state = self._load(project)
+            by_fragment = {}
+            for dt in dates:
+                if dt not in state['dates']:
+                    continue
+                frag, idx = state['dates'][dt]
+                by_fragment.setdefault(
+                    frag['name'], (frag, [])
+                )[1].append(idx)
+            result = {}
+            for frag, indexes in by_fragment.values():
+                result.update(self._build_records(frag, indexes))
+            return result
+
+    def _write_fragment(self, project, records, fragment=None):
+        """
+        Write cache records to a new fragment of a project's files.
+
+        :param project: project name
+        :type project: str
+        :param records: dict of :py:class:`datetime.datetime` date to cache
+          record, as stored
+        :type records: dict
+        :param fragment: 2-tuple of fragment (sequence, generation) to write;
+          if None, a new one (see :py:meth:`~._new_fragment`)
+        :type fragment: tuple
+        """
+        pdir = self._path_for_project(project)
+        if not os.path.exists(pdir):
+            os.makedirs(pdir)
+        if fragment is None:
+            fragment = self._new_fragment()
+        dates = sorted(records.keys())
+        rec_cols = {'date': [], 'metadata': [], 'breakdowns': [], 'extra': []}
+        breakdowns = {}
+        nested = set()
+        for dt in dates:
+            rec = records[dt]
+            names = []
+            extra = {}
+            for k, v in rec.items():
+                if k == 'cache_metadata':
+                    continue
+                if not self._is_breakdown(k, v):
+                    extra[k] = v
+                    continue
+                names.append(k)
+                rows = breakdowns.setdefault(k, [])
+                for key, val in v.items():
+                    if isinstance(val, dict):
+                        nested.add(k)
+                        for subkey, count in val.items():
+                            rows.append((dt, key, subkey, count))
+                    else:
+                        rows.append((dt, key, None, val))
+            rec_cols['date'].append(dt.date())
+            rec_cols['metadata'].append(json.dumps(rec['cache_metadata']))
+            rec_cols['breakdowns'].append(json.dumps(sorted(names)))
+            rec_cols['extra'].append(json.dumps(extra))
+        for name, rows in breakdowns.items():
+            names = ['date', 'key']
+            arrays = [
+                pa.array([r[0].date() for r in rows], type=pa.date32()),
+                pa.array([r[1] for r in rows],
+                         type=pa.string()).dictionary_encode()
+            ]
+            if name in nested:
+                names.append('subkey')
+                arrays.append(pa.array(
+                    [r[2] for r in rows], type=pa.string()
+                ).dictionary_encode())
+            names.append('count')
+            arrays.append(pa.array([r[3] for r in rows], type=pa.int64()))
+            self._write_table(
+                self._path_for_table(pdir, fragment, name), names, arrays
+            )
+        self._write_table(
+            self._path_for_table(pdir, fragment, self._RECORDS_TABLE),
+            ['date', 'metadata', 'breakdowns', 'extra'],
+            [
+                pa.array(rec_cols['date'], type=pa.date32()),
+                pa.array(rec_cols['metadata'], type=pa.string()),
+                pa.array(rec_cols['breakdowns'], type=pa.string()),
+                pa.array(rec_cols['extra'], type=pa.string())
+            ]
+        )
+
+    def _remove_fragment(self, pdir, fragment, tables):
+        """
+        Remove a fragment's files, its records table first.
+
+        :param pdir: project directory
+        :type pdir: str
+        :param fragment: 2-tuple of fragment (sequence, generation)
+        :type fragment: tuple
+        :param tables: names of the fragment's tables
+        :type tables: ``list``
+        """
+        for name in sorted(
+            tables, key=lambda n: (n != self._RECORDS_TABLE, n)
+        ):
+            try:
+                os.remove(self._path_for_table(pdir, fragment, name))
+            except OSError:
+                pass
+
+    def _compact(self, project):
+        """
+        Merge a project's two newest fragments into one, for as long as the
+        older of them has no more dates than the newer, so that fragment sizes
+        decrease from oldest to newest (like the digits of a binary counter).
+        The merged fragment is written (as the newer fragment's next
+        generation) before the two are removed, so readers always see every
+        record. Also remove the files of incomplete fragments older than
+        :py:attr:`~._ORPHAN_AGE`.
+
+        :param project: project name
+        :type project: str
+        """
+        pdir = self._path_for_project(project)
+        with self._lock:
+            while True:
+                frags = self._load(project)['fragments']
+                if (
+                    len(frags) < 2 or
+                    len(frags[-2]['dates']) > len(frags[-1]['dates'])
+                ):
+                    break
+                older, newer = frags[-2], frags[-1]
+                logger.debug('Merging Arrow cache fragments %s and %s for '
+                             'project %s', older['name'], newer['name'],
+                             project)
+                merged = self._build_records(
+                    older, range(len(older['dates']))
+                )
+                merged.update(self._build_records(
+                    newer, range(len(newer['dates']))
+                ))
+                self._write_fragment(project, merged, (
+                    newer['name'][0], '%04d' % (int(newer['name'][1]) + 1)
+                ))
+                tables = self._list_fragments(pdir)[1]
+                for frag in [older, newer]:
+                    self._remove_fragment(
+                        pdir, frag['name'], tables.get(frag['name'], [])
+                    )
+            complete, tables = self._list_fragments(pdir)
+            now = time.time()
+            for frag, names in tables.items():
+                if frag in complete:
+                    continue
+                try:
+                    mtime = max([
+                        os.stat(self._path_for_table(pdir, frag, n)).st_mtime
+                        for n in names
+                    ])
+                except OSError:
+                    continue
+                if now - mtime > self._ORPHAN_AGE:
+                    logger.debug('Removing incomplete Arrow cache fragment '
+                                 '%s for project %s', frag, project)
+                    self._remove_fragment(pdir, frag, names)
+
+    def get(self, project, date):
+        """
+        Get the cache data for a specified project for the specified date.
+        Returns None if the data cannot be found in the cache.
+
+        :param project: PyPi project name to get data for
+        :type project: str
+        :param date: date to get data for
+        :type date: datetime.datetime
+        :return: dict of per-date data for project
+        :rtype: :py:obj:`dict` or ``None``
+        """
+        logger.debug('Cache GET project=%s date=%s', project,
+                     date.strftime('%Y-%m-%d'))
+        rec = self._get_records(project, [date]).get(date, None)
+        if rec is None:
+            return None
+        return self._parse_metadata(rec)
+
+    def get_many(self, keys):
+        """
+        Get the cache data for several projects and/or dates at once, reading
+        each project's files (if they changed) once.
+
+        :param keys: list of 2-tuples of (project name, date), each as the
+          arguments to :py:meth:`~.get`
+        :type keys: ``list``
+        :return: dict of (project name, date) 2-tuple to the cache data for
+          it, as returned by :py:meth:`~.get`, for each of ``keys`` that is
+          found in the cache
+        :rtype: dict
+        """
+        by_project = {}
+        for project, date in keys:
+            by_project.setdefault(project, []).append(date)
+        result = {}
+        for project, dates in by_project.items():
+            for date, rec in self._get_records(project, dates).items():
+                result[(project, date)] = self._parse_metadata(rec)
+        return result
+
+    def get_range(self, project, start_date, end_date):
+        """
+        Get the cache data for a specified project for every date in a range
+        (inclusive) that we have in cache, reading the project's files (if
+        they changed) once, and each breakdown's counts from one slice of each
+        fragment's table.
+
+        :param project: PyPi project name to get data for
+        :type project: str
+        :param start_date: first date to get data for
+        :type start_date: datetime.datetime
+        :param end_date: last date to get data for
+        :type end_date: datetime.datetime
+        :return: dict of date to the cache data for it, as returned by
+          :py:meth:`~.get`
+        :rtype: dict
+        """
+        logger.debug('Cache GET project=%s dates %s to %s', project,
+                     start_date.strftime('%Y-%m-%d'),
+                     end_date.strftime('%Y-%m-%d'))
+        with self._lock:
+            dates = [
+                dt for dt in self._load(project)['dates']
+                if start_date <= dt <= end_date
+            ]
+            return dict([
+                (dt, self._parse_metadata(rec))
+                for dt, rec in self._get_records(project, dates).items()
+            ])
+
+    def set(self, project, date, data, data_ts, metadata=None):
+        """
+        Set the cache data for a specified project for the specified date.
+
+        :param project: project name to set data for
+        :type project: str
+        :param date: date to set data for
+        :type date: datetime.datetime
+        :param data: data to cache
+        :type data: dict
+        :param data_ts: maximum timestamp in the BigQuery data table
+        :type data_ts: int
+        :param metadata: additional metadata to store in the record's
+          ``cache_metadata`` dict
+        :type metadata: dict
+        """
+        self.set_many([(project, date, data, data_ts, metadata)])
+
+    def set_many(self, records):
+        """
+        Set the cache data for several projects and/or dates at once, writing
+        one new fragment per project (see :py:meth:`~._compact`).
+
+        :param records: list of 5-tuples of (project name, date, data,
+          data_ts, metadata), each as the arguments to :py:meth:`~.set`
+        :type records: ``list``
+        """
+        by_project = {}
+        for project, date, data, data_ts, metadata in records:
+            by_project.setdefault(project, {})[date] = self._add_metadata(
+                project, date, data, data_ts, metadata
+            )
+        with self._lock:
+            for project, new in by_project.items():
+                logger.debug('Cache SET project=%s (%d date(s))', project,
+                             len(new))
+                self._write_fragment(project, new)
+                self._compact(project)
+
+    def get_dates_for_project(self, project):
+        """
+        Return a list of the dates we have in cache for the specified project,
+        sorted in ascending date order.
+
+        :param project: project name
+        :type project: str
+        :return: list of datetime.datetime objects
+        :rtype: datetime.datetime
+        """
+        return sorted(self._load(project)['dates'].keys())
+
+    def get_all_dates(self):
+        """
+        Return the dates we have in cache for every project.
+
+        :return: dict of project name to list of datetime.datetime objects,
+          sorted in ascending date order
+        :rtype: dict
+        """
+        result = {}
+        for name in os.listdir(self.cache_path):
+            path = os.path.join(self.cache_path, name)
+            if (
+                name.startswith('_') or not os.path.isdir(path) or
+                len(self._list_fragments(path)[0]) == 0
+            ):
+                continue
+            result[name] = self.get_dates_for_project(name)
+        return result
+
+    def get_date_index(self, project):
+        """
+        Return the date index entries for the specified project: the dates we
+        have in cache for it, and the ``data_ts`` and whether each record is
+        ``empty`` (has no downloads in any breakdown). Unlike
+        :py:meth:`DiskDataCache.get_date_index`, there is no separate index;
+        the entries are built from the project's records.
+
+        :param project: project name
+        :type project: str
+        :return: dict of :py:class:`datetime.datetime` date to dict with
+          ``data_ts`` and ``empty`` keys
+        :rtype: dict
+        """
+        with self._lock:
+            records = self._get_records(
+                project, list(self._load(project)['dates'].keys())
+            )
+        return dict([
+            (dt, self._index_entry(rec)) for dt, rec in records.items()
+        ])
+
+    def rebuild_index(self):
+        """
+        Not supported; the Arrow cache has no date index to rebuild (each
+        project's dates are read from its fragments). Raises an Exception.
+        """
+        raise Exception('ERROR: the Arrow cache has no date index to '
+                        'rebuild; rebuild_index only applies to the JSON '
+                        'cache files')
+
+    def recompress(self):
+        """
+        Not supported; Arrow cache files are not written with a serializer or
+        compression. Raises an Exception.
+        """
+        raise Exception('ERROR: the Arrow cache cannot be recompressed; '
+                        'recompress only applies to the JSON cache files')
+
+    def migrate(self, disk_cache):
+        """
+        Copy every cache record from a :py:class:`~.DiskDataCache` (JSON file
+        per project per day) into this cache, as stored (i.e. keeping their
+        ``cache_metadata``), writing one fragment per project. Existing
+        records for the same project and date are replaced. The JSON files,
+        and non-project state (which both caches share), are left in place.
+
+        :param disk_cache: cache to copy records from
+        :type disk_cache: :py:class:`~.DiskDataCache`
+        :return: number of records copied
+        :rtype: int
+        """
+        count = 0
+        for project, dates in sorted(disk_cache.get_all_dates().items()):
+            new = {}
+            for dt in dates:
+                rec = disk_cache._read_record(project, dt)
+                if rec is None:
+                    logger.warning('Could not read cache record for project=%s '
+                                   'date=%s; skipping', project,
+                                   dt.strftime('%Y-%m-%d'))
+                    continue
+                new[dt] = rec
+            if len(new) > 0:
+                with self._lock:
+                    self._write_fragment(project, new)
+                    self._compact(project)
+            logger.info('Migrated %d cache record(s) for project %s',
+                        len(new), project)
+            count += len(new)
+        return count
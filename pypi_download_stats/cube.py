@@ -0,0 +1,103 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def rollup(cube, columns):
+    """
+    Roll up a fine-grained download count "cube" (as stored in cache records
+    under the ``cube`` key by :py:class:`~.DataQuery` in cube mode) to counts
+    for one or more of its columns.
+
+    The cube is a dict with keys ``columns`` (list of the BigQuery column
+    names, i.e. ``file.version``, that each row is grouped by) and ``rows``
+    (list of lists, each the value of every column followed by the download
+    count for that combination of values).
+
+    :param cube: download count cube
+    :type cube: dict
+    :param columns: names of the column(s) to roll up to, in order
+    :type columns: ``list``
+    :return: for one column, a dict of column value to download count; for
+      more than one, a dict of first column value to dict of second column
+      value (and so on) to download count.
+    :rtype: dict
+    """
+    indexes = [cube['columns'].index(c) for c in columns]
+    result = {}
+    for row in cube['rows']:
+        d = result
+        for idx in indexes[:-1]:
+            if row[idx] not in d:
+                d[row[idx]] = {}
+            d = d[row[idx]]
+        k = row[indexes[-1]]
+        d[k] = d.get(k, 0) + row[-1]
+    return result
+
+
+def merge(cached, delta):
+    """
+    Merge a cube of newly-queried download counts into a cached one,
+    returning a new cube. Counts for rows with the same column values are
+    summed.
+
+    :param cached: download count cube from the cache
+    :type cached: dict
+    :param delta: download count cube of newly-queried counts, with the same
+      columns as ``cached``
+    :type delta: dict
+    :return: merged cube
+    :rtype: dict
+    """
+    if cached['columns'] != delta['columns']:
+        raise Exception('ERROR: cannot merge cubes with different columns')
+    counts = {}
+    order = []
+    for row in cached['rows'] + delta['rows']:
+        k = tuple(row[:-1])
+        if k not in counts:
+            counts[k] = 0
+            order.append(k)
+        counts[k] += row[-1]
+    return {
+        'columns': list(cached['columns']),
+        'rows': [list(k) + [counts[k]] for k in order]
+    }
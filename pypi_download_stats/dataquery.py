@@ -37,16 +37,25 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 
 import logging
 import re
-import os
-import json
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from oauth2client.client import GoogleCredentials
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+from pypi_download_stats import cube
+from pypi_download_stats.querybackends import BigQueryBackend
 
 logger = logging.getLogger(__name__)
 
+# BigQuery on-demand query price, in US dollars per TiB processed; only used
+# for cost estimates.
+USD_PER_TIB = 6.25
+
 
 class DataQuery(object):
 
@@ -54,7 +63,50 @@ class DataQuery(object):
     _DATASET_ID = 'pypi'
     _table_re = re.compile(r'^downloads([0-9]{8})$')
 
-    def __init__(self, project_id, project_names, cache_instance):
+    # how long a persisted listing of the dataset's tables is used before
+    # being refreshed by listing all tables again
+    _TABLE_LISTING_TTL = timedelta(days=7)
+
+    # maximum length of the project name list in a query's WHERE clause;
+    # longer lists are split into batches queried separately
+    _MAX_PROJECTS_LENGTH = 65536
+
+    # number of buckets that rows are hashed into when sampling; a sample rate
+    # of ``r`` selects the rows in the first ``r * _SAMPLE_BUCKETS`` buckets
+    _SAMPLE_BUCKETS = 1000000
+
+    # incremental queries track the newest download timestamp seen in
+    # microseconds, as that is the precision BigQuery stores them at
+    _USEC_PER_SEC = 1000000
+
+    # breakdown key that download counts outside of the top ``top_k`` keys
+    # are summed into (for two-column breakdowns, both keys are this)
+    _OTHER_KEY = 'other'
+
+    # key that column values equal to ``_OTHER_KEY`` are stored as when
+    # ``top_k`` is set, so they are not summed into the ``_OTHER_KEY`` bucket
+    _OTHER_VALUE_KEY = 'other (value)'
+
+    # Cache record keys (see ProjectStats._is_empty_cache_record()) and the
+    # one or two columns that each breakdown is grouped by. Breakdowns with
+    # two columns are stored as nested dicts (name => version => count).
+    _DIMENSION_COLUMNS = OrderedDict([
+        ('by_version', ['file.version']),
+        ('by_file_type', ['file.type']),
+        ('by_installer', ['details.installer.name',
+                          'details.installer.version']),
+        ('by_implementation', ['details.implementation.name',
+                               'details.implementation.version']),
+        ('by_system', ['details.system.name']),
+        ('by_distro', ['details.distro.name', 'details.distro.version']),
+        ('by_country', ['country_code'])
+    ])
+
+    def __init__(self, project_id, project_names, cache_instance,
+                 single_scan=False, backfill_range_days=1,
+                 query_concurrency=1, max_bytes=None, incremental=False,
+                 cube=False, backend=None, project_batch_size=None,
+                 sample_rate=None, top_k=None, dimensions=None):
         """
         Initialize the class to query BigQuery data for the specified projects.
 
@@ -67,100 +119,178 @@ class DataQuery(object):
         :type project_names: ``list``
         :param cache_instance: DataCache instance
         :type cache_instance: :py:class:`~.DiskDataCache`
+        :param single_scan: if True, compute all per-day breakdowns and the
+          newest timestamp with one query per table (see
+          :py:meth:`~._query_single_scan`) instead of one query per breakdown
+        :type single_scan: bool
+        :param backfill_range_days: when backfilling history, query up to this
+          many consecutive missing days with one query (see
+          :py:meth:`~._query_date_range`); 1 queries each day separately
+        :type backfill_range_days: int
+        :param query_concurrency: number of days (or date ranges) to query
+          concurrently, each in its own worker thread
+        :type query_concurrency: int
+        :param max_bytes: if not None, before running any queries,
+          :py:meth:`~.run_queries` will dry-run them and raise an exception if
+          they would process more than this many bytes in total
+        :type max_bytes: int
+        :param incremental: if True, when re-querying a date that all projects
+          already have cached data for (i.e. today's table), only query
+          downloads newer than the cached data's newest timestamp and add them
+          to the cached counts. With ``top_k`` set, this only applies in cube
+          mode (see :py:meth:`~._cached_records`).
+        :type incremental: bool
+        :param cube: if True, query one fine-grained count per project per day
+          grouped by every breakdown column (see :py:meth:`~._cube_query`),
+          store that in the cache records, and derive the breakdowns from it
+          locally; takes precedence over ``single_scan``
+        :type cube: bool
+        :param backend: the backend to run queries against; if None, a
+          :py:class:`~.BigQueryBackend` for ``project_id`` is created
+        :type backend: :py:class:`~.QueryBackend`
+        :param project_batch_size: if not None, query for at most this many
+          projects per query; longer project lists are split into batches (see
+          :py:meth:`~._project_batches`) that are queried separately
+        :type project_batch_size: int
+        :param sample_rate: if not None, only count this fraction (greater
+          than 0 and less than 1) of downloads, selected by a hash of their
+          timestamp (see :py:meth:`~._where_for_projects`) or, with
+          :py:class:`~.StandardSQLBackend`, by ``TABLESAMPLE``, and scale the
+          counts back up by its inverse. The resulting cache records are
+          marked as approximate, and are queried again by later runs without
+          sampling (see :py:meth:`~._is_usable_record`).
+        :type sample_rate: float
+        :param top_k: if not None, only keep the download counts of this
+          many keys with the most downloads in each breakdown, per project per
+          day, and sum the rest into an :py:attr:`~._OTHER_KEY` key (see
+          :py:meth:`~._top_k_query`); column values equal to that key are
+          stored as :py:attr:`~._OTHER_VALUE_KEY` instead. In cube mode, the
+          cube itself is kept in full and only the breakdowns derived from it
+          are limited.
+        :type top_k: int
+        :param dimensions: if not None, only query these breakdowns (keys of
+          :py:attr:`~._DIMENSION_COLUMNS`). The other breakdowns of existing
+          cache records are kept as they are (see :py:meth:`~._set_cache`).
+        :type dimensions: ``list``
         """
+        if dimensions is not None:
+            unknown = [
+                d for d in dimensions if d not in self._DIMENSION_COLUMNS
+            ]
+            if len(unknown) > 0:
+                raise Exception(
+                    'ERROR: unknown dimension(s): %s' % ', '.join(unknown)
+                )
+        if sample_rate is not None and not 0 < sample_rate < 1:
+            raise Exception(
+                'ERROR: sample rate must be greater than 0 and less than 1, '
+                'not %s' % sample_rate
+            )
         logger.info('Initializing DataQuery for projects: %s',
                     ', '.join(project_names))
-        self.project_id = project_id
-        if project_id is None:
-            self.project_id = self._get_project_id()
-        logger.debug('project_id to run queries from: %s', self.project_id)
         self.cache = cache_instance
         self.projects = project_names
-        self.service = self._get_bigquery_service()
+        self.single_scan = single_scan
+        self.backfill_range_days = backfill_range_days
+        self.query_concurrency = query_concurrency
+        self.max_bytes = max_bytes
+        self.incremental = incremental
+        self.cube = cube
+        if backend is None:
+            backend = BigQueryBackend(project_id, query_concurrency)
+        self.backend = backend
+        self.project_batch_size = project_batch_size
+        self.sample_rate = sample_rate
+        self.top_k = top_k
+        self.dimensions = dimensions
 
-    def _dict_for_projects(self):
+    def _dict_for_projects(self, projects=None):
         """
         Return a dict whose keys are each project name we're querying for, and
         values are empty dicts.
 
+        :param projects: project names to use instead of ``self.projects``
+        :type projects: ``list``
         :return: dict with project name keys and empty dict values
         :rtype: dict
         """
+        if projects is None:
+            projects = self.projects
         d = {}
-        for p in self.projects:
+        for p in projects:
             d[p] = {}
         return d
 
-    def _get_project_id(self):
+    def _get_download_table_ids(self):
         """
-        Get our projectId from the ``GOOGLE_APPLICATION_CREDENTIALS`` creds
-        JSON file.
+        Get a list of PyPI downloads table (sharded per day) IDs.
 
-        :return: project ID
-        :rtype: str
-        """
-        fpath = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS', None)
-        if fpath is None:
-            raise Exception('ERROR: No project ID specified, and '
-                            'GOOGLE_APPLICATION_CREDENTIALS env var is not set')
-        fpath = os.path.abspath(os.path.expanduser(fpath))
-        logger.debug('Reading credentials file at %s to get project_id', fpath)
-        with open(fpath, 'r') as fh:
-            cred_data = json.loads(fh.read())
-        return cred_data['project_id']
+        Listing every table in the dataset takes longer the older the dataset
+        gets, so the listing is persisted in the cache (see
+        :py:meth:`~.DiskDataCache.set_state`) and only refreshed with a full
+        listing once it's older than ``self._TABLE_LISTING_TTL``. Otherwise,
+        only the tables for dates after the newest one in the persisted
+        listing are confirmed, with one ``tables.get`` request each.
 
-    def _get_bigquery_service(self):
+        :return: list of table names (strings)
+        :rtype: ``list``
         """
-        Connect to the BigQuery service.
+        listing = self.cache.get_state('tables')
+        now = time.time()
+        if (
+            listing is None or
+            len(listing['tables']) == 0 or
+            now - listing['updated'] > self._TABLE_LISTING_TTL.total_seconds()
+        ):
+            listing = {'updated': now, 'tables': self._list_download_tables()}
+            self.cache.set_state('tables', listing)
+            return listing['tables']
+        tables = listing['tables']
+        logger.info('Using cached listing of %d tables from %s; confirming '
+                    'newer tables', len(tables),
+                    datetime.fromtimestamp(listing['updated']))
+        new_tables = []
+        dt = self._datetime_for_table_name(tables[-1]) + timedelta(days=1)
+        while dt <= datetime.utcnow():
+            table_name = self._table_name_for_datetime(dt)
+            if self._get_table(table_name) is not None:
+                new_tables.append(table_name)
+            dt += timedelta(days=1)
+        if len(new_tables) > 0:
+            listing['tables'] = tables + new_tables
+            self.cache.set_state('tables', listing)
+        return listing['tables']
 
-        Calling ``GoogleCredentials.get_application_default`` requires that
-        you either be running in the Google Cloud, or have the
-        ``GOOGLE_APPLICATION_CREDENTIALS`` environment variable set to the path
-        to a credentials JSON file.
+    def _get_table(self, table_name):
+        """
+        Get the table resource for one of the per-day download tables.
 
-        :return: authenticated BigQuery service connection object
-        :rtype: `googleapiclient.discovery.Resource <http://google.github.io/\
-google-api-python-client/docs/epy/googleapiclient.discovery.\
-Resource-class.html>`_
+        :param table_name: name of the table
+        :type table_name: str
+        :return: table resource (dict), or None if the table does not exist
+        :rtype: dict
         """
-        logger.debug('Getting Google Credentials')
-        credentials = GoogleCredentials.get_application_default()
-        logger.debug('Building BigQuery service instance')
-        bigquery_service = build('bigquery', 'v2', credentials=credentials)
-        return bigquery_service
+        logger.debug('Getting table %s', table_name)
+        return self.backend.get_table(
+            self._PROJECT_ID, self._DATASET_ID, table_name
+        )
 
-    def _get_download_table_ids(self):
+    def _list_download_tables(self):
         """
-        Get a list of PyPI downloads table (sharded per day) IDs.
+        List all PyPI downloads table (sharded per day) IDs in the dataset.
 
-        :return: list of table names (strings)
+        :return: sorted list of table names (strings)
         :rtype: ``list``
         """
         all_table_names = []  # matching per-date table names
         logger.info('Querying for all tables in dataset')
-        tables = self.service.tables()
-        request = tables.list(projectId=self._PROJECT_ID,
-                              datasetId=self._DATASET_ID)
-        while request is not None:
-            response = request.execute()
-            # if the number of results is evenly divisible by the page size,
-            # we may end up with a last response that has no 'tables' key,
-            # and is empty.
-            if 'tables' not in response:
-                response['tables'] = []
-            for table in response['tables']:
-                if table['type'] != 'TABLE':
-                    logger.debug('Skipping %s (type=%s)',
-                                 table['tableReference']['tableId'],
-                                 table['type'])
-                    continue
-                if not self._table_re.match(table['tableReference']['tableId']):
-                    logger.debug('Skipping table with non-matching name: %s',
-                                 table['tableReference']['tableId'])
-                    continue
-                all_table_names.append(table['tableReference']['tableId'])
-            request = tables.list_next(previous_request=request,
-                                       previous_response=response)
+        for name in self.backend.list_tables(self._PROJECT_ID,
+                                             self._DATASET_ID):
+            if not self._table_re.match(name):
+                logger.debug('Skipping table with non-matching name: %s',
+                             name)
+                continue
+            all_table_names.append(name)
         return sorted(all_table_names)
 
     def _datetime_for_table_name(self, table_name):
@@ -190,36 +320,14 @@ Resource-class.html>`_
 
     def _run_query(self, query):
         """
-        Run one query against BigQuery and return the result.
+        Run one query against the backend and return the result.
 
         :param query: the query to run
         :type query: str
-        :return: list of per-row response dicts (key => value)
-        :rtype: ``list``
+        :return: generator of per-row result dicts (key => value)
+        :rtype: ``generator``
         """
-        query_request = self.service.jobs()
-        logger.debug('Running query: %s', query)
-        start = datetime.now()
-        resp = query_request.query(
-            projectId=self.project_id, body={'query': query}
-        ).execute()
-        duration = datetime.now() - start
-        logger.debug('Query response (in %s): %s', duration, resp)
-        if not resp['jobComplete']:
-            logger.error('Error: query reported job not complete!')
-        if int(resp['totalRows']) == 0:
-            return []
-        if int(resp['totalRows']) != len(resp['rows']):
-            logger.error('Error: query reported %s total rows, but only '
-                         'returned %d', resp['totalRows'], len(resp['rows']))
-        data = []
-        fields = [f['name'] for f in resp['schema']['fields']]
-        for row in resp['rows']:
-            d = {}
-            for idx, val in enumerate(row['f']):
-                d[fields[idx]] = val['v']
-            data.append(d)
-        return data
+        return self.backend.run_query(query)
 
     def _from_for_table(self, table_name):
         """
@@ -234,16 +342,123 @@ Resource-class.html>`_
             self._PROJECT_ID, self._DATASET_ID, table_name
         )
 
-    @property
-    def _where_for_projects(self):
+    def _where_for_projects(self, projects=None, since_ts=None,
+                            until_ts=None):
         """
         Construct a WHERE clause for the project names we're querying for.
 
+        :param projects: project names to use instead of ``self.projects``
+        :type projects: ``list``
+        :param since_ts: if not None, only count downloads with a timestamp
+          newer than this (integer microseconds since the epoch)
+        :type since_ts: int
+        :param until_ts: if not None, only count downloads with a timestamp
+          no newer than this (integer microseconds since the epoch)
+        :type until_ts: int
         :return: BigQuery WHERE clause for specified project names
         :rtype: str
+
+        If ``self.sample_rate`` is set, only rows whose timestamp hashes into
+        the first ``self.sample_rate`` fraction of
+        :py:attr:`~._SAMPLE_BUCKETS` buckets are selected. This is
+        deterministic, so re-running a sampled query gives the same counts,
+        and every breakdown computed from one query is from the same sample;
+        but downloads with the same timestamp are kept or dropped together,
+        and BigQuery still reads (and bills for) every row's columns.
+        :py:class:`~.StandardSQLBackend` instead samples the table's storage
+        blocks at random with ``TABLESAMPLE SYSTEM``, and is only billed for
+        the blocks read.
+        """
+        if projects is None:
+            projects = self.projects
+        where = "WHERE file.project IN (%s)" % ', '.join(
+            ["'%s'" % p for p in projects]
+        )
+        if since_ts is not None:
+            where += ' AND timestamp > USEC_TO_TIMESTAMP(%d)' % since_ts
+        if until_ts is not None:
+            where += ' AND timestamp <= USEC_TO_TIMESTAMP(%d)' % until_ts
+        if self.sample_rate is not None:
+            where += ' AND ABS(HASH(STRING(timestamp))) %% %d < %d' % (
+                self._SAMPLE_BUCKETS,
+                int(round(self.sample_rate * self._SAMPLE_BUCKETS))
+            )
+        return where
+
+    def _project_batches(self, projects=None):
+        """
+        Split a list of projects into batches to query separately, so that
+        query size (and compile time) and result size stay bounded for long
+        project lists. Batches have at most ``self.project_batch_size``
+        projects (if set), and their names total at most
+        ``self._MAX_PROJECTS_LENGTH`` characters.
+
+        Note that each query scans the same data regardless of how many
+        projects it selects, so every additional batch adds to the bytes
+        processed.
+
+        :param projects: project names to use instead of ``self.projects``
+        :type projects: ``list``
+        :return: list of lists of project names; if no split is needed, a list
+          containing only ``projects`` (which may be None)
+        :rtype: ``list``
+        """
+        names = projects
+        if names is None:
+            names = self.projects
+        batches = [[]]
+        length = 0
+        for p in names:
+            # quotes, comma and space
+            p_len = len(p) + 4
+            if len(batches[-1]) > 0 and (
+                length + p_len > self._MAX_PROJECTS_LENGTH or
+                (
+                    self.project_batch_size is not None and
+                    len(batches[-1]) >= self.project_batch_size
+                )
+            ):
+                batches.append([])
+                length = 0
+            batches[-1].append(p)
+            length += p_len
+        if len(batches) == 1:
+            return [projects]
+        logger.debug('Split %d projects into %d batches', len(names),
+                     len(batches))
+        return batches
+
+    def _batch_args(self, args_list, idx):
+        """
+        Given a list of argument tuples for :py:meth:`~._run_in_pool`, replace
+        each tuple with one tuple per batch of its projects (the element at
+        index ``idx``), as returned by :py:meth:`~._project_batches`.
+
+        :param args_list: list of tuples of positional arguments
+        :type args_list: ``list``
+        :param idx: index of the projects argument in each tuple
+        :type idx: int
+        :return: list of tuples of positional arguments
+        :rtype: ``list``
+        """
+        result = []
+        for args in args_list:
+            for batch in self._project_batches(args[idx]):
+                result.append(args[:idx] + (batch, ) + args[idx + 1:])
+        return result
+
+    def _newest_ts_query(self, table_name):
+        """
+        Build a query for the timestamp of the newest record in the given table.
+
+        :param table_name: name of the table to query
+        :type table_name: str
+        :return: BigQuery query
+        :rtype: str
         """
-        stmts = ["file.project = '%s'" % p for p in self.projects]
-        return "WHERE (%s)" % ' OR '.join(stmts)
+        return "SELECT TIMESTAMP_TO_USEC(MAX(timestamp)) AS max_ts %s;" % (
+            self._from_for_table(table_name)
+        )
 
     def _get_newest_ts_in_table(self, table_name):
         """
@@ -251,296 +466,1094 @@ Resource-class.html>`_
 
         :param table_name: name of the table to query
         :type table_name: str
-        :return: timestamp of newest row in table
+        :return: timestamp of newest row in table, in microseconds since the
+          epoch
         :rtype: int
         """
         logger.debug(
             'Querying for newest timestamp in table %s', table_name
         )
-        q = "SELECT TIMESTAMP_TO_SEC(MAX(timestamp)) AS max_ts %s;" % (
-            self._from_for_table(table_name)
-        )
-        res = self._run_query(q)
+        res = list(self._run_query(self._newest_ts_query(table_name)))
         ts = int(res[0]['max_ts'])
         logger.debug('Newest timestamp in table %s: %s', table_name, ts)
         return ts
 
-    def _query_by_version(self, table_name):
+    def _dimension_query(self, table_name, name, projects=None,
+                         since_ts=None, until_ts=None):
         """
-        Query for download data broken down by version, for one day.
+        Build a query for download data broken down by one of the dimensions
+        in :py:attr:`~._DIMENSION_COLUMNS`, for one day.
 
         :param table_name: table name to query against
         :type table_name: str
-        :return: dict of download information by version; keys are project
-          name, values are a dict of version to download count
+        :param name: breakdown (cache record key) name, i.e. ``by_version``
+        :type name: str
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        :param since_ts: if not None, only count downloads with a timestamp
+          newer than this (integer microseconds since the epoch)
+        :type since_ts: int
+        :param until_ts: if not None, only count downloads with a timestamp
+          no newer than this (integer microseconds since the epoch)
+        :type until_ts: int
+        :return: BigQuery query
+        :rtype: str
+        """
+        if self.top_k is not None:
+            aliases = [
+                self._column_alias(c) for c in self._DIMENSION_COLUMNS[name]
+            ]
+            cols = ['file.project AS file_project'] + [
+                '%s AS %s' % (c, a)
+                for c, a in zip(self._DIMENSION_COLUMNS[name], aliases)
+            ]
+            return '%s;' % self._top_k_query(
+                "SELECT %s, COUNT(*) AS dl_count %s %s GROUP BY %s" % (
+                    ', '.join(cols),
+                    self._from_for_table(table_name),
+                    self._where_for_projects(projects, since_ts, until_ts),
+                    ', '.join(['file_project'] + aliases)
+                ),
+                ['file_project'], aliases
+            )
+        cols = ', '.join(['file.project'] + self._DIMENSION_COLUMNS[name])
+        return "SELECT %s, COUNT(*) as dl_count " \
+               "%s " \
+               "%s " \
+               "GROUP BY %s;" % (
+                   cols,
+                   self._from_for_table(table_name),
+                   self._where_for_projects(projects, since_ts, until_ts),
+                   cols
+               )
+
+    def _top_k_query(self, query, partition_cols, key_cols):
+        """
+        Wrap a query for download counts (in a ``dl_count`` column) such that,
+        for each distinct value of ``partition_cols`` (i.e. each project, or
+        each date, breakdown and project), only the rows for the
+        ``self.top_k`` keys with the most downloads are kept, and the counts of
+        all others are summed into one row whose key columns are all
+        :py:attr:`~._OTHER_KEY`. Keys are ranked with ``ROW_NUMBER()``, with
+        ties broken by key, so exactly ``self.top_k`` keys are kept. Kept key
+        column values equal to :py:attr:`~._OTHER_KEY` are replaced with
+        :py:attr:`~._OTHER_VALUE_KEY`.
+
+        :param query: query for download counts, without trailing semicolon
+        :type query: str
+        :param partition_cols: names of the columns to rank keys within
+        :type partition_cols: ``list``
+        :param key_cols: names of the key columns to rank
+        :type key_cols: ``list``
+        :return: BigQuery query, without trailing semicolon
+        :rtype: str
+        """
+        ranked = "SELECT %s, dl_count, ROW_NUMBER() OVER " \
+            "(PARTITION BY %s ORDER BY dl_count DESC, %s) AS dl_rank " \
+            "FROM (%s)" % (
+                ', '.join(partition_cols + key_cols),
+                ', '.join(partition_cols),
+                ', '.join(key_cols),
+                query
+            )
+        bucketed = [
+            "CASE WHEN dl_rank > %d THEN '%s' WHEN %s = '%s' THEN '%s' "
+            "ELSE %s END AS %s" % (
+                self.top_k, self._OTHER_KEY, c, self._OTHER_KEY,
+                self._OTHER_VALUE_KEY, c, c
+            )
+            for c in key_cols
+        ]
+        return "SELECT %s, SUM(dl_count) AS dl_count FROM " \
+            "(SELECT %s, dl_count FROM (%s)) GROUP BY %s" % (
+                ', '.join(partition_cols + key_cols),
+                ', '.join(partition_cols + bucketed),
+                ranked,
+                ', '.join(partition_cols + key_cols)
+            )
+
+    def _limit_breakdown(self, breakdown, num_columns):
+        """
+        Limit a breakdown dict rolled up from a cube to its ``self.top_k`` keys
+        with the most downloads, summing the rest into :py:attr:`~._OTHER_KEY`,
+        locally; the equivalent of :py:meth:`~._top_k_query`. Keys are ranked
+        in the same order as that query's ``ROW_NUMBER()`` (see
+        :py:meth:`~._sort_key`), and kept key values equal to
+        :py:attr:`~._OTHER_KEY` are likewise replaced with
+        :py:attr:`~._OTHER_VALUE_KEY`.
+
+        :param breakdown: breakdown dict
+        :type breakdown: dict
+        :param num_columns: number of columns (one or two) in the breakdown
+        :type num_columns: int
+        :return: limited breakdown dict
         :rtype: dict
         """
-        logger.info('Querying for downloads by version in table %s',
-                    table_name)
-        q = "SELECT file.project, file.version, COUNT(*) as dl_count " \
-            "%s " \
-            "%s " \
-            "GROUP BY file.project, file.version;" % (
-                self._from_for_table(table_name),
-                self._where_for_projects
+        counts = []
+        for k1, v in breakdown.items():
+            if num_columns > 1:
+                counts.extend([([k1, k2], count) for k2, count in v.items()])
+            else:
+                counts.append(([k1], v))
+        counts.sort(
+            key=lambda x: (-1 * x[1], [self._sort_key(k) for k in x[0]])
+        )
+        result = {}
+        for keys, count in counts[:self.top_k]:
+            self._add_to_breakdown(result, [
+                self._OTHER_VALUE_KEY if k == self._OTHER_KEY else k
+                for k in keys
+            ], count)
+        if len(counts) > self.top_k:
+            self._add_to_breakdown(
+                result, [self._OTHER_KEY] * num_columns,
+                sum([x[1] for x in counts[self.top_k:]])
             )
-        res = self._run_query(q)
-        result = self._dict_for_projects()
-        for row in res:
-            result[row['file_project']][row['file_version']] = int(
-                row['dl_count'])
         return result
 
-    def _query_by_file_type(self, table_name):
+    @staticmethod
+    def _sort_key(value):
+        """
+        Return a key to sort a column value by, in the order that SQL's
+        ``ORDER BY`` sorts in: ``NULL`` (``None``) first, then strings in
+        ascending (code point, i.e. UTF-8 byte) order.
+
+        :param value: column value
+        :type value: str
+        :return: sort key
+        :rtype: tuple
+        """
+        if value is None:
+            return 0, ''
+        return 1, value
+
+    @staticmethod
+    def _add_to_breakdown(breakdown, keys, count):
+        """
+        Add a download count to a breakdown dict. For single-column breakdowns,
+        ``breakdown[keys[0]]`` is the count; for two-column breakdowns the
+        count is added to ``breakdown[keys[0]][keys[1]]``.
+
+        :param breakdown: the (per-project) breakdown dict to update
+        :type breakdown: dict
+        :param keys: list of one or two column values for the count
+        :type keys: ``list``
+        :param count: download count
+        :type count: int
+        """
+        if len(keys) == 1:
+            breakdown[keys[0]] = count
+            return
+        if keys[0] not in breakdown:
+            breakdown[keys[0]] = {}
+        if keys[1] not in breakdown[keys[0]]:
+            breakdown[keys[0]][keys[1]] = 0
+        breakdown[keys[0]][keys[1]] += count
+
+    def _query_dimension(self, table_name, name, projects=None,
+                         since_ts=None, until_ts=None):
         """
-        Query for download data broken down by file type, for one day.
+        Query for download data broken down by one of the dimensions in
+        :py:attr:`~._DIMENSION_COLUMNS`, for one day.
 
         :param table_name: table name to query against
         :type table_name: str
-        :return: dict of download information by file type; keys are project
-          name, values are a dict of file type to download count
+        :param name: breakdown (cache record key) name, i.e. ``by_version``
+        :type name: str
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        :param since_ts: if not None, only count downloads with a timestamp
+          newer than this (integer microseconds since the epoch)
+        :type since_ts: int
+        :param until_ts: if not None, only count downloads with a timestamp
+          no newer than this (integer microseconds since the epoch)
+        :type until_ts: int
+        :return: dict of download information for the breakdown; keys are
+          project name, values are a dict of column value to download count,
+          or (for two-column breakdowns like installer name and version) a
+          dict of first column value to dicts of second column value to
+          download count.
         :rtype: dict
         """
-        logger.info('Querying for downloads by file type in table %s',
-                    table_name)
-        q = "SELECT file.project, file.type, COUNT(*) as dl_count " \
-            "%s " \
-            "%s " \
-            "GROUP BY file.project, file.type;" % (
-                self._from_for_table(table_name),
-                self._where_for_projects
+        logger.info('Querying for downloads %s in table %s',
+                    name.replace('_', ' '), table_name)
+        res = self._run_query(
+            self._dimension_query(
+                table_name, name, projects, since_ts, until_ts
             )
-        res = self._run_query(q)
-        result = self._dict_for_projects()
+        )
+        aliases = [
+            self._column_alias(c) for c in self._DIMENSION_COLUMNS[name]
+        ]
+        result = self._dict_for_projects(projects)
         for row in res:
-            result[row['file_project']][row['file_type']] = int(
-                row['dl_count'])
+            self._add_to_breakdown(
+                result[row['file_project']],
+                [row[a] for a in aliases],
+                int(row['dl_count'])
+            )
         return result
 
-    def _query_by_installer(self, table_name):
+    def _dimensions(self):
+        """
+        Return the breakdowns to query, i.e. the items of
+        :py:attr:`~._DIMENSION_COLUMNS` in ``self.dimensions`` (or all of them
+        if that is None), in order.
+
+        :return: dict of breakdown name to list of its column names
+        :rtype: :py:class:`collections.OrderedDict`
+        """
+        return OrderedDict([
+            (name, dim_cols)
+            for name, dim_cols in self._DIMENSION_COLUMNS.items()
+            if self.dimensions is None or name in self.dimensions
+        ])
+
+    def _query_columns(self):
+        """
+        Return a list of every column used by the breakdowns to query (see
+        :py:meth:`~._dimensions`), in order.
+
+        :return: list of column names
+        :rtype: ``list``
+        """
+        columns = []
+        for dim_cols in self._dimensions().values():
+            columns.extend(dim_cols)
+        return columns
+
+    @classmethod
+    def _all_dimension_columns(cls):
+        """
+        Return a list of every column used by the breakdowns in
+        :py:attr:`~._DIMENSION_COLUMNS`, in order.
+
+        :return: list of column names
+        :rtype: ``list``
+        """
+        columns = []
+        for dim_cols in cls._DIMENSION_COLUMNS.values():
+            columns.extend(dim_cols)
+        return columns
+
+    @staticmethod
+    def _column_alias(column):
+        """
+        Return the output column name that legacy SQL gives a (possibly
+        nested) column, i.e. ``details.installer.name`` becomes
+        ``details_installer_name``.
+
+        :param column: column name
+        :type column: str
+        :return: output column name
+        :rtype: str
+        """
+        return column.replace('.', '_')
+
+    def _single_scan_query(self, from_clause, by_date=False, projects=None,
+                           since_ts=None):
+        """
+        Build a query for the newest timestamp and all per-project breakdowns
+        in :py:meth:`~._dimensions`, scanning the data only once.
+
+        Each matching row is fanned out (via ``FLATTEN`` of a ``SPLIT``
+        constant) into one row per breakdown, so the table is only scanned
+        once regardless of how many breakdowns we compute. The newest
+        timestamp is computed by a second, ``UNION ALL``-ed, select against
+        the ``timestamp`` column only. As BigQuery bills per column read, this
+        costs the same as one scan of all columns used and runs as one job.
+
+        Result rows have ``dimension``, ``file_project``, ``key1``, ``key2``
+        and ``dl_count`` fields (plus ``download_date`` if ``by_date`` is
+        True), and are parsed by :py:meth:`~._parse_single_scan`.
+
+        :param from_clause: FROM clause to select data from
+        :type from_clause: str
+        :param by_date: whether to also group by the date of each download,
+          for queries that span more than one per-day table
+        :type by_date: bool
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        :param since_ts: if not None, only count downloads with a timestamp
+          newer than this (integer microseconds since the epoch)
+        :type since_ts: int
+        :return: BigQuery query
+        :rtype: str
+        """
+        columns = self._query_columns()
+        key_exprs = []
+        for idx in range(2):
+            whens = [
+                "WHEN dimension = '%s' THEN %s" % (
+                    name, self._column_alias(dim_cols[idx])
+                )
+                for name, dim_cols in self._dimensions().items()
+                if len(dim_cols) > idx
+            ]
+            if len(whens) == 0:
+                # no selected breakdown has a second column
+                key_exprs.append('STRING(NULL)')
+                continue
+            key_exprs.append('CASE %s ELSE NULL END' % ' '.join(whens))
+        inner_cols = ['file.project AS file_project'] + [
+            '%s AS %s' % (c, self._column_alias(c)) for c in columns
+        ]
+        group_cols = ['dimension', 'file_project', 'key1', 'key2']
+        ts_cols = []
+        ts_group = ''
+        if by_date:
+            inner_cols.append('DATE(timestamp) AS download_date')
+            group_cols.insert(0, 'download_date')
+            ts_cols.append('DATE(timestamp) AS download_date')
+            ts_group = ' GROUP BY download_date'
+        inner_cols.append("SPLIT('%s', ',') AS dimension" % ','.join(
+            self._dimensions().keys()))
+        ts_cols.extend([
+            "'data_ts' AS dimension",
+            'STRING(NULL) AS file_project',
+            'STRING(TIMESTAMP_TO_USEC(MAX(timestamp))) AS key1',
+            'STRING(NULL) AS key2',
+            'COUNT(*) AS dl_count'
+        ])
+        counts = "SELECT %s, %s AS key1, %s AS key2, COUNT(*) AS dl_count " \
+            "FROM FLATTEN((SELECT %s %s %s), dimension) GROUP BY %s" % (
+                ', '.join(group_cols[:-2]),
+                key_exprs[0],
+                key_exprs[1],
+                ', '.join(inner_cols),
+                from_clause,
+                self._where_for_projects(projects, since_ts),
+                ', '.join(group_cols)
+            )
+        if self.top_k is not None:
+            counts = self._top_k_query(
+                counts, group_cols[:-2], group_cols[-2:]
+            )
+        return "SELECT %s, dl_count FROM (%s), (SELECT %s %s%s);" % (
+            ', '.join(group_cols),
+            counts,
+            ', '.join(ts_cols),
+            from_clause,
+            ts_group
+        )
+
+    def _parse_single_scan(self, rows, projects=None):
+        """
+        Parse the result rows of a :py:meth:`~._single_scan_query` query.
+
+        :param rows: query result rows, as returned by :py:meth:`~._run_query`
+        :type rows: iterable
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        :return: dict whose keys are the ``download_date`` of the rows
+          (``None`` if the query was not grouped by date) and values are
+          2-tuples of (newest timestamp for that date, in microseconds since
+          the epoch, dict of per-project data; keys are project names, values
+          are dicts of breakdown name to breakdown data as returned by
+          :py:meth:`~._query_dimension`)
+        :rtype: dict
+        """
+        timestamps = {}
+        results = {}
+        for row in rows:
+            row_date = row.get('download_date', None)
+            if row_date not in results:
+                results[row_date] = self._dict_for_projects(projects)
+                for proj in results[row_date]:
+                    for name in self._dimensions():
+                        results[row_date][proj][name] = {}
+            if row['dimension'] == 'data_ts':
+                timestamps[row_date] = int(row['key1'])
+                continue
+            keys = [row['key1'], row['key2']][
+                :len(self._DIMENSION_COLUMNS[row['dimension']])
+            ]
+            self._add_to_breakdown(
+                results[row_date][row['file_project']][row['dimension']],
+                keys, int(row['dl_count'])
+            )
+        return {
+            k: (timestamps.get(k, None), v) for k, v in results.items()
+        }
+
+    def _query_single_scan(self, table_name, projects=None, since_ts=None):
         """
-        Query for download data broken down by installer, for one day.
+        Query for the newest timestamp in the table and all per-project
+        breakdowns, for one day, in a single query (see
+        :py:meth:`~._single_scan_query`).
 
         :param table_name: table name to query against
         :type table_name: str
-        :return: dict of download information by installer; keys are project
-          name, values are a dict of installer names to dicts of installer
-          version to download count.
-        :rtype: dict
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        :param since_ts: if not None, only count downloads with a timestamp
+          newer than this (integer microseconds since the epoch)
+        :type since_ts: int
+        :return: 2-tuple of (newest timestamp in the table, in microseconds
+          since the epoch, dict of per-project data; keys are project names,
+          values are dicts of breakdown name to breakdown data as returned by
+          :py:meth:`~._query_dimension`)
+        :rtype: tuple
         """
-        logger.info('Querying for downloads by installer in table %s',
+        logger.info('Querying for all breakdowns in table %s (single scan)',
                     table_name)
-        q = "SELECT file.project, details.installer.name, " \
-            "details.installer.version, COUNT(*) as dl_count " \
-            "%s " \
-            "%s " \
-            "GROUP BY file.project, details.installer.name, " \
-            "details.installer.version;" % (
-                self._from_for_table(table_name),
-                self._where_for_projects
+        res = self._parse_single_scan(self._run_query(
+            self._single_scan_query(
+                self._from_for_table(table_name), projects=projects,
+                since_ts=since_ts
             )
-        res = self._run_query(q)
-        result = self._dict_for_projects()
-        # iterate through results
-        for row in res:
-            # pointer to the per-project result dict
-            proj = result[row['file_project']]
-            # grab the name and version; change None to 'unknown'
-            iname = row['details_installer_name']
-            iver = row['details_installer_version']
-            if iname not in proj:
-                proj[iname] = {}
-            if iver not in proj[iname]:
-                proj[iname][iver] = 0
-            proj[iname][iver] += int(row['dl_count'])
+        ), projects)
+        # the timestamp select always returns exactly one row
+        data_timestamp, result = res[None]
+        logger.debug('Newest timestamp in table %s: %s', table_name,
+                     data_timestamp)
+        return data_timestamp, result
+
+    def _cube_query(self, from_clause, by_date=False, projects=None,
+                    since_ts=None):
+        """
+        Build a query for the newest timestamp and a fine-grained download
+        count "cube" per project, grouped by every column in
+        :py:meth:`~._query_columns` (by default version, file type, installer,
+        implementation, system, distro and country) at once. Every breakdown,
+        and any cross-tab of them, can then be rolled up locally with
+        :py:func:`pypi_download_stats.cube.rollup`.
+
+        As in :py:meth:`~._single_scan_query`, the newest timestamp is computed
+        by a second, ``UNION ALL``-ed, select against the ``timestamp`` column
+        only. Result rows have ``row_type`` (``counts`` or ``data_ts``),
+        ``file_project``, one field per column (named by
+        :py:meth:`~._column_alias`) and ``dl_count`` fields (plus
+        ``download_date`` if ``by_date`` is True), and are parsed by
+        :py:meth:`~._parse_cube`. For the ``data_ts`` row, ``dl_count`` is the
+        newest timestamp.
+
+        :param from_clause: FROM clause to select data from
+        :type from_clause: str
+        :param by_date: whether to also group by the date of each download,
+          for queries that span more than one per-day table
+        :type by_date: bool
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        :param since_ts: if not None, only count downloads with a timestamp
+          newer than this (integer microseconds since the epoch)
+        :type since_ts: int
+        :return: BigQuery query
+        :rtype: str
+        """
+        columns = self._query_columns()
+        aliases = [self._column_alias(c) for c in columns]
+        count_cols = ["'counts' AS row_type", 'file.project AS file_project']
+        count_cols.extend([
+            '%s AS %s' % (c, a) for c, a in zip(columns, aliases)
+        ])
+        group_cols = ['row_type', 'file_project'] + aliases
+        ts_cols = ["'data_ts' AS row_type", 'STRING(NULL) AS file_project']
+        ts_cols.extend(['STRING(NULL) AS %s' % a for a in aliases])
+        ts_group = ''
+        out_cols = ['row_type', 'file_project'] + aliases + ['dl_count']
+        if by_date:
+            count_cols.insert(0, 'DATE(timestamp) AS download_date')
+            group_cols.insert(0, 'download_date')
+            ts_cols.insert(0, 'DATE(timestamp) AS download_date')
+            ts_group = ' GROUP BY download_date'
+            out_cols.insert(0, 'download_date')
+        return "SELECT %s FROM " \
+            "(SELECT %s, COUNT(*) AS dl_count %s %s GROUP BY %s), " \
+            "(SELECT %s, TIMESTAMP_TO_USEC(MAX(timestamp)) AS dl_count " \
+            "%s%s);" % (
+                ', '.join(out_cols),
+                ', '.join(count_cols),
+                from_clause,
+                self._where_for_projects(projects, since_ts),
+                ', '.join(group_cols),
+                ', '.join(ts_cols),
+                from_clause,
+                ts_group
+            )
+
+    def _cube_breakdowns(self, cube_data):
+        """
+        Roll up a download count cube to every breakdown in
+        :py:meth:`~._dimensions`, limited to ``self.top_k`` keys each
+        (see :py:meth:`~._limit_breakdown`) if set.
+
+        :param cube_data: download count cube, as stored in cache records
+        :type cube_data: dict
+        :return: dict of breakdown name to breakdown data, as returned by
+          :py:meth:`~._query_dimension`
+        :rtype: dict
+        """
+        result = {}
+        for name, dim_cols in self._dimensions().items():
+            result[name] = cube.rollup(cube_data, dim_cols)
+            if self.top_k is not None:
+                result[name] = self._limit_breakdown(
+                    result[name], len(dim_cols)
+                )
         return result
 
-    def _query_by_implementation(self, table_name):
+    def _parse_cube(self, rows, projects=None):
         """
-        Query for download data broken down by Python implementation, for one
-        day.
+        Parse the result rows of a :py:meth:`~._cube_query` query.
 
-        :param table_name: table name to query against
-        :type table_name: str
-        :return: dict of download information by implementation; keys are
-          project name, values are a dict of implementation names to dicts of
-          implementation version to download count.
+        :param rows: query result rows, as returned by :py:meth:`~._run_query`
+        :type rows: iterable
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        :return: dict whose keys are the ``download_date`` of the rows
+          (``None`` if the query was not grouped by date) and values are
+          2-tuples of (newest timestamp for that date, in microseconds since
+          the epoch, dict of per-project data; keys are project names, values
+          are dicts with a ``cube`` key holding the download count cube and
+          every breakdown rolled up from it by :py:meth:`~._cube_breakdowns`)
         :rtype: dict
         """
-        logger.info('Querying for downloads by Python implementation in table '
-                    '%s', table_name)
-        q = "SELECT file.project, details.implementation.name, " \
-            "details.implementation.version, COUNT(*) as dl_count " \
-            "%s " \
-            "%s " \
-            "GROUP BY file.project, details.implementation.name, " \
-            "details.implementation.version;" % (
-                self._from_for_table(table_name),
-                self._where_for_projects
+        columns = self._query_columns()
+        aliases = [self._column_alias(c) for c in columns]
+        timestamps = {}
+        results = {}
+        for row in rows:
+            row_date = row.get('download_date', None)
+            if row_date not in results:
+                results[row_date] = self._dict_for_projects(projects)
+                for proj in results[row_date]:
+                    results[row_date][proj]['cube'] = {
+                        'columns': columns, 'rows': []
+                    }
+            if row['row_type'] == 'data_ts':
+                timestamps[row_date] = int(row['dl_count'])
+                continue
+            results[row_date][row['file_project']]['cube']['rows'].append(
+                [row[a] for a in aliases] + [int(row['dl_count'])]
             )
-        res = self._run_query(q)
-        result = self._dict_for_projects()
-        # iterate through results
-        for row in res:
-            # pointer to the per-project result dict
-            proj = result[row['file_project']]
-            # grab the name and version; change None to 'unknown'
-            iname = row['details_implementation_name']
-            iver = row['details_implementation_version']
-            if iname not in proj:
-                proj[iname] = {}
-            if iver not in proj[iname]:
-                proj[iname][iver] = 0
-            proj[iname][iver] += int(row['dl_count'])
-        return result
+        for data in results.values():
+            for proj_data in data.values():
+                proj_data.update(self._cube_breakdowns(proj_data['cube']))
+        return {
+            k: (timestamps.get(k, None), v) for k, v in results.items()
+        }
 
-    def _query_by_system(self, table_name):
+    def _query_cube(self, table_name, projects=None, since_ts=None):
         """
-        Query for download data broken down by system, for one day.
+        Query for the newest timestamp in the table and the per-project
+        download count cube, for one day, in a single query (see
+        :py:meth:`~._cube_query`).
 
         :param table_name: table name to query against
         :type table_name: str
-        :return: dict of download information by system; keys are project name,
-          values are a dict of system names to download count.
-        :rtype: dict
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        :param since_ts: if not None, only count downloads with a timestamp
+          newer than this (integer microseconds since the epoch)
+        :type since_ts: int
+        :return: 2-tuple of (newest timestamp in the table, in microseconds
+          since the epoch, dict of per-project data as returned by
+          :py:meth:`~._parse_cube`)
+        :rtype: tuple
         """
-        logger.info('Querying for downloads by system in table %s',
+        logger.info('Querying for download count cube in table %s',
                     table_name)
-        q = "SELECT file.project, details.system.name, COUNT(*) as dl_count " \
-            "%s " \
-            "%s " \
-            "GROUP BY file.project, details.system.name;" % (
-                self._from_for_table(table_name),
-                self._where_for_projects
+        res = self._parse_cube(self._run_query(
+            self._cube_query(
+                self._from_for_table(table_name), projects=projects,
+                since_ts=since_ts
             )
-        res = self._run_query(q)
-        result = self._dict_for_projects()
-        for row in res:
-            system = row['details_system_name']
-            result[row['file_project']][system] = int(
-                row['dl_count'])
-        return result
+        ), projects)
+        # the timestamp select always returns exactly one row
+        data_timestamp, result = res[None]
+        logger.debug('Newest timestamp in table %s: %s', table_name,
+                     data_timestamp)
+        return data_timestamp, result
 
-    def _query_by_distro(self, table_name):
+    def _range_query(self, start_date, end_date, projects=None):
         """
-        Query for download data broken down by OS distribution, for one day.
+        Return the query that :py:meth:`~._query_date_range` runs for the
+        specified range of dates.
 
-        :param table_name: table name to query against
-        :type table_name: str
-        :return: dict of download information by distro; keys are project name,
-          values are a dict of distro names to dicts of distro version to
-          download count.
+        :param start_date: first date to query
+        :type start_date: datetime.datetime
+        :param end_date: last date to query
+        :type end_date: datetime.datetime
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        :return: BigQuery query
+        :rtype: str
+        """
+        from_clause = self._from_for_date_range(start_date, end_date)
+        if self.cube:
+            return self._cube_query(from_clause, by_date=True,
+                                    projects=projects)
+        return self._single_scan_query(from_clause, by_date=True,
+                                       projects=projects)
+
+    def _from_for_date_range(self, start_date, end_date):
+        """
+        Construct a FROM clause for all per-day tables from ``start_date``
+        to ``end_date``, inclusive. Dates without a table are skipped.
+
+        :param start_date: first date to select data for
+        :type start_date: datetime.datetime
+        :param end_date: last date to select data for
+        :type end_date: datetime.datetime
+        :return: BigQuery FROM clause
+        :rtype: str
+        """
+        return "FROM TABLE_DATE_RANGE([%s:%s.downloads], TIMESTAMP('%s'), " \
+            "TIMESTAMP('%s'))" % (
+                self._PROJECT_ID, self._DATASET_ID,
+                start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+            )
+
+    def _query_date_range(self, start_date, end_date, projects=None):
+        """
+        Query for the newest timestamp and all per-project breakdowns, for
+        every day from ``start_date`` to ``end_date`` (inclusive), in a single
+        query grouped by date.
+
+        :param start_date: first date to query
+        :type start_date: datetime.datetime
+        :param end_date: last date to query
+        :type end_date: datetime.datetime
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        :return: dict whose keys are :py:class:`datetime.datetime` dates and
+          values are 2-tuples of (newest timestamp for that date, in
+          microseconds since the epoch, dict of per-project data as returned
+          by :py:meth:`~._query_single_scan` or, in cube mode,
+          :py:meth:`~._query_cube`). Dates with no data are omitted.
         :rtype: dict
         """
-        logger.info('Querying for downloads by distro in table %s', table_name)
-        q = "SELECT file.project, details.distro.name, " \
-            "details.distro.version, COUNT(*) as dl_count " \
-            "%s " \
-            "%s " \
-            "GROUP BY file.project, details.distro.name, " \
-            "details.distro.version;" % (
-                self._from_for_table(table_name),
-                self._where_for_projects
+        logger.info('Querying for all breakdowns from %s to %s',
+                    start_date.strftime('%Y-%m-%d'),
+                    end_date.strftime('%Y-%m-%d'))
+        query = self._range_query(start_date, end_date, projects)
+        if self.cube:
+            res = self._parse_cube(self._run_query(query), projects)
+        else:
+            res = self._parse_single_scan(self._run_query(query), projects)
+        result = {}
+        for date_str, (data_timestamp, data) in res.items():
+            if data_timestamp is None:
+                continue
+            result[datetime.strptime(date_str, '%Y-%m-%d')] = (
+                data_timestamp, data
             )
-        res = self._run_query(q)
-        result = self._dict_for_projects()
-        # iterate through results
-        for row in res:
-            # pointer to the per-project result dict
-            proj = result[row['file_project']]
-            # grab the name and version; change None to 'unknown'
-            dname = row['details_distro_name']
-            dver = row['details_distro_version']
-            if dname not in proj:
-                proj[dname] = {}
-            if dver not in proj[dname]:
-                proj[dname][dver] = 0
-            proj[dname][dver] += int(row['dl_count'])
         return result
 
-    def _query_by_country_code(self, table_name):
+    def _query_per_dimension(self, table_name, projects=None, since_ts=None):
         """
-        Query for download data broken down by country code, for one day.
+        Query for the newest timestamp in the table and all per-project
+        breakdowns, for one day, running one query for the timestamp and one
+        per breakdown (:py:meth:`~._query_dimension`). The breakdown queries
+        only count downloads up to that timestamp, so that rows added to the
+        table while they run are left for the next (incremental) query.
 
         :param table_name: table name to query against
         :type table_name: str
-        :return: dict of download information by country code; keys are project
-          name, values are a dict of country code to download count.
-        :rtype: dict
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        :param since_ts: if not None, only count downloads with a timestamp
+          newer than this (integer microseconds since the epoch)
+        :type since_ts: int
+        :return: 2-tuple of (newest timestamp in the table, in microseconds
+          since the epoch, dict of per-project data; keys are project names,
+          values are dicts of breakdown name to breakdown data as returned by
+          :py:meth:`~._query_dimension`)
+        :rtype: tuple
         """
-        logger.info('Querying for downloads by country code in table %s',
-                    table_name)
-        q = "SELECT file.project, country_code, COUNT(*) as dl_count " \
-            "%s " \
-            "%s " \
-            "GROUP BY file.project, country_code;" % (
-                self._from_for_table(table_name),
-                self._where_for_projects
+        final = self._dict_for_projects(projects)
+        data_timestamp = self._get_newest_ts_in_table(table_name)
+        # data queries
+        # note - ProjectStats._is_empty_cache_record() needs to know keys
+        for name in self._dimensions():
+            tmp = self._query_dimension(
+                table_name, name, projects, since_ts, data_timestamp
             )
-        res = self._run_query(q)
-        result = self._dict_for_projects()
-        for row in res:
-            result[row['file_project']][row['country_code']] = int(
-                row['dl_count'])
-        return result
+            for proj_name in tmp:
+                final[proj_name][name] = tmp[proj_name]
+        return data_timestamp, final
 
-    def query_one_table(self, table_name):
+    def _is_table_not_found(self, exc):
+        """
+        Return True if the specified exception is the backend telling us that
+        the table does not exist, False otherwise.
+
+        :param exc: exception raised while running a query
+        :type exc: Exception
+        :return: whether the error is a "table not found" error
+        :rtype: bool
+        """
+        return self.backend.is_table_not_found(exc)
+
+    def query_one_table(self, table_name, projects=None, table=None):
         """
         Run all queries for the given table name (date) and update the cache.
 
         :param table_name: table name to query against
         :type table_name: str
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        :param table: the table resource, as returned by
+          :py:meth:`~._get_table` *before* querying; if specified, its
+          modification time and row count are stored in the cache records
+          for :py:meth:`~._is_cache_current`
+        :type table: dict
         """
         table_date = self._datetime_for_table_name(table_name)
         logger.info('Running all queries for date table: %s (%s)', table_name,
                     table_date.strftime('%Y-%m-%d'))
-        final = self._dict_for_projects()
+        cached, since_ts = self._incremental_since(table_date, projects)
+        if cached is not None:
+            logger.info('Querying only downloads newer than cached data '
+                        '(timestamp %s usec)', since_ts)
         try:
-            data_timestamp = self._get_newest_ts_in_table(table_name)
-        except HttpError as exc:
-            try:
-                content = json.loads(exc.content.decode('utf-8'))
-                if content['error']['message'].startswith('Not found: Table'):
-                    logger.error("Table %s not found; no data for that day",
-                                 table_name)
-                    return
-            except:
-                pass
+            if self.cube:
+                data_timestamp, final = self._query_cube(
+                    table_name, projects, since_ts
+                )
+            elif self.single_scan:
+                data_timestamp, final = self._query_single_scan(
+                    table_name, projects, since_ts
+                )
+            else:
+                data_timestamp, final = self._query_per_dimension(
+                    table_name, projects, since_ts
+                )
+        except Exception as exc:
+            if self._is_table_not_found(exc):
+                logger.error("Table %s not found; no data for that day",
+                             table_name)
+                return
             raise exc
-        # data queries
-        # note - ProjectStats._is_empty_cache_record() needs to know keys
-        for name, func in {
-            'by_version': self._query_by_version,
-            'by_file_type': self._query_by_file_type,
-            'by_installer': self._query_by_installer,
-            'by_implementation': self._query_by_implementation,
-            'by_system': self._query_by_system,
-            'by_distro': self._query_by_distro,
-            'by_country': self._query_by_country_code
-        }.items():
-            tmp = func(table_name)
-            for proj_name in tmp:
-                final[proj_name][name] = tmp[proj_name]
-        # add to cache
-        for proj_name in final:
-            self.cache.set(proj_name, table_date, final[proj_name],
-                           data_timestamp)
+        if self.sample_rate is not None:
+            self._scale_counts(final)
+        if cached is not None and self.cube:
+            for proj_name in final:
+                final[proj_name]['cube'] = cube.merge(
+                    cached[proj_name]['cube'], final[proj_name]['cube']
+                )
+                final[proj_name].update(
+                    self._cube_breakdowns(final[proj_name]['cube'])
+                )
+        elif cached is not None:
+            for proj_name in final:
+                for name in final[proj_name]:
+                    final[proj_name][name] = self._merge_counts(
+                        cached[proj_name].get(name, {}), final[proj_name][name]
+                    )
+        metadata = {'data_ts_usec': data_timestamp}
+        if table is not None:
+            metadata.update({
+                'table_modified': int(table['lastModifiedTime']),
+                'table_rows': int(table['numRows'])
+            })
+        self._set_cache(
+            table_date, data_timestamp // self._USEC_PER_SEC, final, metadata
+        )
 
-    def _have_cache_for_date(self, dt):
+    def _incremental_since(self, date, projects=None):
         """
-        Return True if we have cached data for all projects for the specified
-        datetime. Return False otherwise.
+        If ``self.incremental`` is set and the cache records for the specified
+        date can be incrementally updated (see :py:meth:`~._cached_records`),
+        return them and the newest timestamp they were queried up to, which
+        the date's queries should only count downloads newer than.
 
-        :param dt: datetime to find cache for
-        :type dt: datetime.datetime
-        :return: True if we have cache for all projects for this date, False
-          otherwise
+        :param date: date to get records for
+        :type date: datetime.datetime
+        :param projects: project names to use instead of ``self.projects``
+        :type projects: ``list``
+        :return: 2-tuple of (dict of project name to cache record, timestamp
+          in microseconds since the epoch), or (None, None)
+        :rtype: tuple
+        """
+        if not self.incremental:
+            return None, None
+        cached = self._cached_records(date, projects)
+        if cached is None:
+            return None, None
+        return cached, list(cached.values())[0]['cache_metadata'][
+            'data_ts_usec']
+
+    def _cached_records(self, date, projects=None):
+        """
+        Return the cache records for all projects for the specified date, if
+        every project has one and they were all queried up to the same newest
+        timestamp (i.e. can all be incrementally updated from that timestamp)
+        and at the same sample rate as this run's queries, for at least the
+        breakdowns this run queries (see :py:meth:`~._record_dimensions`). In
+        cube mode, every record must also have a download count cube of the
+        same columns as this run's. Otherwise, if ``self.top_k`` is set, this
+        always returns None, as the counts of keys that were summed into
+        :py:attr:`~._OTHER_KEY` can't be told apart to merge new counts into.
+
+        :param date: date to get records for
+        :type date: datetime.datetime
+        :param projects: project names to use instead of ``self.projects``
+        :type projects: ``list``
+        :return: dict of project name to cache record, or None
+        :rtype: dict
+        """
+        if self.top_k is not None and not self.cube:
+            logger.debug('Limited breakdowns can only be updated from a '
+                         'download count cube; not querying %s '
+                         'incrementally', date.strftime('%Y-%m-%d'))
+            return None
+        if projects is None:
+            projects = self.projects
+        records = {}
+        for p in projects:
+            rec = self.cache.get(p, date)
+            if (
+                rec is None or
+                rec['cache_metadata'].get('data_ts_usec') is None
+            ):
+                # records from older versions only have data_ts, truncated
+                # to whole seconds
+                return None
+            if rec['cache_metadata'].get('sample_rate') != self.sample_rate:
+                logger.debug('Cached data for %s was sampled at a different '
+                             'rate; not querying incrementally',
+                             date.strftime('%Y-%m-%d'))
+                return None
+            if not set(self._dimensions()).issubset(
+                    self._record_dimensions(rec)):
+                logger.debug('Cached data for %s is missing breakdowns; not '
+                             'querying incrementally',
+                             date.strftime('%Y-%m-%d'))
+                return None
+            if self.cube and (
+                'cube' not in rec or
+                rec['cube']['columns'] != self._query_columns()
+            ):
+                logger.debug('Cached data for %s has no matching download '
+                             'count cube; not querying incrementally',
+                             date.strftime('%Y-%m-%d'))
+                return None
+            records[p] = rec
+        if len(set([
+            r['cache_metadata']['data_ts_usec'] for r in records.values()
+        ])) != 1:
+            logger.debug('Cached data for %s has differing data_ts; not '
+                         'querying incrementally', date.strftime('%Y-%m-%d'))
+            return None
+        return records
+
+    @staticmethod
+    def _merge_counts(cached, delta):
+        """
+        Merge newly-queried download counts into cached ones for one breakdown,
+        returning a new dict. Counts for keys in both are summed; nested
+        (two-column) breakdowns are merged recursively.
+
+        Cached data has been through JSON, which turns ``None`` keys into the
+        string ``null``, so ``None`` keys in ``delta`` are merged into those.
+
+        :param cached: breakdown dict from the cache
+        :type cached: dict
+        :param delta: breakdown dict of newly-queried counts
+        :type delta: dict
+        :return: merged breakdown dict
+        :rtype: dict
+        """
+        result = dict(cached)
+        for k, v in delta.items():
+            if k is None:
+                k = 'null'
+            if isinstance(v, dict):
+                result[k] = DataQuery._merge_counts(result.get(k, {}), v)
+            else:
+                result[k] = result.get(k, 0) + v
+        return result
+
+    def _scale_counts(self, data):
+        """
+        Scale sampled download counts (see ``sample_rate`` in
+        :py:meth:`~.__init__`) up to estimates of the actual counts, in place.
+
+        :param data: dict of per-project data; keys are project names, values
+          are dicts of breakdown name (or ``cube``) to breakdown data
+        :type data: dict
+        """
+
+        def scale(breakdown):
+            for k, v in breakdown.items():
+                if isinstance(v, dict):
+                    scale(v)
+                else:
+                    breakdown[k] = int(round(v / self.sample_rate))
+
+        for proj_data in data.values():
+            for name, breakdown in proj_data.items():
+                if name == 'cube':
+                    for row in breakdown['rows']:
+                        row[-1] = int(round(row[-1] / self.sample_rate))
+                    continue
+                scale(breakdown)
+
+    def _set_cache(self, date, data_timestamp, data, metadata=None):
+        """
+        Write the query results for one date to the cache, in one
+        :py:meth:`~.DiskDataCache.set_many` call. See
+        :py:meth:`~._cache_records`.
+
+        :param date: date the data is for
+        :type date: datetime.datetime
+        :param data_timestamp: newest timestamp in the data for this date
+        :type data_timestamp: int
+        :param data: dict of per-project data; keys are project names, values
+          are dicts of breakdown name to breakdown data
+        :type data: dict
+        :param metadata: additional metadata to store in each cache record
+        :type metadata: dict
+        """
+        self.cache.set_many(
+            self._cache_records(date, data_timestamp, data, metadata)
+        )
+
+    def _cache_records(self, date, data_timestamp, data, metadata=None):
+        """
+        Return the cache records for the query results for one date, as
+        arguments to :py:meth:`~.DiskDataCache.set_many`.
+
+        :param date: date the data is for
+        :type date: datetime.datetime
+        :param data_timestamp: newest timestamp in the data for this date
+        :type data_timestamp: int
+        :param data: dict of per-project data; keys are project names, values
+          are dicts of breakdown name to breakdown data
+        :type data: dict
+        :param metadata: additional metadata to store in each cache record
+        :type metadata: dict
+        :return: list of 5-tuples of (project name, date, data, data_ts,
+          metadata)
+        :rtype: ``list``
+
+        If ``self.dimensions`` is set, the breakdowns that were not queried are
+        copied over from the existing cache record (if any), and the names of
+        those that were are stored in the record's ``dimensions`` metadata
+        (see :py:meth:`~._record_dimensions`).
+        """
+        if self.sample_rate is not None:
+            metadata = dict(metadata or {})
+            metadata.update({
+                'approximate': True, 'sample_rate': self.sample_rate
+            })
+        if self.dimensions is not None:
+            metadata = dict(metadata or {})
+            metadata['dimensions'] = list(self._dimensions().keys())
+        records = []
+        for proj_name in data:
+            proj_data = data[proj_name]
+            if self.dimensions is not None:
+                proj_data = self._keep_other_dimensions(
+                    proj_name, date, proj_data
+                )
+            records.append(
+                (proj_name, date, proj_data, data_timestamp, metadata)
+            )
+        return records
+
+    def _keep_other_dimensions(self, project, date, data):
+        """
+        Return a copy of newly-queried data for one project and date, with the
+        breakdowns that were not queried (see :py:meth:`~._dimensions`) copied
+        from the existing cache record, if there is one. A download count cube
+        is not copied, as it would no longer match the record's data.
+
+        :param project: project name
+        :type project: str
+        :param date: date the data is for
+        :type date: datetime.datetime
+        :param data: dict of breakdown name to breakdown data
+        :type data: dict
+        :return: dict of breakdown name to breakdown data
+        :rtype: dict
+        """
+        rec = self.cache.get(project, date)
+        result = dict(data)
+        if rec is None:
+            return result
+        selected = self._dimensions()
+        for name in self._DIMENSION_COLUMNS:
+            if name not in selected and name in rec:
+                result[name] = rec[name]
+        return result
+
+    def _record_dimensions(self, rec):
+        """
+        Return the names of the breakdowns that a cache record holds data for
+        as of its ``data_ts``, i.e. those in its ``dimensions`` metadata or,
+        for records written without ``dimensions`` set, all of them. Any other
+        breakdowns in the record were kept from earlier queries.
+
+        :param rec: cache record
+        :type rec: dict
+        :return: list of breakdown names
+        :rtype: ``list``
+        """
+        return rec['cache_metadata'].get(
+            'dimensions', list(self._DIMENSION_COLUMNS.keys())
+        )
+
+    def _is_usable_record(self, rec):
+        """
+        Return True if a cache record is at least as accurate as this run's
+        queries would be, i.e. it is exact, or was sampled at a rate no lower
+        than ``self.sample_rate``; approximate records are otherwise queried
+        again (and replaced). Records that lack any of the breakdowns this run
+        queries (see :py:meth:`~._record_dimensions`) are also queried again.
+
+        :param rec: cache record
+        :type rec: dict
+        :return: whether the record can be kept
         :rtype: bool
         """
+        if not set(self._dimensions()).issubset(self._record_dimensions(rec)):
+            return False
+        rate = rec['cache_metadata'].get('sample_rate', None)
+        if rate is None:
+            return True
+        return self.sample_rate is not None and rate >= self.sample_rate
+
+    def _cache_gaps(self, dates):
+        """
+        Build a (project x date) matrix of the cache records that are missing
+        for the specified dates. Records that are less accurate than this
+        run's queries (see :py:meth:`~._is_usable_record`) count as missing.
+
+        :param dates: dates to check the cache for
+        :type dates: ``list``
+        :return: dict of date (:py:class:`datetime.datetime`) to a list of the
+          projects that do not have cached data for that date
+        :rtype: dict
+        """
+        check = set(dates)
+        keys = []
         for p in self.projects:
-            if self.cache.get(p, dt) is None:
-                return False
-        return True
+            for dt in self.cache.get_dates_for_project(p):
+                if dt in check:
+                    keys.append((p, dt))
+        have = {p: set() for p in self.projects}
+        for (p, dt), rec in self.cache.get_many(keys).items():
+            if self._is_usable_record(rec):
+                have[p].add(dt)
+        return {
+            dt: [p for p in self.projects if dt not in have[p]]
+            for dt in dates
+        }
 
     def backfill_history(self, num_days, available_table_names):
         """
@@ -552,6 +1565,28 @@ Resource-class.html>`_
         :param available_table_names: names of available per-date tables
         :type available_table_names: ``list``
         """
+        tables, ranges = self._backfill_plan(num_days, available_table_names)
+        self._run_in_pool(self.query_one_table, tables)
+        self._run_in_pool(self._backfill_date_range, ranges)
+
+    def _backfill_plan(self, num_days, available_table_names):
+        """
+        Determine which days of historical data are missing, for which
+        projects, and how they should be queried. Each query is filtered to
+        only the projects that are missing data for its date(s), so adding one
+        new project to a long list only backfills history for that project.
+
+        :param num_days: number of days of historical data to backfill,
+          if missing
+        :type num_days: int
+        :param available_table_names: names of available per-date tables
+        :type available_table_names: ``list``
+        :return: 2-tuple of (list of 2-tuples of (table name, list of
+          projects) to query one at a time with :py:meth:`~.query_one_table`,
+          list of 3-tuples of (start date, end date, list of projects) to query
+          with :py:meth:`~._backfill_date_range`)
+        :rtype: tuple
+        """
         if num_days == -1:
             # skip the first date, under the assumption that data may be
             # incomplete
@@ -568,16 +1603,198 @@ Resource-class.html>`_
             start_date.strftime('%Y-%m-%d'), end_table,
             end_date.strftime('%Y-%m-%d')
         )
-        for days in range((end_date - start_date).days + 1):
-            backfill_dt = start_date + timedelta(days=days)
-            if self._have_cache_for_date(backfill_dt):
+        available = set(available_table_names)
+        gaps = self._cache_gaps([
+            start_date + timedelta(days=days)
+            for days in range((end_date - start_date).days + 1)
+        ])
+        missing_tables = []
+        missing_dates = []
+        for backfill_dt in sorted(gaps.keys()):
+            projects = gaps[backfill_dt]
+            if len(projects) == 0:
                 logger.info('Cache present for all projects for %s; skipping',
                             backfill_dt.strftime('%Y-%m-%d'))
                 continue
             backfill_table = self._table_name_for_datetime(backfill_dt)
-            logger.info('Backfilling %s (%s)', backfill_table,
-                        backfill_dt.strftime('%Y-%m-%d'))
-            self.query_one_table(backfill_table)
+            if self.backfill_range_days > 1:
+                if backfill_table not in available:
+                    logger.error("Table %s not found; no data for that day",
+                                 backfill_table)
+                    continue
+                missing_dates.append((backfill_dt, projects))
+                continue
+            logger.info('Backfilling %s (%s) for %d project(s)',
+                        backfill_table, backfill_dt.strftime('%Y-%m-%d'),
+                        len(projects))
+            missing_tables.append((backfill_table, projects))
+        return (
+            self._batch_args(missing_tables, 1),
+            self._batch_args(self._date_ranges(missing_dates), 2)
+        )
+
+    def _run_in_pool(self, func, args_list):
+        """
+        Call ``func`` once for each tuple of positional arguments in
+        ``args_list``. If ``self.query_concurrency`` is greater than one, the
+        calls are made from a pool of that many worker threads; otherwise
+        they're made serially, in order.
+
+        Each call is expected to write its own results to the cache, so work
+        finished before an error is kept. If any call raises an exception,
+        no further calls are started and the first exception is re-raised once
+        in-flight calls have finished.
+
+        :param func: function to call
+        :type func: callable
+        :param args_list: list of tuples of positional arguments to ``func``
+        :type args_list: ``list``
+        """
+        if self.query_concurrency < 2 or len(args_list) < 2:
+            for args in args_list:
+                func(*args)
+            return
+        work = Queue()
+        for args in args_list:
+            work.put(args)
+        errors = []
+
+        def worker():
+            while len(errors) == 0:
+                try:
+                    args = work.get_nowait()
+                except Empty:
+                    return
+                try:
+                    func(*args)
+                except Exception as ex:
+                    logger.error('Error in %s%s: %s', func.__name__, args, ex)
+                    errors.append(ex)
+
+        num_threads = min(self.query_concurrency, len(args_list))
+        logger.info('Running %d %s calls in %d worker threads',
+                    len(args_list), func.__name__, num_threads)
+        threads = [
+            threading.Thread(target=worker, name='query-worker-%d' % idx)
+            for idx in range(num_threads)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if len(errors) > 0:
+            raise errors[0]
+
+    def _date_ranges(self, dates):
+        """
+        Group dates into ranges of consecutive dates that are missing data for
+        the same projects, each no longer than ``self.backfill_range_days``
+        days.
+
+        :param dates: sorted list of 2-tuples of (date, list of projects
+          missing data for that date)
+        :type dates: ``list``
+        :return: list of 3-tuples of (first date, last date, list of projects)
+          for each range
+        :rtype: ``list``
+        """
+        ranges = []
+        for dt, projects in dates:
+            if (
+                len(ranges) > 0 and
+                dt - ranges[-1][1] == timedelta(days=1) and
+                (dt - ranges[-1][0]).days < self.backfill_range_days and
+                projects == ranges[-1][2]
+            ):
+                ranges[-1][1] = dt
+                continue
+            ranges.append([dt, dt, projects])
+        return [tuple(x) for x in ranges]
+
+    def _backfill_date_range(self, start_date, end_date, projects=None):
+        """
+        Query all data for a range of dates with one query, and update the
+        cache for each date, in one :py:meth:`~.DiskDataCache.set_many` call.
+
+        :param start_date: first date to backfill
+        :type start_date: datetime.datetime
+        :param end_date: last date to backfill
+        :type end_date: datetime.datetime
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        """
+        logger.info('Backfilling %s to %s', start_date.strftime('%Y-%m-%d'),
+                    end_date.strftime('%Y-%m-%d'))
+        res = self._query_date_range(start_date, end_date, projects)
+        records = []
+        for days in range((end_date - start_date).days + 1):
+            dt = start_date + timedelta(days=days)
+            if dt not in res:
+                logger.error('No data found for %s', dt.strftime('%Y-%m-%d'))
+                continue
+            data_timestamp, data = res[dt]
+            if self.sample_rate is not None:
+                self._scale_counts(data)
+            records.extend(self._cache_records(
+                dt, data_timestamp // self._USEC_PER_SEC, data,
+                {'data_ts_usec': data_timestamp}
+            ))
+        self.cache.set_many(records)
+
+    def _is_cache_current(self, table_name, table):
+        """
+        Return True if every project's cache record for the specified table
+        was queried from the table as it is now, i.e. the table's modification
+        time and row count match those stored in the records by
+        :py:meth:`~.query_one_table`, and no new data has landed since, and
+        the records are accurate enough (see :py:meth:`~._is_usable_record`).
+
+        :param table_name: name of the table
+        :type table_name: str
+        :param table: the table resource, as returned by :py:meth:`~._get_table`
+        :type table: dict
+        :return: whether the cache is current for this table
+        :rtype: bool
+        """
+        table_date = self._datetime_for_table_name(table_name)
+        for p in self.projects:
+            rec = self.cache.get(p, table_date)
+            if rec is None:
+                return False
+            if not self._is_usable_record(rec):
+                return False
+            meta = rec['cache_metadata']
+            if (
+                meta.get('table_modified', None) !=
+                int(table['lastModifiedTime']) or
+                meta.get('table_rows', None) != int(table['numRows'])
+            ):
+                return False
+        return True
+
+    def _tables_to_refresh(self, available_tables):
+        """
+        Determine which of the two newest tables (today and yesterday) need to
+        be queried again, skipping those that have not changed since they were
+        last queried (see :py:meth:`~._is_cache_current`).
+
+        :param available_tables: names of available per-date tables
+        :type available_tables: ``list``
+        :return: list of 2-tuples of (table name, table resource as returned
+          by :py:meth:`~._get_table`) to query
+        :rtype: ``list``
+        """
+        refresh = []
+        for table_name in [available_tables[-1], available_tables[-2]]:
+            table = self._get_table(table_name)
+            if table is not None and self._is_cache_current(table_name, table):
+                logger.info('Table %s unchanged since last queried (modified '
+                            '%s, %s rows); skipping', table_name,
+                            table['lastModifiedTime'], table['numRows'])
+                continue
+            refresh.append((table_name, table))
+        return refresh
 
     def run_queries(self, backfill_num_days=7):
         """
@@ -590,8 +1807,147 @@ Resource-class.html>`_
         available_tables = self._get_download_table_ids()
         logger.debug('Found %d available download tables: %s',
                      len(available_tables), available_tables)
-        today_table = available_tables[-1]
-        yesterday_table = available_tables[-2]
-        self.query_one_table(today_table)
-        self.query_one_table(yesterday_table)
+        refresh = self._tables_to_refresh(available_tables)
+        if self.max_bytes is not None:
+            self._check_budget(backfill_num_days, available_tables, refresh)
+        self._run_in_pool(
+            self.query_one_table,
+            self._batch_args(
+                [(table_name, None, table) for table_name, table in refresh], 1
+            )
+        )
         self.backfill_history(backfill_num_days, available_tables)
+
+    def _queries_for_table(self, table_name, projects=None):
+        """
+        Return the queries that :py:meth:`~.query_one_table` would run for the
+        specified table.
+
+        :param table_name: table name to query against
+        :type table_name: str
+        :param projects: project names to query for, instead of
+          ``self.projects``
+        :type projects: ``list``
+        :return: list of 2-tuples of (description, query)
+        :rtype: ``list``
+        """
+        _, since_ts = self._incremental_since(
+            self._datetime_for_table_name(table_name), projects
+        )
+        if self.cube:
+            return [(
+                'download count cube',
+                self._cube_query(
+                    self._from_for_table(table_name), projects=projects,
+                    since_ts=since_ts
+                )
+            )]
+        if self.single_scan:
+            return [(
+                'all breakdowns',
+                self._single_scan_query(
+                    self._from_for_table(table_name), projects=projects,
+                    since_ts=since_ts
+                )
+            )]
+        queries = [('newest timestamp', self._newest_ts_query(table_name))]
+        for name in self._dimensions():
+            queries.append((name, self._dimension_query(
+                table_name, name, projects, since_ts
+            )))
+        return queries
+
+    def _dry_run_query(self, query):
+        """
+        Dry-run a query (i.e. as a BigQuery dry-run job), which validates the
+        query and returns how many bytes it would process, without running (or
+        billing for) it.
+
+        :param query: the query to dry-run
+        :type query: str
+        :return: number of bytes the query would process, or None if the
+          table it queries does not exist
+        :rtype: int
+        """
+        return self.backend.dry_run_query(query)
+
+    def plan_queries(self, backfill_num_days=7, available_tables=None,
+                     refresh=None):
+        """
+        Determine every query that :py:meth:`~.run_queries` would run (given
+        the current contents of the cache), and use BigQuery dry-run jobs to
+        find how many bytes each would process. Nothing is queried or cached.
+
+        :param backfill_num_days: number of days of historical data to backfill,
+          if missing
+        :type backfill_num_days: int
+        :param available_tables: names of available per-date tables; if None,
+          these will be retrieved with :py:meth:`~._get_download_table_ids`
+        :type available_tables: ``list``
+        :param refresh: the newest tables to query again, as returned by
+          :py:meth:`~._tables_to_refresh`; if None, these will be determined
+          by calling it
+        :type refresh: ``list``
+        :return: list of dicts, one per query, in the order they would be run;
+          each has keys ``target`` (table name or date range queried),
+          ``description``, ``query`` and ``bytes`` (bytes that would be
+          processed, or None if the table does not exist)
+        :rtype: ``list``
+        """
+        if available_tables is None:
+            available_tables = self._get_download_table_ids()
+        if refresh is None:
+            refresh = self._tables_to_refresh(available_tables)
+        tables, ranges = self._backfill_plan(
+            backfill_num_days, available_tables
+        )
+        plan = []
+        for table_name, projects in self._batch_args([
+            (table_name, None) for table_name, _ in refresh
+        ], 1) + tables:
+            for desc, query in self._queries_for_table(table_name, projects):
+                plan.append({
+                    'target': table_name, 'description': desc, 'query': query
+                })
+        for start_date, end_date, projects in ranges:
+            plan.append({
+                'target': '%s to %s' % (
+                    start_date.strftime('%Y-%m-%d'),
+                    end_date.strftime('%Y-%m-%d')
+                ),
+                'description': 'all breakdowns',
+                'query': self._range_query(start_date, end_date, projects)
+            })
+
+        def dry_run(entry):
+            entry['bytes'] = self._dry_run_query(entry['query'])
+
+        self._run_in_pool(dry_run, [(entry, ) for entry in plan])
+        return plan
+
+    def _check_budget(self, backfill_num_days, available_tables, refresh):
+        """
+        Dry-run all queries that :py:meth:`~.run_queries` would run, and raise
+        an exception if they would process more than ``self.max_bytes`` bytes
+        in total.
+
+        :param backfill_num_days: number of days of historical data to backfill,
+          if missing
+        :type backfill_num_days: int
+        :param available_tables: names of available per-date tables
+        :type available_tables: ``list``
+        :param refresh: the newest tables to query again, as returned by
+          :py:meth:`~._tables_to_refresh`
+        :type refresh: ``list``
+        """
+        plan = self.plan_queries(backfill_num_days, available_tables, refresh)
+        total = sum([x['bytes'] for x in plan if x['bytes'] is not None])
+        logger.info('%d queries would process %d bytes (budget: %d bytes)',
+                    len(plan), total, self.max_bytes)
+        if total > self.max_bytes:
+            raise Exception(
+                'ERROR: %d queries would process %d bytes, more than the '
+                'per-run budget of %d bytes' % (
+                    len(plan), total, self.max_bytes
+                )
+            )
@@ -39,31 +39,126 @@ import logging
 import os
 import json
 import re
+import shutil
+import threading
+import uuid
+import zlib
 from datetime import datetime
 import time
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from pypi_download_stats.serializers import SERIALIZERS, get_serializer
 from pypi_download_stats.version import VERSION
 
 logger = logging.getLogger(__name__)
 
 
+class CacheMetadata(dict):
+    """
+    The ``cache_metadata`` dict of a cache record returned by
+    :py:meth:`~.DiskDataCache.get`. It holds the values as stored, and only
+    converts the ``date`` (``YYYYMMDD`` string) and ``updated`` (timestamp)
+    fields to :py:class:`datetime.datetime` objects when they are accessed
+    with ``[]`` or ``get``, since most readers never access them. Comparison,
+    iteration and serialization see the stored values.
+    """
+
+    def __getitem__(self, key):
+        return self._convert(key, super(CacheMetadata, self).__getitem__(key))
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self[key]
+
+    @staticmethod
+    def _convert(key, value):
+        """
+        Convert a stored value of the specified field, if needed.
+
+        :param key: field name
+        :type key: str
+        :param value: stored value
+        :return: converted value
+        """
+        if key == 'date' and not isinstance(value, datetime):
+            return datetime.strptime(value, '%Y%m%d')
+        if key == 'updated' and not isinstance(value, datetime):
+            return datetime.fromtimestamp(value)
+        return value
+
+
 class DiskDataCache(object):
 
-    def __init__(self, cache_path):
+    # name of the directory, in the cache directory, holding the date index
+    # (one manifest file per project); see :py:meth:`~.rebuild_index`
+    _INDEX_DIR = '_index'
+
+    # cache record file name extension suffix for each supported compression,
+    # after the serializer's extension
+    COMPRESSION_EXTENSIONS = {
+        None: '',
+        'gzip': '.gz',
+        'zstd': '.zst'
+    }
+
+    # regex matching cache record file names; groups are project name,
+    # ``YYYYMMDD`` date and extension
+    _RECORD_RE = re.compile(
+        r'^([^_].*)_([0-9]{8})(\.(?:json|msgpack)(?:\.gz|\.zst)?)$'
+    )
+
+    def __init__(self, cache_path, compression=None, serializer='json'):
         """
         Initialize the disk data cache.
 
         :param cache_path: absolute path to the cache directory
         :type cache_path: str
+        :param compression: compression to write cache records with; one of
+          the keys of :py:attr:`~.COMPRESSION_EXTENSIONS` (None for none).
+          Records are read back regardless of how they were compressed.
+        :type compression: str
+        :param serializer: name of the serializer to write cache records with
+          (see :py:data:`~.SERIALIZERS`). Records are read back with a
+          serializer for the file name extension they were written with.
+        :type serializer: str
         """
+        self.serializer = get_serializer(serializer)
+        # file name extension => serializer to read records with
+        self._serializers = {self.serializer.extension: self.serializer}
+        if compression not in self.COMPRESSION_EXTENSIONS:
+            raise Exception('ERROR: unknown cache compression: %s' %
+                            compression)
+        if compression == 'zstd' and zstandard is None:
+            raise Exception('ERROR: zstd cache compression requires '
+                            'zstandard; please "pip install zstandard"')
+        self.compression = compression
         cache_path = os.path.abspath(os.path.expanduser(cache_path))
         if not os.path.exists(cache_path):
             logger.debug('Creating cache directory: %s', cache_path)
             os.makedirs(cache_path)
         logger.info('Initialized DiskDataCache cache_path=%s', cache_path)
         self.cache_path = cache_path
+        self._index_path = os.path.join(cache_path, self._INDEX_DIR)
+        self._index_lock = threading.RLock()
+
+    @property
+    def extension(self):
+        """
+        Return the file name extension that cache records are written with,
+        for ``self.serializer`` and ``self.compression``.
+
+        :return: file name extension
+        :rtype: str
+        """
+        return self.serializer.extension + self.COMPRESSION_EXTENSIONS[
+            self.compression]
 
-    def _path_for_file(self, project_name, date):
+    def _path_for_file(self, project_name, date, extension=None):
         """
         Generate the path on disk for a specified project and date.
 
@@ -71,14 +166,74 @@ class DiskDataCache(object):
         :type project: str
         :param date: the date for the data
         :type date: datetime.datetime
+        :param extension: the file name extension to generate the path for,
+          if not :py:attr:`~.extension`
+        :type extension: str
         :return: path for where to store this data on disk
         :rtype: str
         """
+        if extension is None:
+            extension = self.extension
         return os.path.join(
             self.cache_path,
-            '%s_%s.json' % (project_name, date.strftime('%Y%m%d'))
+            '%s_%s%s' % (project_name, date.strftime('%Y%m%d'), extension)
         )
 
+    def _paths_for_record(self, project_name, date):
+        """
+        Generate every path on disk that a specified project and date's data
+        may be stored at and that we can read (i.e. with any available
+        serializer and compression), beginning with the one for
+        :py:attr:`~.extension`.
+
+        :param project_name: the PyPI project name for the data
+        :type project: str
+        :param date: the date for the data
+        :type date: datetime.datetime
+        :return: list of paths
+        :rtype: ``list``
+        """
+        extensions = set()
+        for cls in SERIALIZERS.values():
+            if self._serializer_for(cls.extension) is None:
+                continue
+            for c, suffix in self.COMPRESSION_EXTENSIONS.items():
+                if c == 'zstd' and zstandard is None:
+                    continue
+                extensions.add(cls.extension + suffix)
+        extensions.discard(self.extension)
+        return [self._path_for_file(project_name, date)] + [
+            self._path_for_file(project_name, date, extension=e)
+            for e in sorted(extensions)
+        ]
+
+    def _read_record(self, project_name, date):
+        """
+        Read a specified project and date's data, as stored (see
+        :py:meth:`~._read_record_file`), however it is serialized and
+        compressed. Returns None if it cannot be read.
+
+        :param project_name: the PyPI project name for the data
+        :type project: str
+        :param date: the date for the data
+        :type date: datetime.datetime
+        :return: the cache record
+        :rtype: :py:obj:`dict` or ``None``
+        """
+        paths = self._paths_for_record(project_name, date)
+        data = self._read_record_file(paths[0])
+        if data is not None:
+            return data
+        # records written with other settings are rare; only open those
+        # that exist
+        for fpath in paths[1:]:
+            if not os.path.exists(fpath):
+                continue
+            data = self._read_record_file(fpath)
+            if data is not None:
+                return data
+        return None
+
     def get(self, project, date):
         """
         Get the cache data for a specified project for the specified date.
@@ -91,37 +246,198 @@ class DiskDataCache(object):
         :return: dict of per-date data for project
         :rtype: :py:obj:`dict` or ``None``
         """
-        fpath = self._path_for_file(project, date)
-        logger.debug('Cache GET project=%s date=%s - path=%s',
-                     project, date.strftime('%Y-%m-%d'), fpath)
-        try:
-            with open(fpath, 'r') as fh:
-                data = json.loads(fh.read())
-        except:
+        logger.debug('Cache GET project=%s date=%s', project,
+                     date.strftime('%Y-%m-%d'))
+        data = self._read_record(project, date)
+        if data is None:
             logger.debug('Error getting from cache for project=%s date=%s',
                          project, date.strftime('%Y-%m-%d'))
             return None
-        data['cache_metadata']['date'] = datetime.strptime(
-            data['cache_metadata']['date'],
-            '%Y%m%d'
-        )
-        data['cache_metadata']['updated'] = datetime.fromtimestamp(
-            data['cache_metadata']['updated']
-        )
+        return self._parse_metadata(data)
+
+    def get_many(self, keys):
+        """
+        Get the cache data for several projects and/or dates at once, using
+        the date index (see :py:meth:`~.get_date_index`), read once per
+        project, to only read the records that exist.
+
+        :param keys: list of 2-tuples of (project name, date), each as the
+          arguments to :py:meth:`~.get`
+        :type keys: ``list``
+        :return: dict of (project name, date) 2-tuple to the cache data for
+          it, as returned by :py:meth:`~.get`, for each of ``keys`` that is
+          found in the cache
+        :rtype: dict
+        """
+        indexes = {}
+        result = {}
+        for project, date in keys:
+            if project not in indexes:
+                indexes[project] = self.get_date_index(project)
+            if date not in indexes[project]:
+                continue
+            data = self.get(project, date)
+            if data is not None:
+                result[(project, date)] = data
+        return result
+
+    def get_range(self, project, start_date, end_date):
+        """
+        Get the cache data for a specified project for every date in a range
+        (inclusive) that we have in cache, using the date index (see
+        :py:meth:`~.get_date_index`) to find them.
+
+        :param project: PyPi project name to get data for
+        :type project: str
+        :param start_date: first date to get data for
+        :type start_date: datetime.datetime
+        :param end_date: last date to get data for
+        :type end_date: datetime.datetime
+        :return: dict of date to the cache data for it, as returned by
+          :py:meth:`~.get`
+        :rtype: dict
+        """
+        dates = [
+            d for d in self.get_dates_for_project(project)
+            if start_date <= d <= end_date
+        ]
+        result = {}
+        for d in dates:
+            data = self.get(project, d)
+            if data is not None:
+                result[d] = data
+        return result
+
+    @staticmethod
+    def _read(fpath):
+        """
+        Read and deserialize one JSON file. Returns None if it cannot be read.
+
+        :param fpath: path to the file
+        :type fpath: str
+        :return: file contents
+        :rtype: :py:obj:`dict` or ``None``
+        """
+        try:
+            with open(fpath, 'r') as fh:
+                return json.loads(fh.read())
+        except Exception:
+            return None
+
+    def _serializer_for(self, extension):
+        """
+        Return the serializer to read records with the specified file name
+        extension (without any compression extension) with, or None if there
+        is none or its dependency is not installed.
+
+        :param extension: file name extension, i.e. ``.json``
+        :type extension: str
+        :return: serializer instance
+        :rtype: :py:class:`~.JSONSerializer` or ``None``
+        """
+        if extension not in self._serializers:
+            # the first serializer for the extension, i.e. json for .json
+            names = [
+                n for n, cls in SERIALIZERS.items()
+                if cls.extension == extension
+            ]
+            serializer = None
+            if len(names) > 0:
+                try:
+                    serializer = get_serializer(names[0])
+                except Exception as ex:
+                    logger.debug('Cannot read %s cache records: %s',
+                                 extension, ex)
+            self._serializers[extension] = serializer
+        return self._serializers[extension]
+
+    def _read_record_file(self, fpath):
+        """
+        Read one cache record file, as stored (i.e. without converting its
+        ``cache_metadata``), decompressing and deserializing it according to
+        its extension. Returns None if it cannot be read, including if the
+        serializer or compression it was written with is not available.
+
+        :param fpath: path to the file
+        :type fpath: str
+        :return: the cache record
+        :rtype: :py:obj:`dict` or ``None``
+        """
+        base, ext = os.path.splitext(fpath)
+        compression = None
+        for c, suffix in self.COMPRESSION_EXTENSIONS.items():
+            if c is not None and ext == suffix:
+                compression = c
+                base, ext = os.path.splitext(base)
+        serializer = self._serializer_for(ext)
+        if serializer is None or (
+            compression == 'zstd' and zstandard is None
+        ):
+            return None
+        try:
+            with open(fpath, 'rb') as fh:
+                raw = fh.read()
+            if compression == 'gzip':
+                raw = zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+            elif compression == 'zstd':
+                raw = zstandard.ZstdDecompressor().decompress(raw)
+            return serializer.loads(raw)
+        except Exception:
+            return None
+
+    def _write_record_file(self, fpath, data):
+        """
+        Serialize a cache record with ``self.serializer`` and write it to
+        ``fpath``, compressed with ``self.compression``.
+
+        :param fpath: path to the file
+        :type fpath: str
+        :param data: cache record
+        :type data: dict
+        """
+        raw = self.serializer.dumps(data)
+        if self.compression == 'gzip':
+            c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            raw = c.compress(raw) + c.flush()
+        elif self.compression == 'zstd':
+            raw = zstandard.ZstdCompressor().compress(raw)
+        with open(fpath, 'wb') as fh:
+            fh.write(raw)
+
+    @staticmethod
+    def _parse_metadata(data):
+        """
+        Wrap a stored record's ``cache_metadata`` in a
+        :py:class:`~.CacheMetadata`, which converts its ``date`` and
+        ``updated`` fields to :py:class:`datetime.datetime` objects when they
+        are accessed, in place.
+
+        :param data: cache record, as stored
+        :type data: dict
+        :return: the cache record
+        :rtype: dict
+        """
+        data['cache_metadata'] = CacheMetadata(data['cache_metadata'])
         return data
 
-    def set(self, project, date, data, data_ts):
+    @staticmethod
+    def _add_metadata(project, date, data, data_ts, metadata=None):
         """
-        Set the cache data for a specified project for the specified date.
+        Set the ``cache_metadata`` of a record to be stored, in place.
 
-        :param project: project name to set data for
+        :param project: project name the data is for
         :type project: str
-        :param date: date to set data for
+        :param date: date the data is for
         :type date: datetime.datetime
         :param data: data to cache
         :type data: dict
         :param data_ts: maximum timestamp in the BigQuery data table
         :type data_ts: int
+        :param metadata: additional metadata to store in the record's
+          ``cache_metadata`` dict
+        :type metadata: dict
+        :return: the cache record
+        :rtype: dict
         """
         data['cache_metadata'] = {
             'project': project,
@@ -130,29 +446,340 @@ class DiskDataCache(object):
             'version': VERSION,
             'data_ts': data_ts
         }
-        fpath = self._path_for_file(project, date)
-        logger.debug('Cache SET project=%s date=%s - path=%s',
-                     project, date.strftime('%Y-%m-%d'), fpath)
+        if metadata is not None:
+            data['cache_metadata'].update(metadata)
+        return data
+
+    def set(self, project, date, data, data_ts, metadata=None):
+        """
+        Set the cache data for a specified project for the specified date.
+
+        :param project: project name to set data for
+        :type project: str
+        :param date: date to set data for
+        :type date: datetime.datetime
+        :param data: data to cache
+        :type data: dict
+        :param data_ts: maximum timestamp in the BigQuery data table
+        :type data_ts: int
+        :param metadata: additional metadata to store in the record's
+          ``cache_metadata`` dict
+        :type metadata: dict
+        """
+        self.set_many([(project, date, data, data_ts, metadata)])
+
+    def set_many(self, records):
+        """
+        Set the cache data for several projects and/or dates at once. Each
+        record is written to its own file, as with :py:meth:`~.set`, and then
+        the date index (see :py:meth:`~.get_date_index`) is updated once per
+        project.
+
+        :param records: list of 5-tuples of (project name, date, data,
+          data_ts, metadata), each as the arguments to :py:meth:`~.set`
+        :type records: ``list``
+        """
+        entries = {}
+        for project, date, data, data_ts, metadata in records:
+            self._add_metadata(project, date, data, data_ts, metadata)
+            paths = self._paths_for_record(project, date)
+            logger.debug('Cache SET project=%s date=%s - path=%s',
+                         project, date.strftime('%Y-%m-%d'), paths[0])
+            self._write_record_file(paths[0], data)
+            # remove any copy stored with a different compression
+            for fpath in paths[1:]:
+                if os.path.exists(fpath):
+                    os.remove(fpath)
+            entries.setdefault(project, {})[
+                date.strftime('%Y%m%d')] = self._index_entry(data)
+        self._update_index(entries)
+
+    def _path_for_state(self, name):
+        """
+        Generate the path on disk for a named piece of non-project state.
+        State file names begin with an underscore, which PyPI project names
+        cannot, so they never collide with per-project data files.
+
+        :param name: state name
+        :type name: str
+        :return: path for where to store this state on disk
+        :rtype: str
+        """
+        return os.path.join(self.cache_path, '_%s.json' % name)
+
+    def get_state(self, name):
+        """
+        Get a named piece of non-project state (such as the BigQuery table
+        listing) persisted alongside the cached data. Returns None if the
+        state cannot be found.
+
+        :param name: state name
+        :type name: str
+        :return: the JSON-serializable state that was stored
+        :rtype: object
+        """
+        fpath = self._path_for_state(name)
+        logger.debug('Cache GET state %s - path=%s', name, fpath)
+        data = self._read(fpath)
+        if data is None:
+            logger.debug('Error getting state %s from cache', name)
+        return data
+
+    def set_state(self, name, data):
+        """
+        Set a named piece of non-project state, persisted alongside the cached
+        data.
+
+        :param name: state name
+        :type name: str
+        :param data: JSON-serializable state to store
+        :type data: object
+        """
+        fpath = self._path_for_state(name)
+        logger.debug('Cache SET state %s - path=%s', name, fpath)
         with open(fpath, 'w') as fh:
             fh.write(json.dumps(data))
 
+    @staticmethod
+    def _index_entry(data):
+        """
+        Return the date index entry for a cache record.
+
+        :param data: cache record, as stored
+        :type data: dict
+        :return: dict with the record's ``data_ts`` and whether it is
+          ``empty``, i.e. has no downloads in any breakdown
+        :rtype: dict
+        """
+        return {
+            'data_ts': data['cache_metadata']['data_ts'],
+            'empty': not any(
+                len(v) > 0 for k, v in data.items()
+                if k.startswith('by_') and isinstance(v, dict)
+            )
+        }
+
+    def _path_for_index(self, project_name, index_path=None):
+        """
+        Generate the path on disk for a project's date index manifest.
+
+        :param project_name: the PyPI project name
+        :type project_name: str
+        :param index_path: index directory, if not the default
+        :type index_path: str
+        :return: path to the manifest
+        :rtype: str
+        """
+        if index_path is None:
+            index_path = self._index_path
+        return os.path.join(index_path, '%s.json' % project_name)
+
+    @staticmethod
+    def _write_json(fpath, data):
+        """
+        Serialize ``data`` to JSON and write it to ``fpath``, via a temporary
+        file and rename so that readers never see a partial file.
+
+        :param fpath: path to write to
+        :type fpath: str
+        :param data: JSON-serializable data
+        :type data: object
+        """
+        tmp_path = '%s.%s.tmp' % (fpath, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as fh:
+            fh.write(json.dumps(data, sort_keys=True))
+        os.rename(tmp_path, fpath)
+
+    def _ensure_index(self):
+        """
+        Build the date index (see :py:meth:`~.rebuild_index`) if the cache
+        directory does not have one yet, i.e. it was written by an older
+        version.
+        """
+        with self._index_lock:
+            if os.path.isdir(self._index_path):
+                return
+            logger.info('Cache directory %s has no date index; building it',
+                        self.cache_path)
+            self.rebuild_index()
+
+    def _update_index(self, entries):
+        """
+        Add entries to the date index, rewriting each project's manifest once.
+
+        :param entries: dict of project name to dict of ``YYYYMMDD`` date
+          string to index entry (see :py:meth:`~._index_entry`)
+        :type entries: dict
+        """
+        self._ensure_index()
+        with self._index_lock:
+            for project, new in entries.items():
+                manifest = self._read(self._path_for_index(project))
+                if manifest is None:
+                    manifest = {}
+                manifest.update(new)
+                self._write_json(self._path_for_index(project), manifest)
+
+    def get_date_index(self, project):
+        """
+        Return the date index entries for the specified project: the dates we
+        have in cache for it, and the ``data_ts`` and whether each record is
+        ``empty`` (has no downloads in any breakdown), without reading the
+        records themselves.
+
+        The index is one manifest file per project, updated by
+        :py:meth:`~.set_many`; if the cache files are changed by other means,
+        run :py:meth:`~.rebuild_index`.
+
+        :param project: project name
+        :type project: str
+        :return: dict of :py:class:`datetime.datetime` date to dict with
+          ``data_ts`` and ``empty`` keys
+        :rtype: dict
+        """
+        self._ensure_index()
+        manifest = self._read(self._path_for_index(project))
+        if manifest is None:
+            return {}
+        return {
+            datetime.strptime(k, '%Y%m%d'): v for k, v in manifest.items()
+        }
+
     def get_dates_for_project(self, project):
         """
         Return a list of the dates we have in cache for the specified project,
-        sorted in ascending date order.
+        sorted in ascending date order, from the date index (see
+        :py:meth:`~.get_date_index`).
 
         :param project: project name
         :type project: str
         :return: list of datetime.datetime objects
         :rtype: datetime.datetime
         """
-        file_re = re.compile(r'^%s_([0-9]{8})\.json$' % project)
-        all_dates = []
+        return sorted(self.get_date_index(project).keys())
+
+    def get_all_dates(self):
+        """
+        Return the dates we have in cache for every project, from the date
+        index (see :py:meth:`~.get_date_index`).
+
+        :return: dict of project name to list of datetime.datetime objects,
+          sorted in ascending date order
+        :rtype: dict
+        """
+        self._ensure_index()
+        result = {}
+        for f in os.listdir(self._index_path):
+            if not f.endswith('.json'):
+                continue
+            dates = self.get_dates_for_project(f[:-5])
+            if len(dates) > 0:
+                result[f[:-5]] = dates
+        return result
+
+    def rebuild_index(self):
+        """
+        Rebuild the date index (see :py:meth:`~.get_date_index`) from the
+        cache files, listing the cache directory once and reading every
+        record. The new index is built in a temporary directory and then
+        swapped in place of the old one. Unreadable files are left out of the
+        index, with a warning.
+
+        :return: number of records indexed
+        :rtype: int
+        """
+        manifests = {}
         for f in os.listdir(self.cache_path):
-            if not os.path.isfile(os.path.join(self.cache_path, f)):
+            m = self._RECORD_RE.match(f)
+            if m is None:
+                continue
+            fpath = os.path.join(self.cache_path, f)
+            if not os.path.isfile(fpath):
                 continue
+            data = self._read_record_file(fpath)
+            if data is None:
+                logger.warning('Could not read cache file %s; not indexing '
+                               'it', fpath)
+                continue
+            manifests.setdefault(m.group(1), {})[
+                m.group(2)] = self._index_entry(data)
+        tmp_path = '%s.%s.tmp' % (self._index_path, uuid.uuid4().hex)
+        os.makedirs(tmp_path)
+        for project, manifest in manifests.items():
+            self._write_json(self._path_for_index(project, tmp_path), manifest)
+        with self._index_lock:
+            old_path = None
+            if os.path.isdir(self._index_path):
+                old_path = '%s.%s.old' % (self._index_path, uuid.uuid4().hex)
+                os.rename(self._index_path, old_path)
+            os.rename(tmp_path, self._index_path)
+            if old_path is not None:
+                shutil.rmtree(old_path)
+        count = sum([len(m) for m in manifests.values()])
+        logger.info('Indexed %d cache record(s) for %d project(s) in %s',
+                    count, len(manifests), self.cache_path)
+        return count
+
+    def get_state_names(self):
+        """
+        Return the names of all of the non-project state stored in the cache
+        (see :py:meth:`~.set_state`).
+
+        :return: sorted list of state names
+        :rtype: ``list``
+        """
+        file_re = re.compile(r'^_(.+)\.json$')
+        names = []
+        for f in os.listdir(self.cache_path):
             m = file_re.match(f)
             if m is None:
                 continue
-            all_dates.append(datetime.strptime(m.group(1), '%Y%m%d'))
-        return sorted(all_dates)
+            if not os.path.isfile(os.path.join(self.cache_path, f)):
+                continue
+            names.append(m.group(1))
+        return sorted(names)
+
+    def recompress(self):
+        """
+        Rewrite every cache record that is not stored with
+        ``self.serializer`` and ``self.compression`` (i.e. that was written
+        with different settings) with them, removing the original files. If
+        a record is stored in more than one way, only the most recently
+        updated copy is kept. Unreadable files are left in place,
+        with a warning.
+
+        :return: number of records rewritten
+        :rtype: int
+        """
+        ext = self.extension
+        count = 0
+        for f in sorted(os.listdir(self.cache_path)):
+            m = self._RECORD_RE.match(f)
+            if m is None or m.group(3) == ext:
+                continue
+            fpath = os.path.join(self.cache_path, f)
+            data = self._read_record_file(fpath)
+            if data is None:
+                logger.warning('Could not read cache file %s; not '
+                               'recompressing it', fpath)
+                continue
+            dest = self._path_for_file(
+                m.group(1), datetime.strptime(m.group(2), '%Y%m%d')
+            )
+            existing = self._read_record_file(dest)
+            if existing is not None and (
+                existing['cache_metadata']['updated'] >=
+                data['cache_metadata']['updated']
+            ):
+                # already stored with these settings; the other copy is
+                # older
+                os.remove(fpath)
+                continue
+            tmp_path = '%s.%s.tmp' % (dest, uuid.uuid4().hex)
+            self._write_record_file(tmp_path, data)
+            os.rename(tmp_path, dest)
+            os.remove(fpath)
+            count += 1
+        logger.info('Recompressed %d cache record(s) in %s', count,
+                    self.cache_path)
+        return count
@@ -0,0 +1,721 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import sys
+import argparse
+import csv
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+from calendar import timegm
+from datetime import datetime, timedelta
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+from pypi_download_stats.dataquery import DataQuery
+from pypi_download_stats.arrowdatacache import ArrowDataCache
+from pypi_download_stats.diskdatacache import DiskDataCache
+from pypi_download_stats.serializers import SERIALIZERS
+from pypi_download_stats.sqlitedatacache import SQLiteDataCache
+from pypi_download_stats.version import PROJECT_URL, VERSION
+
+logger = logging.getLogger(__name__)
+
+#: file name suffixes (after removing any ``.gz``) for each supported format
+FORMAT_SUFFIXES = {
+    '.json': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.ndjson': 'ndjson',
+    '.csv': 'csv',
+    '.parquet': 'parquet'
+}
+
+#: default size of the byte ranges that large uncompressed text files are
+#: split into, to be aggregated in parallel
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+#: default number of days that aggregated results may span before they are
+#: written to the cache
+DEFAULT_FLUSH_DAYS = 7
+
+# number of Parquet rows to read into memory at once
+_PARQUET_BATCH_SIZE = 65536
+
+
+def _get_field(event, name):
+    """
+    Get a (possibly nested, i.e. ``details.installer.name``) field from a
+    download event. Events may be nested dicts, as in BigQuery JSON exports,
+    or flat dicts keyed by the dotted field name, as in CSV exports.
+
+    :param event: download event
+    :type event: dict
+    :param name: field name
+    :type name: str
+    :return: field value, or None if not present
+    """
+    if name in event:
+        return event[name]
+    val = event
+    for part in name.split('.'):
+        if not isinstance(val, dict):
+            return None
+        val = val.get(part, None)
+    return val
+
+
+def _parse_timestamp(val):
+    """
+    Parse a download event timestamp into integer seconds since the epoch.
+    Accepts numeric epoch seconds, :py:class:`datetime.datetime` objects
+    (naive ones are assumed to be UTC) and strings such as BigQuery's
+    ``2016-08-22 13:45:12.123456 UTC`` or ISO 8601 ``2016-08-22T13:45:12Z``.
+
+    :param val: timestamp value
+    :return: seconds since the epoch
+    :rtype: int
+    """
+    if isinstance(val, datetime):
+        return timegm(val.utctimetuple())
+    if isinstance(val, (int, float)):
+        return int(val)
+    s = val.strip()
+    if len(s) > 10 and s[10] == 'T':
+        s = s[:10] + ' ' + s[11:]
+    for suffix in [' UTC', 'Z', '+00:00', '+0000']:
+        if s.endswith(suffix):
+            s = s[:-len(suffix)]
+    try:
+        return int(float(s))
+    except ValueError:
+        pass
+    return timegm(
+        datetime.strptime(s.split('.')[0], '%Y-%m-%d %H:%M:%S').timetuple()
+    )
+
+
+def _decode(line):
+    """
+    Return a line read from a file opened in binary mode as a native string.
+    """
+    if not isinstance(line, str):
+        line = line.decode('utf-8')
+    return line
+
+
+def _read_lines(path, start=None, end=None):
+    """
+    Generate the lines of a (possibly gzipped) text file. If ``start`` and
+    ``end`` are specified, only generate the lines that begin within that
+    byte range of the (uncompressed) file.
+
+    :param path: path to the file
+    :type path: str
+    :param start: byte offset of the start of the range
+    :type start: int
+    :param end: byte offset of the end of the range
+    :type end: int
+    :return: generator of lines
+    :rtype: ``generator``
+    """
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as fh:
+            for line in fh:
+                yield _decode(line)
+        return
+    with open(path, 'rb') as fh:
+        if start is None:
+            for line in fh:
+                yield _decode(line)
+            return
+        if start > 0:
+            # skip the partial line; it belongs to the previous range
+            fh.seek(start - 1)
+            fh.readline()
+        while fh.tell() < end:
+            line = fh.readline()
+            if not line:
+                break
+            yield _decode(line)
+
+
+def _iter_ndjson(path, start=None, end=None):
+    """
+    Generate download events from a newline-delimited JSON file.
+
+    :param path: path to the file
+    :type path: str
+    :param start: byte offset of the start of the range to read, if any
+    :type start: int
+    :param end: byte offset of the end of the range to read, if any
+    :type end: int
+    :return: generator of event dicts
+    :rtype: ``generator``
+    """
+    for line in _read_lines(path, start, end):
+        if line.strip() == '':
+            continue
+        yield json.loads(line)
+
+
+def _iter_csv(path, start=None, end=None):
+    """
+    Generate download events from a CSV file with a header row naming each
+    column (i.e. ``file.project``). Empty values are treated as NULL.
+
+    :param path: path to the file
+    :type path: str
+    :param start: byte offset of the start of the range to read, if any
+    :type start: int
+    :param end: byte offset of the end of the range to read, if any
+    :type end: int
+    :return: generator of event dicts
+    :rtype: ``generator``
+    """
+    lines = _read_lines(path)
+    header = next(csv.reader(lines), None)
+    lines.close()
+    if header is None:
+        return
+    lines = _read_lines(path, start, end)
+    if not start:
+        # skip the header row
+        next(lines)
+    for row in csv.reader(lines):
+        yield {k: (v if v != '' else None) for k, v in zip(header, row)}
+
+
+def _iter_parquet(path, row_group=None):
+    """
+    Generate download events from a Parquet file, one batch of rows at a time.
+
+    :param path: path to the file
+    :type path: str
+    :param row_group: if not None, only read this row group
+    :type row_group: int
+    :return: generator of event dicts
+    :rtype: ``generator``
+    """
+    if pq is None:
+        raise Exception('ERROR: reading Parquet files requires pyarrow; '
+                        'please "pip install pyarrow"')
+    pf = pq.ParquetFile(path)
+    groups = None
+    if row_group is not None:
+        groups = [row_group]
+    for batch in pf.iter_batches(batch_size=_PARQUET_BATCH_SIZE,
+                                 row_groups=groups):
+        for event in batch.to_pylist():
+            yield event
+
+
+def _file_format(path):
+    """
+    Return the format of a download event file, based on its name.
+
+    :param path: path to the file
+    :type path: str
+    :return: format name (one of the values of :py:data:`~.FORMAT_SUFFIXES`)
+      or None if not a supported file
+    :rtype: str
+    """
+    name = path
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return FORMAT_SUFFIXES.get(os.path.splitext(name)[1].lower(), None)
+
+
+def find_files(paths):
+    """
+    Find all supported download event files in the specified paths, which may
+    be files or directories (searched recursively).
+
+    :param paths: list of file or directory paths
+    :type paths: ``list``
+    :return: sorted list of file paths
+    :rtype: ``list``
+    """
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for dirpath, _, filenames in os.walk(path):
+            for fname in filenames:
+                fpath = os.path.join(dirpath, fname)
+                if _file_format(fpath) is not None:
+                    files.append(fpath)
+    return sorted(files)
+
+
+def plan_tasks(files, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Split download event files into units of work that can be aggregated
+    independently: byte ranges of at most ``chunk_size`` bytes for
+    uncompressed NDJSON and CSV files, row groups for Parquet files, and
+    whole files for gzipped files.
+
+    :param files: list of file paths
+    :type files: ``list``
+    :param chunk_size: maximum size of each byte range
+    :type chunk_size: int
+    :return: list of 3-tuples of (path, format, part), where part is None (the
+      whole file), a 2-tuple of (start, end) byte offsets, or a Parquet row
+      group index
+    :rtype: ``list``
+    """
+    tasks = []
+    for path in files:
+        fmt = _file_format(path)
+        if fmt is None:
+            raise Exception('ERROR: unsupported file type: %s' % path)
+        if fmt == 'parquet':
+            if pq is None:
+                tasks.append((path, fmt, None))
+                continue
+            for idx in range(pq.ParquetFile(path).num_row_groups):
+                tasks.append((path, fmt, idx))
+            continue
+        if path.endswith('.gz'):
+            tasks.append((path, fmt, None))
+            continue
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), chunk_size):
+            tasks.append((path, fmt, (start, min(start + chunk_size, size))))
+    return tasks
+
+
+class DownloadAggregator(object):
+    """
+    Aggregate download events into the same per-project, per-day data that
+    :py:meth:`~.DataQuery.query_one_table` caches, in memory proportional to
+    the number of distinct values rather than the number of events.
+    """
+
+    def __init__(self, projects=None):
+        """
+        :param projects: if not None, only count downloads of these projects
+        :type projects: ``list``
+        """
+        self.projects = None
+        if projects is not None:
+            self.projects = set(projects)
+        self._dimensions = list(DataQuery._DIMENSION_COLUMNS.items())
+        #: dict of day number (days since the epoch) to a dict with keys
+        #: ``data_ts`` (newest timestamp that day) and ``projects`` (dict of
+        #: project name to dict of breakdown name to breakdown data)
+        self.days = {}
+
+    def add(self, event):
+        """
+        Count one download event.
+
+        :param event: download event
+        :type event: dict
+        """
+        ts = _parse_timestamp(_get_field(event, 'timestamp'))
+        day = ts // 86400
+        if day not in self.days:
+            self.days[day] = {'data_ts': ts, 'projects': {}}
+        day_data = self.days[day]
+        # like DataQuery, the timestamp is the newest of *all* downloads
+        if ts > day_data['data_ts']:
+            day_data['data_ts'] = ts
+        project = _get_field(event, 'file.project')
+        if project is None:
+            return
+        if self.projects is not None and project not in self.projects:
+            return
+        if project not in day_data['projects']:
+            day_data['projects'][project] = {
+                name: {} for name, _ in self._dimensions
+            }
+        proj_data = day_data['projects'][project]
+        for name, columns in self._dimensions:
+            # JSON turns None keys into "null"; use that directly so that
+            # merged results never have both
+            keys = []
+            for col in columns:
+                val = _get_field(event, col)
+                keys.append('null' if val is None else val)
+            d = proj_data[name]
+            if len(keys) == 2:
+                if keys[0] not in d:
+                    d[keys[0]] = {}
+                d = d[keys[0]]
+            d[keys[-1]] = d.get(keys[-1], 0) + 1
+
+    def merge(self, days):
+        """
+        Merge the results of another aggregator (its ``days`` attribute) into
+        this one.
+
+        :param days: another aggregator's ``days`` attribute
+        :type days: dict
+        """
+        for day, other in days.items():
+            if day not in self.days:
+                self.days[day] = other
+                continue
+            mine = self.days[day]
+            mine['data_ts'] = max(mine['data_ts'], other['data_ts'])
+            for project, proj_data in other['projects'].items():
+                if project not in mine['projects']:
+                    mine['projects'][project] = proj_data
+                    continue
+                for name, breakdown in proj_data.items():
+                    mine['projects'][project][name] = DataQuery._merge_counts(
+                        mine['projects'][project][name], breakdown
+                    )
+
+
+def aggregate_task(task, projects=None):
+    """
+    Aggregate the download events in one unit of work, as returned by
+    :py:func:`~.plan_tasks`.
+
+    :param task: 3-tuple of (path, format, part)
+    :type task: tuple
+    :param projects: if not None, only count downloads of these projects
+    :type projects: ``list``
+    :return: the aggregator's ``days`` attribute
+    :rtype: dict
+    """
+    path, fmt, part = task
+    if fmt == 'parquet':
+        events = _iter_parquet(path, part)
+    else:
+        start = end = None
+        if part is not None:
+            start, end = part
+        if fmt == 'csv':
+            events = _iter_csv(path, start, end)
+        else:
+            events = _iter_ndjson(path, start, end)
+    agg = DownloadAggregator(projects)
+    count = 0
+    for event in events:
+        agg.add(event)
+        count += 1
+    logger.debug('Aggregated %d events from %s %s', count, path, part)
+    return agg.days
+
+
+def _aggregate_task_star(args):
+    """
+    Call :py:func:`~.aggregate_task` with a tuple of arguments, for
+    :py:meth:`multiprocessing.pool.Pool.imap_unordered`.
+    """
+    return aggregate_task(*args)
+
+
+def ingest(paths, cache, projects=None, jobs=None,
+           chunk_size=DEFAULT_CHUNK_SIZE, merge=False,
+           flush_days=DEFAULT_FLUSH_DAYS):
+    """
+    Aggregate all download events in the specified files or directories,
+    using a pool of ``jobs`` worker processes, and write the resulting
+    per-project, per-day records to the cache. Each worker streams its part
+    of a file, so memory use does not depend on file size; and whenever the
+    results aggregated so far span ``flush_days`` days or more, they are
+    written to the cache (see :py:func:`~._write_days`) and dropped, so it
+    does not grow with the number of days either, and an interrupted run
+    keeps what it has written.
+
+    If ``projects`` is specified, records are written for each of those
+    projects for every day with downloads (as :py:class:`~.DataQuery` does);
+    otherwise, for every project found in the days written at once.
+
+    Unless ``merge`` is True, the records written replace any cached records
+    for the same project and day, so all of the files for a day must be
+    ingested in one run (a day written more than once by one run is merged
+    with what that run already wrote). With ``merge``, the counts are added to
+    those of the cached records instead (see :py:func:`~._merge_cached`), so
+    that a day can be ingested over several runs; ingesting the same file
+    twice then counts its downloads twice.
+
+    :param paths: list of file or directory paths
+    :type paths: ``list``
+    :param cache: cache to write records to
+    :type cache: :py:class:`~.DiskDataCache`
+    :param projects: if not None, only count downloads of these projects
+    :type projects: ``list``
+    :param jobs: number of worker processes; defaults to the number of CPUs.
+      If 1, everything is aggregated in this process.
+    :type jobs: int
+    :param chunk_size: maximum size of the byte ranges that large uncompressed
+      text files are split into
+    :type chunk_size: int
+    :param merge: whether to add the counts to those of existing cached
+      records, instead of replacing them
+    :type merge: bool
+    :param flush_days: write the aggregated results to the cache whenever
+      they span at least this many days
+    :type flush_days: int
+    :return: sorted list of the dates (:py:class:`datetime.datetime`)
+      written to the cache
+    :rtype: ``list``
+    """
+    tasks = plan_tasks(find_files(paths), chunk_size)
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    logger.info('Aggregating %d parts of %d files with %d process(es)',
+                len(tasks), len(set([t[0] for t in tasks])), jobs)
+    result = DownloadAggregator(projects)
+    written = set()
+    args = [(t, projects) for t in tasks]
+    pool = None
+    if jobs < 2 or len(tasks) < 2:
+        results = (_aggregate_task_star(a) for a in args)
+    else:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap_unordered(_aggregate_task_star, args)
+    try:
+        for days in results:
+            result.merge(days)
+            if len(result.days) >= flush_days:
+                _write_days(cache, result.days, projects, merge, written)
+                result.days = {}
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    _write_days(cache, result.days, projects, merge, written)
+    logger.info('Wrote %d days of data to cache', len(written))
+    return sorted(written)
+
+
+def _write_days(cache, days, projects=None, merge=False, written=None):
+    """
+    Write the per-project records for days of aggregated download counts to
+    the cache, in one :py:meth:`~.DiskDataCache.set_many` call.
+
+    :param cache: cache to write records to
+    :type cache: :py:class:`~.DiskDataCache`
+    :param days: a :py:class:`~.DownloadAggregator`'s ``days`` attribute
+    :type days: dict
+    :param projects: if not None, write a record for each of these projects
+      for every day; otherwise, for every project found in ``days``
+    :type projects: ``list``
+    :param merge: whether to add the counts to those of existing cached
+      records (see :py:func:`~._merge_cached`), instead of replacing them
+    :type merge: bool
+    :param written: if not None, a set of the dates that were already written
+      (and are merged with the cached records, as with ``merge``); the dates
+      written are added to it
+    :type written: set
+    """
+    if len(days) == 0:
+        return
+    if written is None:
+        written = set()
+    if projects is None:
+        projects = set()
+        for day_data in days.values():
+            projects.update(day_data['projects'].keys())
+        projects = sorted(projects)
+    records = []
+    for day in sorted(days.keys()):
+        dt = datetime(1970, 1, 1) + timedelta(days=day)
+        day_data = days[day]
+        for project in projects:
+            data = day_data['projects'].get(project, None)
+            if data is None:
+                data = {name: {} for name in DataQuery._DIMENSION_COLUMNS}
+            records.append((project, dt, data, day_data['data_ts'], None))
+    if merge:
+        records = _merge_cached(cache, records)
+    elif len(written.intersection([r[1] for r in records])) > 0:
+        records = [
+            r for r in records if r[1] not in written
+        ] + _merge_cached(cache, [r for r in records if r[1] in written])
+    cache.set_many(records)
+    written.update([r[1] for r in records])
+    logger.info('Wrote %d days of data for %d project(s) to cache',
+                len(days), len(projects))
+
+
+def _merge_cached(cache, records):
+    """
+    Add the counts of the existing cached records (read with one
+    :py:meth:`~.DiskDataCache.get_many` call) for the same projects and days
+    to those of newly-aggregated records, with
+    :py:meth:`~.DataQuery._merge_counts`, and keep the newer ``data_ts`` of
+    the two. Only the breakdowns are merged; other data in the cached
+    records (i.e. a download count cube) is not kept.
+
+    :param cache: cache to read existing records from
+    :type cache: :py:class:`~.DiskDataCache`
+    :param records: list of 5-tuples of (project name, date, data, data_ts,
+      metadata), as passed to :py:meth:`~.DiskDataCache.set_many`
+    :type records: ``list``
+    :return: list of merged records, in the same form and order
+    :rtype: ``list``
+    """
+    cached = cache.get_many([(r[0], r[1]) for r in records])
+    logger.info('Merging with %d existing cached record(s)', len(cached))
+    result = []
+    for project, dt, data, data_ts, metadata in records:
+        old = cached.get((project, dt), None)
+        if old is not None:
+            data = {
+                name: DataQuery._merge_counts(old.get(name, {}), data[name])
+                for name in data
+            }
+            data_ts = max(data_ts, old['cache_metadata']['data_ts'])
+        result.append((project, dt, data, data_ts, metadata))
+    return result
+
+
+def parse_args(argv):
+    """
+    Use Argparse to parse command-line arguments.
+
+    :param argv: list of arguments to parse (``sys.argv[1:]``)
+    :type argv: ``list``
+    :return: parsed arguments
+    :rtype: :py:class:`argparse.Namespace`
+    """
+    p = argparse.ArgumentParser(
+        description='pypi-download-stats-ingest - Build the pypi-download-stats'
+                    ' cache from local raw download event files '
+                    '(newline-delimited JSON, CSV or Parquet; optionally '
+                    'gzipped) - <%s>' % PROJECT_URL,
+        prog='pypi-download-stats-ingest'
+    )
+    p.add_argument('-V', '--version', action='version',
+                   version='%(prog)s ' + VERSION)
+    p.add_argument('-v', '--verbose', dest='verbose', action='count',
+                   default=0,
+                   help='verbose output. specify twice for debug-level output.')
+    p.add_argument('-c', '--cache-dir', dest='cache_dir', action='store',
+                   type=str, default='./pypi-stats-cache',
+                   help='stats cache directory (default: ./pypi-stats-cache)')
+    p.add_argument('--cache-compression', dest='cache_compression',
+                   action='store', type=str, default='none',
+                   choices=['none', 'gzip', 'zstd'],
+                   help='compression for cache files written to the cache '
+                        'directory (zstd requires zstandard; default: none)')
+    p.add_argument('--cache-serializer', dest='cache_serializer',
+                   action='store', type=str, default='json',
+                   choices=list(SERIALIZERS.keys()),
+                   help='serializer for cache files written to the cache '
+                        'directory (orjson and msgpack require the package '
+                        'of the same name; default: json)')
+    cf = p.add_mutually_exclusive_group()
+    cf.add_argument('--cache-db', dest='cache_db', action='store', type=str,
+                    default=None,
+                    help='store cached stats in this SQLite database, instead '
+                         'of one JSON file per project per day in the cache '
+                         'directory')
+    cf.add_argument('--arrow-cache', dest='arrow_cache', action='store_true',
+                    default=False,
+                    help='store cached stats in columnar Arrow files, one '
+                         'directory per project in the cache directory, '
+                         'instead of one JSON file per project per day '
+                         '(requires pyarrow)')
+    p.add_argument('-P', '--project', dest='PROJECT', action='append', type=str,
+                   help='project name to count downloads of (can be specified '
+                        'more than once; default: all projects)')
+    p.add_argument('-j', '--jobs', dest='jobs', type=int, action='store',
+                   default=None,
+                   help='number of worker processes (default: number of CPUs)')
+    p.add_argument('--chunk-size', dest='chunk_size', type=int,
+                   action='store', default=DEFAULT_CHUNK_SIZE // (1024 * 1024),
+                   help='split uncompressed text files into ranges of this '
+                        'many MiB, aggregated in parallel (default: %d)' % (
+                            DEFAULT_CHUNK_SIZE // (1024 * 1024)))
+    p.add_argument('--flush-days', dest='flush_days', type=int,
+                   action='store', default=DEFAULT_FLUSH_DAYS,
+                   help='write aggregated results to the cache whenever they '
+                        'span this many days, to bound memory use (default: '
+                        '%d)' % DEFAULT_FLUSH_DAYS)
+    p.add_argument('--merge', dest='merge', action='store_true',
+                   default=False,
+                   help='add the counts to those already cached for the same '
+                        'projects and days, e.g. to ingest one day\'s files '
+                        'over several runs (default: replace cached days, so '
+                        'all of the files for a day must be ingested in one '
+                        'run)')
+    p.add_argument('PATH', nargs='+', type=str,
+                   help='download event file, or directory to search for '
+                        'them (.json/.jsonl/.ndjson, .csv or .parquet; '
+                        'text formats may be gzipped)')
+    args = p.parse_args(argv)
+    return args
+
+
+def main(args=None):
+    """
+    Main entry point
+    """
+    # imported here so that using this module as a library doesn't require
+    # the runner's graphing dependencies
+    from pypi_download_stats.runner import set_log_info, set_log_debug
+    if args is None:
+        args = parse_args(sys.argv[1:])
+
+    # set logging level
+    if args.verbose > 1:
+        set_log_debug()
+    elif args.verbose == 1:
+        set_log_info()
+
+    cachepath = os.path.abspath(os.path.expanduser(args.cache_dir))
+    if args.cache_db is not None:
+        cache = SQLiteDataCache(args.cache_db)
+    elif args.arrow_cache:
+        cache = ArrowDataCache(cachepath)
+    else:
+        compression = args.cache_compression
+        if compression == 'none':
+            compression = None
+        cache = DiskDataCache(cache_path=cachepath, compression=compression,
+                              serializer=args.cache_serializer)
+    ingest(args.PATH, cache, projects=args.PROJECT, jobs=args.jobs,
+           chunk_size=args.chunk_size * 1024 * 1024, merge=args.merge,
+           flush_days=args.flush_days)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    main(args)
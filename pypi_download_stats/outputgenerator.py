@@ -64,7 +64,22 @@ class OutputGenerator(object):
         'by-distro'
     ]
 
-    def __init__(self, project_name, stats, output_dir):
+    # graph key to 3-tuple of (title, ProjectStats data property, Y axis name)
+    _GRAPHS = {
+        'by-version': ('Downloads by Version', 'per_version_data', 'Version'),
+        'by-file-type': ('Downloads by File Type', 'per_file_type_data',
+                         'File Type'),
+        'by-installer': ('Downloads by Installer', 'per_installer_data',
+                         'Installer'),
+        'by-implementation': ('Downloads by Python Implementation/Version',
+                              'per_implementation_data',
+                              'Implementation/Version'),
+        'by-system': ('Downloads by System Type', 'per_system_data', 'System'),
+        'by-country': ('Downloads by Country', 'per_country_data', 'Country'),
+        'by-distro': ('Downloads by Distro', 'per_distro_data', 'Distro')
+    }
+
+    def __init__(self, project_name, stats, output_dir, dimensions=None):
         """
         Initialize an OutputGenerator for one project.
 
@@ -74,11 +89,19 @@ class OutputGenerator(object):
         :type stats: :py:class:`~.ProjectStats`hey
         :param output_dir: path to write project output to
         :type output_dir: str
+        :param dimensions: if not None, only generate graphs for these
+          breakdowns (cache record keys, i.e. ``by_version`` for the
+          ``by-version`` graph)
+        :type dimensions: ``list``
         """
         logger.debug('Initializing OutputGenerator for project %s '
                      '(output_dir=%s)', project_name, output_dir)
         self.project_name = project_name
         self._stats = stats
+        self._graph_keys = [
+            k for k in self.GRAPH_KEYS
+            if dimensions is None or k.replace('-', '_') in dimensions
+        ]
         self.output_dir = os.path.abspath(os.path.expanduser(output_dir))
         if os.path.exists(self.output_dir):
             logger.debug('Removing existing per-project directory: %s',
@@ -110,12 +133,13 @@ class OutputGenerator(object):
         html = template.render(
             project=self.project_name,
             cache_date=self._stats.as_of_datetime,
+            approximate_dates=self._stats.approximate_dates,
             user=getuser(),
             host=platform_node(),
             version=VERSION,
             proj_url=PROJECT_URL,
             graphs=self._graphs,
-            graph_keys=self.GRAPH_KEYS,
+            graph_keys=self._graph_keys,
             resources=Resources(mode='inline').render(),
             badges=self._badges
         )
@@ -163,10 +187,17 @@ class OutputGenerator(object):
         :return: dict containing only the top 10 series, based on average over
           the last 7 days.
         :rtype: dict
+
+        An existing ``other`` series (i.e. counts already limited at query
+        time) is not ranked, and is added to the final ``other`` series.
         """
         if len(data.keys()) <= 10:
             logger.debug("Data has less than 10 keys; not limiting")
             return data
+        data = dict(data)
+        other = []  # values for dropped/'other' series
+        if 'other' in data:
+            other.append(data.pop('other'))
         # average last 7 days of each series
         avgs = {}
         for k in data:
@@ -177,7 +208,6 @@ class OutputGenerator(object):
             avgs[k] = sum(vals) / len(vals)
         # hold state
         final_data = {}  # final data dict
-        other = []  # values for dropped/'other' series
         count = 0  # iteration counter
         # iterate the sorted averages; either drop or keep
         for k in sorted(avgs, key=avgs.get, reverse=True):
@@ -199,6 +229,7 @@ class OutputGenerator(object):
         Generate a downloads graph; append it to ``self._graphs``.
 
         :param name: HTML name of the graph, also used in ``self.GRAPH_KEYS``
+          and ``self._GRAPHS``
         :type name: str
         :param title: human-readable title for the graph
         :type title: str
@@ -268,48 +299,10 @@ class OutputGenerator(object):
         Generate all output types and write to disk.
         """
         logger.info('Generating graphs')
-        self._generate_graph(
-            'by-version',
-            'Downloads by Version',
-            self._stats.per_version_data,
-            'Version'
-        )
-        self._generate_graph(
-            'by-file-type',
-            'Downloads by File Type',
-            self._stats.per_file_type_data,
-            'File Type'
-        )
-        self._generate_graph(
-            'by-installer',
-            'Downloads by Installer',
-            self._stats.per_installer_data,
-            'Installer'
-        )
-        self._generate_graph(
-            'by-implementation',
-            'Downloads by Python Implementation/Version',
-            self._stats.per_implementation_data,
-            'Implementation/Version'
-        )
-        self._generate_graph(
-            'by-system',
-            'Downloads by System Type',
-            self._stats.per_system_data,
-            'System'
-        )
-        self._generate_graph(
-            'by-country',
-            'Downloads by Country',
-            self._stats.per_country_data,
-            'Country'
-        )
-        self._generate_graph(
-            'by-distro',
-            'Downloads by Distro',
-            self._stats.per_distro_data,
-            'Distro'
-        )
+        for name in self._graph_keys:
+            title, attr, y_name = self._GRAPHS[name]
+            self._generate_graph(name, title, getattr(self._stats, attr),
+                                 y_name)
         self._generate_badges()
         logger.info('Generating HTML')
         html = self._generate_html()
@@ -42,22 +42,34 @@ from tzlocal import get_localzone
 from iso3166 import countries
 from math import ceil
 
+from pypi_download_stats import cube
+from pypi_download_stats.dataquery import DataQuery
+
 logger = logging.getLogger(__name__)
 
 
 class ProjectStats(object):
 
-    def __init__(self, project_name, cache_instance):
+    # cache record keys of every breakdown, in order
+    DIMENSIONS = list(DataQuery._DIMENSION_COLUMNS.keys())
+
+    def __init__(self, project_name, cache_instance, dimensions=None):
         """
         Initialize a ProjectStats class for the specified project.
         :param project_name: project name to calculate stats for
         :type project_name: str
         :param cache_instance: DataCache instance
         :type cache_instance: :py:class:`~.DiskDataCache`
+        :param dimensions: if not None, only use these breakdowns (items of
+          :py:attr:`~.DIMENSIONS`) of the cached data
+        :type dimensions: ``list``
         """
         logger.debug('Initializing ProjectStats for project: %s', project_name)
         self.project_name = project_name
         self.cache = cache_instance
+        if dimensions is None:
+            dimensions = self.DIMENSIONS
+        self.dimensions = [d for d in self.DIMENSIONS if d in dimensions]
         self.cache_data = {}
         self.cache_dates = self._get_cache_dates()
         self.as_of_timestamp = self._cache_get(
@@ -89,6 +101,7 @@ class ProjectStats(object):
                 dates = []
             last_date = val
             dates.append(val)
+        self._cache_load(dates)
         # find the first download record, and only look at dates after that
         for idx, cache_date in enumerate(dates):
             data = self._cache_get(cache_date)
@@ -99,23 +112,15 @@ class ProjectStats(object):
 
     def _is_empty_cache_record(self, rec):
         """
-        Return True if the specified cache record has no data, False otherwise.
+        Return True if the specified cache record has no data for any of the
+        breakdowns in ``self.dimensions``, False otherwise.
 
         :param rec: cache record returned by :py:meth:`~._cache_get`
         :type rec: dict
         :return: True if record is empty, False otherwise
         :rtype: bool
         """
-        # these are taken from DataQuery.query_one_table()
-        for k in [
-            'by_version',
-            'by_file_type',
-            'by_installer',
-            'by_implementation',
-            'by_system',
-            'by_distro',
-            'by_country'
-        ]:
+        for k in self.dimensions:
             if k in rec and len(rec[k]) > 0:
                 return False
         return True
@@ -136,9 +141,42 @@ class ProjectStats(object):
         logger.debug('Getting data from cache for date %s',
                      date.strftime('%Y-%m-%d'))
         data = self.cache.get(self.project_name, date)
-        self.cache_data[date] = data
+        self._cache_put(date, data)
         return data
 
+    def _cache_load(self, dates):
+        """
+        Get cache data for all of the specified dates with one
+        :py:meth:`~.DiskDataCache.get_range` call, and cache it locally in
+        this class.
+
+        :param dates: sorted list of dates to get data for
+        :type dates: ``list``
+        """
+        if len(dates) == 0:
+            return
+        logger.debug('Getting data from cache for %d dates (%s to %s)',
+                     len(dates), dates[0].strftime('%Y-%m-%d'),
+                     dates[-1].strftime('%Y-%m-%d'))
+        records = self.cache.get_range(self.project_name, dates[0], dates[-1])
+        for date in dates:
+            self._cache_put(date, records.get(date, None))
+
+    def _cache_put(self, date, data):
+        """
+        Cache data for the specified day locally in this class.
+
+        :param date: date the data is for
+        :type date: datetime.datetime
+        :param data: cache data for date, or None if not in cache
+        :type data: :py:obj:`dict` or ``None``
+        """
+        if data is not None:
+            # records written with DataQuery dimensions set may lack some
+            for k in self.dimensions:
+                data.setdefault(k, {})
+        self.cache_data[date] = data
+
     @staticmethod
     def _alpha2_to_country(alpha2):
         """
@@ -175,7 +213,10 @@ class ProjectStats(object):
     @staticmethod
     def _compound_column_value(k1, k2):
         """
-        Like :py:meth:`~._column_value` but collapses two unknowns into one.
+        Like :py:meth:`~._column_value` but collapses two unknowns into one,
+        as well as the two ``other`` keys of the bucket that counts beyond a
+        breakdown's top keys are summed into (see ``top_k`` in
+        :py:meth:`.DataQuery.__init__`).
 
         :param k1: first (top-level) value
         :param k2: second (bottom-level) value
@@ -186,6 +227,8 @@ class ProjectStats(object):
         k2 = ProjectStats._column_value(k2)
         if k1 == 'unknown' and k2 == 'unknown':
             return 'unknown'
+        if k1 == 'other' and k2 == 'other':
+            return 'other'
         return '%s %s' % (k1, k2)
 
     @staticmethod
@@ -320,6 +363,9 @@ class ProjectStats(object):
             data = self._cache_get(cache_date)
             ret[cache_date] = {}
             for cc, count in data['by_country'].items():
+                if cc == 'other':
+                    ret[cache_date]['other'] = count
+                    continue
                 k = '%s (%s)' % (self._alpha2_to_country(cc), cc)
                 ret[cache_date][k] = count
             if len(ret[cache_date]) == 0:
@@ -353,6 +399,77 @@ class ProjectStats(object):
                 ret[cache_date]['unknown'] = 0
         return ret
 
+    def crosstab_data(self, columns):
+        """
+        Return download data cross-tabulated by two or more BigQuery columns,
+        i.e. ``['file.version', 'details.implementation.name']`` for version
+        by Python implementation, rolled up from the download count cube that
+        :py:class:`~.DataQuery` stores in cube mode. Dates whose cache records
+        have no cube (i.e. were not queried in cube mode) have no data.
+
+        :param columns: names of the columns to cross-tabulate by, in order
+        :type columns: ``list``
+        :return: dict of cache data; keys are datetime objects, values are
+          dict of space-separated column values (str) to count (int).
+        :rtype: dict
+        """
+        ret = {}
+        for cache_date in self.cache_dates:
+            data = self._cache_get(cache_date)
+            ret[cache_date] = {}
+            if 'cube' in data:
+                self._flatten_rollup(
+                    cube.rollup(data['cube'], columns), [], ret[cache_date]
+                )
+            else:
+                logger.debug('No download count cube for date %s',
+                             cache_date.strftime('%Y-%m-%d'))
+            if len(ret[cache_date]) == 0:
+                ret[cache_date]['unknown'] = 0
+        return ret
+
+    @staticmethod
+    def _flatten_rollup(rollup, keys, result):
+        """
+        Flatten a nested rollup, as returned by
+        :py:func:`pypi_download_stats.cube.rollup`, into ``result``, keyed by
+        the space-separated column values. As with
+        :py:meth:`~._compound_column_value`, keys whose values are all unknown
+        are collapsed into one.
+
+        :param rollup: nested dict of column values to counts
+        :type rollup: dict
+        :param keys: column values of the enclosing levels of ``rollup``
+        :type keys: ``list``
+        :param result: dict of display key to count, to add counts to
+        :type result: dict
+        """
+        for k, v in rollup.items():
+            k = ProjectStats._column_value(k)
+            if isinstance(v, dict):
+                ProjectStats._flatten_rollup(v, keys + [k], result)
+                continue
+            if set(keys + [k]) == set(['unknown']):
+                display = 'unknown'
+            else:
+                display = ' '.join(keys + [k])
+            result[display] = result.get(display, 0) + v
+
+    @property
+    def approximate_dates(self):
+        """
+        Return the dates whose cached data is approximate, i.e. was queried
+        with a sample rate and scaled up (see ``sample_rate`` in
+        :py:meth:`.DataQuery.__init__`).
+
+        :return: list of :py:class:`datetime.datetime` dates, in ascending order
+        :rtype: ``list``
+        """
+        return [
+            d for d in self.cache_dates
+            if self._cache_get(d)['cache_metadata'].get('approximate', False)
+        ]
+
     @property
     def downloads_per_day(self):
         """
@@ -403,6 +520,24 @@ class ProjectStats(object):
         logger.debug("Downloads per month = %d", count)
         return count
 
+    @staticmethod
+    def _breakdown_total(breakdown):
+        """
+        Return the total download count of a (possibly nested) breakdown.
+
+        :param breakdown: breakdown dict from a cache record
+        :type breakdown: dict
+        :return: download count
+        :rtype: int
+        """
+        total = 0
+        for v in breakdown.values():
+            if isinstance(v, dict):
+                total += ProjectStats._breakdown_total(v)
+            else:
+                total += v
+        return total
+
     def _downloads_for_num_days(self, num_days):
         """
         Given a number of days of historical data to look at (starting with
@@ -410,6 +545,9 @@ class ProjectStats(object):
         for that time range, and the number of days of data we had (in cases
         where we had less data than requested).
 
+        Totals are taken from the first breakdown in ``self.dimensions``
+        (``by_version`` unless that is not used).
+
         :param num_days: number of days of data to look at
         :type num_days: int
         :return: 2-tuple of (download total, number of days of data)
@@ -424,6 +562,6 @@ class ProjectStats(object):
         dl_sum = 0
         for cache_date in dates:
             data = self._cache_get(cache_date)
-            dl_sum += sum(data['by_version'].values())
+            dl_sum += self._breakdown_total(data[self.dimensions[0]])
         logger.debug("Sum of download counts: %d", dl_sum)
         return dl_sum, len(dates)
@@ -0,0 +1,1737 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import logging
+import re
+import os
+import json
+import hashlib
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from calendar import timegm
+from datetime import datetime, timedelta
+
+import httplib2
+from googleapiclient.discovery import (build, build_from_document,
+                                       DISCOVERY_URI)
+from googleapiclient.errors import HttpError
+from oauth2client.client import GoogleCredentials
+
+try:
+    from googleapiclient import __version__ as googleapiclient_version
+except ImportError:
+    from googleapiclient.version import __version__ as googleapiclient_version
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBackend(object):
+    """
+    Interface for the service that :py:class:`~.DataQuery` runs its (BigQuery
+    legacy SQL) queries against.
+    """
+
+    def run_query(self, query):
+        """
+        Run one query and return the result.
+
+        :param query: the query to run
+        :type query: str
+        :return: generator of per-row result dicts (column name => value)
+        :rtype: ``generator``
+        """
+        raise NotImplementedError()
+
+    def dry_run_query(self, query):
+        """
+        Validate a query and return how many bytes it would process, without
+        running it.
+
+        :param query: the query to dry-run
+        :type query: str
+        :return: number of bytes the query would process, or None if a table it
+          queries does not exist
+        :rtype: int
+        """
+        raise NotImplementedError()
+
+    def get_table(self, dataset_project, dataset_id, table_id):
+        """
+        Get the table resource for one table.
+
+        :param dataset_project: ID of the project the dataset belongs to
+        :type dataset_project: str
+        :param dataset_id: ID of the dataset the table is in
+        :type dataset_id: str
+        :param table_id: name of the table
+        :type table_id: str
+        :return: table resource (dict), with at least ``lastModifiedTime``
+          (milliseconds since the epoch) and ``numRows`` keys, or None if the
+          table does not exist
+        :rtype: dict
+        """
+        raise NotImplementedError()
+
+    def list_tables(self, dataset_project, dataset_id):
+        """
+        List the names of all tables in a dataset.
+
+        :param dataset_project: ID of the project the dataset belongs to
+        :type dataset_project: str
+        :param dataset_id: ID of the dataset
+        :type dataset_id: str
+        :return: list of table names (strings)
+        :rtype: ``list``
+        """
+        raise NotImplementedError()
+
+    def is_table_not_found(self, exc):
+        """
+        Return True if the specified exception, raised by
+        :py:meth:`~.run_query`, means that a table queried does not exist.
+
+        :param exc: exception raised by :py:meth:`~.run_query`
+        :type exc: Exception
+        :return: whether the error is a "table not found" error
+        :rtype: bool
+        """
+        raise NotImplementedError()
+
+    @property
+    def identity(self):
+        """
+        Return a string identifying what this backend runs queries against,
+        so that :py:class:`~.CachingBackend` can keep results of the same query
+        text from different backends apart.
+
+        :return: backend identity
+        :rtype: str
+        """
+        return self.__class__.__name__
+
+
+class BigQueryBackend(QueryBackend):
+    """
+    Run queries against Google BigQuery, using ``googleapiclient``.
+    """
+
+    # HTTP status codes and BigQuery error reasons that are retried with
+    # exponential backoff by :py:meth:`~._execute`
+    _RETRY_STATUSES = [429, 500, 502, 503, 504]
+    _RETRY_REASONS = [
+        'rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded',
+        'backendError', 'internalError'
+    ]
+    _MAX_RETRIES = 6
+
+    # number of result rows to retrieve per getQueryResults request, and how
+    # long each request should wait for the query job to complete
+    _PAGE_SIZE = 10000
+    _POLL_TIMEOUT_MS = 10000
+
+    # whether queries are legacy SQL (or standard SQL)
+    _USE_LEGACY_SQL = True
+
+    # how long a discovery document cached on disk is used before being
+    # fetched again
+    _DISCOVERY_TTL = timedelta(days=7)
+
+    # 2-tuples of (credentials, BigQuery service) built in this process,
+    # keyed by discovery document cache path and shared by every instance
+    _services = {}
+    _services_lock = threading.Lock()
+
+    def __init__(self, project_id, query_concurrency=1,
+                 discovery_cache_path=None):
+        """
+        Connect to BigQuery.
+
+        :param project_id: the Project ID for the user you're authenticating as;
+          if omitted will attempt to find this in the JSON file at the path
+          specified by the ``GOOGLE_APPLICATION_CREDENTIALS`` environment
+          variable.
+        :type project_id: str
+        :param query_concurrency: number of threads that will be running
+          queries concurrently; if more than one, each thread uses its own
+          authorized HTTP transport
+        :type query_concurrency: int
+        :param discovery_cache_path: if not None, directory to cache the
+          BigQuery API discovery document in (see
+          :py:meth:`~._get_discovery_document`), instead of fetching it every
+          time the service is built
+        :type discovery_cache_path: str
+        """
+        self.project_id = project_id
+        if project_id is None:
+            self.project_id = self._get_project_id()
+        logger.debug('project_id to run queries from: %s', self.project_id)
+        self.query_concurrency = query_concurrency
+        self._thread_local = threading.local()
+        self._credentials = None
+        self.discovery_cache_path = discovery_cache_path
+        if discovery_cache_path is not None:
+            self.discovery_cache_path = os.path.abspath(
+                os.path.expanduser(discovery_cache_path)
+            )
+        self.service = self._get_bigquery_service()
+
+    def _get_project_id(self):
+        """
+        Get our projectId from the ``GOOGLE_APPLICATION_CREDENTIALS`` creds
+        JSON file.
+
+        :return: project ID
+        :rtype: str
+        """
+        fpath = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS', None)
+        if fpath is None:
+            raise Exception('ERROR: No project ID specified, and '
+                            'GOOGLE_APPLICATION_CREDENTIALS env var is not set')
+        fpath = os.path.abspath(os.path.expanduser(fpath))
+        logger.debug('Reading credentials file at %s to get project_id', fpath)
+        with open(fpath, 'r') as fh:
+            cred_data = json.loads(fh.read())
+        return cred_data['project_id']
+
+    def _get_bigquery_service(self):
+        """
+        Connect to the BigQuery service.
+
+        Calling ``GoogleCredentials.get_application_default`` requires that
+        you either be running in the Google Cloud, or have the
+        ``GOOGLE_APPLICATION_CREDENTIALS`` environment variable set to the path
+        to a credentials JSON file.
+
+        The service is only built once per process (for each discovery
+        document cache path); later instances reuse it and its credentials.
+
+        :return: authenticated BigQuery service connection object
+        :rtype: `googleapiclient.discovery.Resource <http://google.github.io/\
+google-api-python-client/docs/epy/googleapiclient.discovery.\
+Resource-class.html>`_
+        """
+        with self._services_lock:
+            if self.discovery_cache_path in self._services:
+                logger.debug('Reusing BigQuery service instance')
+                credentials, bigquery_service = self._services[
+                    self.discovery_cache_path
+                ]
+                self._credentials = credentials
+                return bigquery_service
+            logger.debug('Getting Google Credentials')
+            credentials = GoogleCredentials.get_application_default()
+            # keep these around to authorize per-thread HTTP transports
+            self._credentials = credentials
+            logger.debug('Building BigQuery service instance')
+            if self.discovery_cache_path is None:
+                bigquery_service = build('bigquery', 'v2',
+                                         credentials=credentials)
+            else:
+                bigquery_service = build_from_document(
+                    self._get_discovery_document(), credentials=credentials
+                )
+            self._services[self.discovery_cache_path] = (
+                credentials, bigquery_service
+            )
+        return bigquery_service
+
+    def _is_discovery_current(self, cached):
+        """
+        Return True if a discovery document cached on disk can be used, i.e.
+        it is the BigQuery v2 document, was fetched with the installed version
+        of ``googleapiclient`` and is less than :py:attr:`~._DISCOVERY_TTL`
+        old.
+
+        :param cached: cached discovery document file contents
+        :type cached: dict
+        :return: whether the cached document is current
+        :rtype: bool
+        """
+        if cached.get('client_version') != googleapiclient_version:
+            logger.debug('Cached discovery document was fetched by '
+                         'googleapiclient %s, not %s',
+                         cached.get('client_version'), googleapiclient_version)
+            return False
+        try:
+            doc = json.loads(cached['document'])
+            if doc['name'] != 'bigquery' or doc['version'] != 'v2':
+                return False
+        except Exception:
+            logger.debug('Cached discovery document is invalid')
+            return False
+        age = time.time() - cached['fetched']
+        return 0 <= age < self._DISCOVERY_TTL.total_seconds()
+
+    def _fetch_discovery_document(self):
+        """
+        Fetch the BigQuery v2 API discovery document.
+
+        :return: discovery document (JSON)
+        :rtype: str
+        """
+        uri = DISCOVERY_URI.replace('{api}', 'bigquery').replace(
+            '{apiVersion}', 'v2'
+        )
+        logger.debug('Fetching BigQuery discovery document from %s', uri)
+        resp, content = httplib2.Http().request(uri)
+        if int(resp.status) != 200:
+            raise Exception(
+                'ERROR: got status %s fetching discovery document from %s' % (
+                    resp.status, uri
+                )
+            )
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        return content
+
+    def _get_discovery_document(self):
+        """
+        Return the BigQuery v2 API discovery document, from the copy cached in
+        ``self.discovery_cache_path`` if it is current (see
+        :py:meth:`~._is_discovery_current`), otherwise fetched and cached. If
+        fetching fails, an expired cached copy for the installed version of
+        ``googleapiclient`` is used instead.
+
+        :return: discovery document (JSON)
+        :rtype: str
+        """
+        fpath = os.path.join(self.discovery_cache_path, 'bigquery_v2.json')
+        cached = None
+        try:
+            with open(fpath, 'r') as fh:
+                cached = json.loads(fh.read())
+        except Exception:
+            logger.debug('No cached discovery document at %s', fpath)
+        if cached is not None and self._is_discovery_current(cached):
+            logger.debug('Using cached discovery document from %s', fpath)
+            return cached['document']
+        try:
+            doc = self._fetch_discovery_document()
+        except Exception:
+            if (
+                cached is None or
+                cached.get('client_version') != googleapiclient_version
+            ):
+                raise
+            logger.warning('Error fetching BigQuery discovery document; '
+                           'using expired cached copy', exc_info=True)
+            return cached['document']
+        if not os.path.exists(self.discovery_cache_path):
+            logger.debug('Creating discovery document cache directory: %s',
+                         self.discovery_cache_path)
+            os.makedirs(self.discovery_cache_path)
+        tmp_path = '%s.%s.tmp' % (fpath, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'w') as fh:
+                fh.write(json.dumps({
+                    'client_version': googleapiclient_version,
+                    'fetched': time.time(),
+                    'document': doc
+                }))
+            os.rename(tmp_path, fpath)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return doc
+
+    def _get_http(self):
+        """
+        Return an authorized HTTP transport for the current thread. httplib2
+        is not thread-safe, so when querying concurrently each worker thread
+        needs its own transport; the service object itself can be shared.
+
+        :return: authorized HTTP transport, or None to use the service's own
+          transport (when not querying concurrently)
+        :rtype: ``httplib2.Http`` or ``None``
+        """
+        if self.query_concurrency < 2 or self._credentials is None:
+            return None
+        http = getattr(self._thread_local, 'http', None)
+        if http is None:
+            logger.debug('Creating authorized HTTP transport for thread %s',
+                         threading.current_thread().name)
+            http = self._credentials.authorize(httplib2.Http())
+            self._thread_local.http = http
+        return http
+
+    def _is_retryable(self, exc):
+        """
+        Return True if the specified HttpError is a transient, quota or
+        rate-limit error that should be retried, False otherwise.
+
+        :param exc: exception raised by the BigQuery API client
+        :type exc: googleapiclient.errors.HttpError
+        :return: whether the request should be retried
+        :rtype: bool
+        """
+        if int(exc.resp.status) in self._RETRY_STATUSES:
+            return True
+        try:
+            content = json.loads(exc.content.decode('utf-8'))
+            reasons = [e['reason'] for e in content['error']['errors']]
+        except Exception:
+            return False
+        for reason in reasons:
+            if reason in self._RETRY_REASONS:
+                return True
+        return False
+
+    def _execute(self, request):
+        """
+        Execute an API request using this thread's HTTP transport (see
+        :py:meth:`~._get_http`), retrying with exponential backoff (and
+        jitter) on quota, rate-limit and transient backend errors.
+
+        :param request: API request to execute
+        :type request: googleapiclient.http.HttpRequest
+        :return: API response
+        :rtype: dict
+        """
+        http = self._get_http()
+        for attempt in range(self._MAX_RETRIES + 1):
+            try:
+                if http is None:
+                    return request.execute()
+                return request.execute(http=http)
+            except HttpError as exc:
+                if attempt >= self._MAX_RETRIES or not self._is_retryable(exc):
+                    raise
+                delay = (2 ** attempt) + random.random()
+                logger.warning('Retryable error from BigQuery (attempt %d of '
+                               '%d); retrying in %.1f seconds: %s',
+                               attempt + 1, self._MAX_RETRIES + 1, delay, exc)
+                time.sleep(delay)
+
+    def get_table(self, dataset_project, dataset_id, table_id):
+        """
+        Get the BigQuery table resource for a table.
+
+        :param dataset_project: ID of the project the dataset belongs to
+        :type dataset_project: str
+        :param dataset_id: ID of the dataset the table is in
+        :type dataset_id: str
+        :param table_id: name of the table
+        :type table_id: str
+        :return: table resource (dict), or None if the table does not exist
+        :rtype: dict
+        """
+        try:
+            return self._execute(self.service.tables().get(
+                projectId=dataset_project, datasetId=dataset_id,
+                tableId=table_id
+            ))
+        except HttpError as exc:
+            if int(exc.resp.status) == 404:
+                logger.debug('Table %s does not exist', table_id)
+                return None
+            raise
+
+    def list_tables(self, dataset_project, dataset_id):
+        """
+        List the names of all tables (but not views) in a dataset, paging
+        through the results.
+
+        :param dataset_project: ID of the project the dataset belongs to
+        :type dataset_project: str
+        :param dataset_id: ID of the dataset
+        :type dataset_id: str
+        :return: list of table names (strings)
+        :rtype: ``list``
+        """
+        names = []
+        tables = self.service.tables()
+        request = tables.list(projectId=dataset_project, datasetId=dataset_id)
+        while request is not None:
+            response = self._execute(request)
+            # if the number of results is evenly divisible by the page size,
+            # we may end up with a last response that has no 'tables' key,
+            # and is empty.
+            if 'tables' not in response:
+                response['tables'] = []
+            for table in response['tables']:
+                if table['type'] != 'TABLE':
+                    logger.debug('Skipping %s (type=%s)',
+                                 table['tableReference']['tableId'],
+                                 table['type'])
+                    continue
+                names.append(table['tableReference']['tableId'])
+            request = tables.list_next(previous_request=request,
+                                       previous_response=response)
+        return names
+
+    def _insert_query_job(self, query):
+        """
+        Submit a query job to BigQuery, without waiting for it to complete.
+
+        The job ID is generated client-side, so that if the insert request
+        succeeds but is retried by :py:meth:`~._execute` (i.e. the response
+        was lost), we simply continue with the job that already exists.
+
+        :param query: the query to run
+        :type query: str
+        :return: job ID
+        :rtype: str
+        """
+        job_id = 'pypi_download_stats_%s' % uuid.uuid4().hex
+        body = {
+            'jobReference': {'projectId': self.project_id, 'jobId': job_id},
+            'configuration': {
+                'query': {
+                    'query': query, 'useLegacySql': self._USE_LEGACY_SQL
+                }
+            }
+        }
+        try:
+            self._execute(self.service.jobs().insert(
+                projectId=self.project_id, body=body
+            ))
+        except HttpError as exc:
+            if int(exc.resp.status) != 409:
+                raise
+            logger.debug('Job %s already exists', job_id)
+        logger.debug('Inserted query job %s', job_id)
+        return job_id
+
+    def run_query(self, query):
+        """
+        Run one query against BigQuery and return the result.
+
+        The query is submitted as an asynchronous job (``jobs.insert``); we then
+        poll ``jobs.getQueryResults`` until the job completes, and page through
+        the results ``self._PAGE_SIZE`` rows at a time using page tokens. Rows
+        are yielded as each page is retrieved, so results of any size can be
+        processed in constant memory and are never truncated.
+
+        :param query: the query to run
+        :type query: str
+        :return: generator of per-row response dicts (key => value)
+        :rtype: ``generator``
+        """
+        logger.debug('Running query: %s', query)
+        start = datetime.now()
+        job_id = self._insert_query_job(query)
+        jobs = self.service.jobs()
+        page_token = None
+        num_pages = 0
+        num_rows = 0
+        while True:
+            kwargs = {
+                'projectId': self.project_id,
+                'jobId': job_id,
+                'maxResults': self._PAGE_SIZE,
+                'timeoutMs': self._POLL_TIMEOUT_MS
+            }
+            if page_token is not None:
+                kwargs['pageToken'] = page_token
+            resp = self._execute(jobs.getQueryResults(**kwargs))
+            if not resp['jobComplete']:
+                logger.debug('Job %s not complete after %s; polling again',
+                             job_id, datetime.now() - start)
+                continue
+            num_pages += 1
+            fields = [f['name'] for f in resp['schema']['fields']]
+            for row in resp.get('rows', []):
+                num_rows += 1
+                yield self._row_to_dict(fields, row)
+            page_token = resp.get('pageToken', None)
+            if page_token is None:
+                break
+        duration = datetime.now() - start
+        logger.debug('Query job %s returned %d rows in %d pages (in %s)',
+                     job_id, num_rows, num_pages, duration)
+        if num_rows != int(resp['totalRows']):
+            logger.error('Error: query reported %s total rows, but only '
+                         'returned %d', resp['totalRows'], num_rows)
+
+    @staticmethod
+    def _row_to_dict(fields, row):
+        """
+        Convert one BigQuery result row to a dict.
+
+        :param fields: list of field names, from the result schema
+        :type fields: ``list``
+        :param row: result row, as returned by the API
+        :type row: dict
+        :return: dict of field name to value
+        :rtype: dict
+        """
+        d = {}
+        for idx, val in enumerate(row['f']):
+            d[fields[idx]] = val['v']
+        return d
+
+    def dry_run_query(self, query):
+        """
+        Run a query as a BigQuery dry-run job, which validates the query and
+        returns how many bytes it would process, without running (or billing
+        for) it.
+
+        :param query: the query to dry-run
+        :type query: str
+        :return: number of bytes the query would process, or None if the
+          table it queries does not exist
+        :rtype: int
+        """
+        logger.debug('Dry-running query: %s', query)
+        try:
+            resp = self._execute(self.service.jobs().query(
+                projectId=self.project_id,
+                body={'query': query, 'dryRun': True,
+                      'useLegacySql': self._USE_LEGACY_SQL}
+            ))
+        except HttpError as exc:
+            if self.is_table_not_found(exc):
+                return None
+            raise
+        return int(resp['totalBytesProcessed'])
+
+    def is_table_not_found(self, exc):
+        """
+        Return True if the specified exception is BigQuery telling us that
+        the table does not exist, False otherwise.
+
+        :param exc: exception raised by the BigQuery API client
+        :type exc: Exception
+        :return: whether the error is a "table not found" error
+        :rtype: bool
+        """
+        if not isinstance(exc, HttpError):
+            return False
+        try:
+            content = json.loads(exc.content.decode('utf-8'))
+            return content['error']['message'].startswith('Not found: Table')
+        except Exception:
+            return False
+
+
+# Legacy SQL constructs that DataQuery generates, for the backends that
+# translate its queries to other SQL dialects.
+_TABLE_REF_RE = re.compile(r'\[[\w-]+:\w+\.(downloads[0-9]{8})\]')
+_DATE_RANGE_RE = re.compile(
+    r"TABLE_DATE_RANGE\(\[[\w-]+:\w+\.downloads\], "
+    r"TIMESTAMP\('([0-9-]+)'\), TIMESTAMP\('([0-9-]+)'\)\)"
+)
+_FLATTEN_RE = re.compile(
+    r"FLATTEN\(\(SELECT (?P<cols>.*?), SPLIT\('(?P<values>[^']*)', ','\) "
+    r"AS (?P<name>\w+) (?P<source>FROM .*?) (?P<where>WHERE .*?)\), "
+    r"(?P=name)\)"
+)
+
+
+def _split_union(from_clause):
+    """
+    Given the text following ``FROM`` in a query, if it is a legacy SQL
+    comma-separated union of parenthesized subqueries, return the
+    subqueries (with their parentheses) and the remaining text.
+
+    :param from_clause: query text following ``FROM``
+    :type from_clause: str
+    :return: 2-tuple of (list of subquery strings, remaining text)
+    :rtype: tuple
+    """
+    parts = []
+    pos = 0
+    while pos < len(from_clause) and from_clause[pos] == '(':
+        depth = 0
+        for idx in range(pos, len(from_clause)):
+            if from_clause[idx] == '(':
+                depth += 1
+            elif from_clause[idx] == ')':
+                depth -= 1
+                if depth == 0:
+                    break
+        parts.append(from_clause[pos:idx + 1])
+        pos = idx + 1
+        if from_clause[pos:pos + 2] != ', ':
+            break
+        pos += 2
+    return parts, from_clause[pos:]
+
+
+def _union_all(query, part_format):
+    """
+    Rewrite every legacy SQL comma-separated union of subqueries in a query's
+    FROM clauses as a parenthesized ``UNION ALL``.
+
+    :param query: query text
+    :type query: str
+    :param part_format: format string for each subquery (with its
+      parentheses) in the ``UNION ALL``
+    :type part_format: str
+    :return: query text
+    :rtype: str
+    """
+    idx = 0
+    while True:
+        idx = query.find('FROM (', idx)
+        if idx == -1:
+            break
+        idx += len('FROM ')
+        parts, rest = _split_union(query[idx:])
+        if len(parts) > 1:
+            query = query[:idx] + '(%s)' % ' UNION ALL '.join(
+                [part_format % p for p in parts]
+            ) + rest
+    return query
+
+
+def _parse_timestamp(ts):
+    """
+    Parse a timestamp stored as a ``YYYY-MM-DD HH:MM:SS`` (UTC) string,
+    optionally with fractional seconds (``YYYY-MM-DD HH:MM:SS.ffffff``).
+
+    :param ts: stored timestamp
+    :type ts: str
+    :return: the timestamp
+    :rtype: datetime.datetime
+    """
+    if '.' in ts:
+        return datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
+    return datetime.strptime(ts, '%Y-%m-%d %H:%M:%S')
+
+
+def _timestamp_to_sec(ts):
+    """
+    SQLite implementation of the legacy SQL ``TIMESTAMP_TO_SEC`` function,
+    for timestamps stored as ``YYYY-MM-DD HH:MM:SS`` (UTC) strings.
+    """
+    if ts is None:
+        return None
+    return timegm(_parse_timestamp(ts).timetuple())
+
+
+def _timestamp_to_usec(ts):
+    """
+    SQLite implementation of the legacy SQL ``TIMESTAMP_TO_USEC`` function.
+    """
+    if ts is None:
+        return None
+    dt = _parse_timestamp(ts)
+    return timegm(dt.timetuple()) * 1000000 + dt.microsecond
+
+
+def _sec_to_timestamp(sec):
+    """
+    SQLite implementation of the legacy SQL ``SEC_TO_TIMESTAMP`` function.
+    """
+    if sec is None:
+        return None
+    return datetime.utcfromtimestamp(int(sec)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _usec_to_timestamp(usec):
+    """
+    SQLite implementation of the legacy SQL ``USEC_TO_TIMESTAMP`` function.
+    Whole seconds are formatted without a fractional part, so that the result
+    compares correctly (as a string) against stored timestamps of either
+    form.
+    """
+    if usec is None:
+        return None
+    sec, frac = divmod(int(usec), 1000000)
+    res = _sec_to_timestamp(sec)
+    if frac:
+        res += '.%06d' % frac
+    return res
+
+
+def _string(val):
+    """
+    SQLite implementation of the legacy SQL ``STRING`` function.
+    """
+    if val is None:
+        return None
+    return '%s' % val
+
+
+def _hash(val):
+    """
+    SQLite stand-in for the legacy SQL ``HASH`` function. Like it, this is a
+    deterministic integer hash of the value (though not the same one, and
+    never negative).
+    """
+    if val is None:
+        return None
+    return int(hashlib.md5(val.encode('utf-8')).hexdigest()[:15], 16)
+
+
+class SQLiteBackend(QueryBackend):
+    """
+    Run queries against a local SQLite database of synthetic (or mirrored)
+    download events, so that the whole query path - including cache writes -
+    can be run offline and benchmarked without a Google account.
+
+    The database has one ``downloadsYYYYMMDD`` table per day, mirroring the
+    BigQuery dataset; each has the columns in :py:attr:`~.COLUMNS`, named
+    with the same (dotted) names as the nested BigQuery fields, and
+    ``timestamp`` stored as a ``YYYY-MM-DD HH:MM:SS`` UTC string. The legacy
+    SQL that :py:class:`~.DataQuery` generates is translated to SQLite by
+    :py:meth:`~._translate`, which handles only the constructs DataQuery uses.
+    """
+
+    #: columns of each per-day download table
+    COLUMNS = [
+        'timestamp',
+        'country_code',
+        'file.project',
+        'file.version',
+        'file.type',
+        'details.installer.name',
+        'details.installer.version',
+        'details.implementation.name',
+        'details.implementation.version',
+        'details.system.name',
+        'details.distro.name',
+        'details.distro.version'
+    ]
+
+    _nested_column_re = re.compile(r'(?<![\w."])((?:file|details)(?:\.\w+)+)')
+
+    def __init__(self, db_path):
+        """
+        Connect to (or create) a local SQLite database.
+
+        :param db_path: path to the SQLite database file. Each thread uses its
+          own connection, so this should not be ``:memory:`` when querying
+          concurrently.
+        :type db_path: str
+        """
+        self.db_path = db_path
+        self._thread_local = threading.local()
+
+    @property
+    def identity(self):
+        """
+        Return a string identifying the database this backend queries.
+
+        :return: backend identity
+        :rtype: str
+        """
+        return '%s:%s' % (self.__class__.__name__, self.db_path)
+
+    def _get_conn(self):
+        """
+        Return the database connection for the current thread, connecting (and
+        registering our legacy SQL functions) if needed.
+
+        :return: database connection
+        :rtype: sqlite3.Connection
+        """
+        conn = getattr(self._thread_local, 'conn', None)
+        if conn is None:
+            logger.debug('Connecting to %s for thread %s', self.db_path,
+                         threading.current_thread().name)
+            conn = sqlite3.connect(self.db_path)
+            conn.create_function('TIMESTAMP_TO_SEC', 1, _timestamp_to_sec)
+            conn.create_function('SEC_TO_TIMESTAMP', 1, _sec_to_timestamp)
+            conn.create_function(
+                'TIMESTAMP_TO_USEC', 1, _timestamp_to_usec
+            )
+            conn.create_function(
+                'USEC_TO_TIMESTAMP', 1, _usec_to_timestamp
+            )
+            conn.create_function('STRING', 1, _string)
+            conn.create_function('HASH', 1, _hash)
+            self._thread_local.conn = conn
+        return conn
+
+    def _table_names(self):
+        """
+        Return the names of all tables in the database.
+
+        :return: list of table names
+        :rtype: ``list``
+        """
+        cursor = self._get_conn().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"
+        )
+        return [r[0] for r in cursor.fetchall()]
+
+    def _translate(self, query):
+        """
+        Translate a legacy SQL query, as generated by :py:class:`~.DataQuery`,
+        to SQLite.
+
+        - ``[project:dataset.table]`` references become quoted table names.
+        - ``TABLE_DATE_RANGE()`` becomes a ``UNION ALL`` of the existing tables
+          in the range.
+        - ``FLATTEN()`` of a ``SPLIT()`` constant becomes a cross join with the
+          split values.
+        - A comma-separated union of subqueries becomes a ``UNION ALL``.
+        - Nested column names (i.e. ``file.project``) are quoted.
+
+        :param query: legacy SQL query
+        :type query: str
+        :return: SQLite query
+        :rtype: str
+        """
+        query = _TABLE_REF_RE.sub(r'"\1"', query)
+        tables = set(self._table_names())
+
+        def date_range(m):
+            dt = datetime.strptime(m.group(1), '%Y-%m-%d')
+            end = datetime.strptime(m.group(2), '%Y-%m-%d')
+            names = []
+            while dt <= end:
+                name = 'downloads%s' % dt.strftime('%Y%m%d')
+                if name in tables:
+                    names.append(name)
+                dt += timedelta(days=1)
+            if len(names) == 0:
+                # what BigQuery does when no tables match the range
+                names.append('downloads%s' % end.strftime('%Y%m%d'))
+            return '(%s)' % ' UNION ALL '.join(
+                ['SELECT * FROM "%s"' % n for n in names]
+            )
+
+        query = _DATE_RANGE_RE.sub(date_range, query)
+
+        def flatten(m):
+            values = ' UNION ALL '.join([
+                "SELECT '%s' AS value" % v
+                for v in m.group('values').split(',')
+            ])
+            return '(SELECT %s, _flat.value AS %s %s CROSS JOIN (%s) ' \
+                'AS _flat %s)' % (
+                    m.group('cols'), m.group('name'), m.group('source'),
+                    values, m.group('where')
+                )
+
+        query = _FLATTEN_RE.sub(flatten, query)
+        query = _union_all(query, 'SELECT * FROM %s')
+        return self._nested_column_re.sub(r'"\1"', query)
+
+    def run_query(self, query):
+        """
+        Translate a legacy SQL query to SQLite (see :py:meth:`~._translate`)
+        and run it.
+
+        :param query: the query to run
+        :type query: str
+        :return: generator of per-row result dicts (column name => value)
+        :rtype: ``generator``
+        """
+        logger.debug('Running query: %s', query)
+        query = self._translate(query)
+        logger.debug('Translated query: %s', query)
+        start = datetime.now()
+        cursor = self._get_conn().execute(query)
+        # like legacy SQL, name un-aliased nested columns i.e. file_project
+        fields = [d[0].replace('.', '_') for d in cursor.description]
+        num_rows = 0
+        for row in cursor:
+            num_rows += 1
+            yield dict(zip(fields, row))
+        logger.debug('Query returned %d rows (in %s)', num_rows,
+                     datetime.now() - start)
+
+    def dry_run_query(self, query):
+        """
+        Validate a query by having SQLite ``EXPLAIN`` it. Local queries
+        are free, so this always reports zero bytes processed.
+
+        :param query: the query to dry-run
+        :type query: str
+        :return: 0, or None if a table it queries does not exist
+        :rtype: int
+        """
+        try:
+            self._get_conn().execute('EXPLAIN ' + self._translate(query))
+        except sqlite3.OperationalError as exc:
+            if self.is_table_not_found(exc):
+                return None
+            raise
+        return 0
+
+    def get_table(self, dataset_project, dataset_id, table_id):
+        """
+        Get a table resource for one of the per-day tables. As SQLite does not
+        track modification times, ``lastModifiedTime`` is the newest download
+        timestamp in the table.
+
+        :param dataset_project: ignored
+        :type dataset_project: str
+        :param dataset_id: ignored
+        :type dataset_id: str
+        :param table_id: name of the table
+        :type table_id: str
+        :return: table resource (dict), or None if the table does not exist
+        :rtype: dict
+        """
+        if table_id not in self._table_names():
+            logger.debug('Table %s does not exist', table_id)
+            return None
+        num_rows, newest = self._get_conn().execute(
+            'SELECT COUNT(*), TIMESTAMP_TO_SEC(MAX(timestamp)) FROM "%s"' %
+            table_id
+        ).fetchone()
+        return {
+            'tableReference': {'tableId': table_id},
+            'numRows': '%d' % num_rows,
+            'lastModifiedTime': '%d' % ((newest or 0) * 1000)
+        }
+
+    def list_tables(self, dataset_project, dataset_id):
+        """
+        List the names of all tables in the database.
+
+        :param dataset_project: ignored
+        :type dataset_project: str
+        :param dataset_id: ignored
+        :type dataset_id: str
+        :return: list of table names (strings)
+        :rtype: ``list``
+        """
+        return self._table_names()
+
+    def is_table_not_found(self, exc):
+        """
+        Return True if the specified exception is SQLite telling us that a
+        table does not exist, False otherwise.
+
+        :param exc: exception raised by :py:meth:`~.run_query`
+        :type exc: Exception
+        :return: whether the error is a "table not found" error
+        :rtype: bool
+        """
+        return (
+            isinstance(exc, sqlite3.OperationalError) and
+            str(exc).startswith('no such table')
+        )
+
+    def add_downloads(self, table_name, rows):
+        """
+        Create a per-day download table if it does not exist, and insert rows
+        into it in one transaction.
+
+        :param table_name: table name, i.e. ``downloads20160822``
+        :type table_name: str
+        :param rows: iterable of rows; each a tuple of values for
+          :py:attr:`~.COLUMNS`, in order
+        :type rows: iterable
+        """
+        conn = self._get_conn()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS "%s" (%s)' % (
+                table_name, ', '.join(['"%s" TEXT' % c for c in self.COLUMNS])
+            ))
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS "%s_project" ON "%s" '
+                '("file.project")' % (table_name, table_name)
+            )
+            conn.executemany('INSERT INTO "%s" VALUES (%s)' % (
+                table_name, ', '.join(['?'] * len(self.COLUMNS))
+            ), rows)
+
+    def generate_synthetic_data(self, projects, start_date, num_days,
+                                downloads_per_day, seed=None):
+        """
+        Fill the database with randomly-generated download events for the
+        specified projects, one table per day.
+
+        :param projects: names of the projects to generate downloads of
+        :type projects: ``list``
+        :param start_date: date of the first table to generate
+        :type start_date: datetime.datetime
+        :param num_days: number of days (tables) to generate
+        :type num_days: int
+        :param downloads_per_day: number of download events to generate per
+          day, per project
+        :type downloads_per_day: int
+        :param seed: seed for the random number generator, for repeatable data
+        :type seed: int
+        """
+        rand = random.Random(seed)
+        versions = ['0.%d.%d' % (x, y) for x in range(5) for y in range(4)]
+        installers = [
+            ('pip', '9.0.1'), ('pip', '8.1.2'), ('pip', '1.5.6'),
+            ('setuptools', '28.8.0'), ('bandersnatch', '1.11'), (None, None)
+        ]
+        impls = [
+            ('CPython', '2.7.12'), ('CPython', '3.5.2'), ('CPython', '3.6.0'),
+            ('PyPy', '5.4.1'), (None, None)
+        ]
+        systems = ['Linux', 'Darwin', 'Windows', None]
+        distros = [
+            ('Ubuntu', '16.04'), ('CentOS Linux', '7.2.1511'),
+            ('debian', '8'), ('macOS', '10.12.1'), (None, None)
+        ]
+        countries = ['US', 'DE', 'GB', 'FR', 'JP', 'CN', 'IN', None]
+        for day in range(num_days):
+            dt = start_date + timedelta(days=day)
+            table_name = 'downloads%s' % dt.strftime('%Y%m%d')
+            logger.info('Generating %d downloads for each of %d projects in '
+                        '%s', downloads_per_day, len(projects), table_name)
+            rows = []
+            for project in projects:
+                for _ in range(downloads_per_day):
+                    ts = dt + timedelta(seconds=rand.randint(0, 86399))
+                    inst = rand.choice(installers)
+                    impl = rand.choice(impls)
+                    distro = rand.choice(distros)
+                    rows.append((
+                        ts.strftime('%Y-%m-%d %H:%M:%S'),
+                        rand.choice(countries),
+                        project,
+                        rand.choice(versions),
+                        rand.choice(['sdist', 'bdist_wheel']),
+                        inst[0], inst[1], impl[0], impl[1],
+                        rand.choice(systems),
+                        distro[0], distro[1]
+                    ))
+            self.add_downloads(table_name, rows)
+
+
+class StandardSQLBackend(BigQueryBackend):
+    """
+    Run queries with standard SQL against the single PyPI downloads table
+    (``bigquery-public-data.pypi.file_downloads`` by default), which is
+    partitioned by day on ``timestamp`` and clustered by ``project``, instead
+    of the per-day ``downloadsYYYYMMDD`` tables.
+
+    The legacy SQL that :py:class:`~.DataQuery` generates is translated by
+    :py:meth:`~._translate`, which (like :py:class:`~.SQLiteBackend`) handles
+    only the constructs DataQuery uses. Each per-day table (or
+    ``TABLE_DATE_RANGE``) becomes a subquery filtered to that day's
+    partition(s) and, if the query selects specific projects, to those
+    projects, so BigQuery only reads the clustered blocks holding those
+    projects' downloads instead of the whole day. The table's partitions are
+    presented as ``downloadsYYYYMMDD`` tables by :py:meth:`~.list_tables` and
+    :py:meth:`~.get_table`.
+
+    Note that, as timestamp selects are also restricted to the queried
+    projects, the newest timestamp of single-scan and cube queries is that of
+    the newest download of those projects, not of the whole day's data.
+    """
+
+    _USE_LEGACY_SQL = False
+
+    #: default table to query
+    DEFAULT_TABLE = 'bigquery-public-data.pypi.file_downloads'
+
+    _partition_table_re = re.compile(r'^downloads([0-9]{8})$')
+    _projects_re = re.compile(r"WHERE file\.project IN \(([^)]*)\)")
+    _sample_re = re.compile(r'(ABS\(HASH\(STRING\(timestamp\)\)\)) % ([0-9]+)')
+    # a table reference directly followed by a WHERE clause that samples rows
+    # by a hash of their timestamp (see DataQuery._where_for_projects)
+    _sampled_ref_re = re.compile(
+        r"(?P<ref>\[[\w-]+:\w+\.downloads[0-9]{8}\]|"
+        r"TABLE_DATE_RANGE\(\[[\w-]+:\w+\.downloads\], "
+        r"TIMESTAMP\('[0-9-]+'\), TIMESTAMP\('[0-9-]+'\)\)) "
+        r"(?P<where>WHERE [^\[\]]*?) AND ABS\(HASH\(STRING\(timestamp\)\)\) "
+        r"% (?P<buckets>[0-9]+) < (?P<limit>[0-9]+)"
+    )
+    _tablesample = r'(?: TABLESAMPLE SYSTEM ' \
+        r'\((?P<percent>[0-9.e-]+) PERCENT\))?'
+    _table_ref_re = re.compile(_TABLE_REF_RE.pattern + _tablesample)
+    _date_range_re = re.compile(_DATE_RANGE_RE.pattern + _tablesample)
+    _string_re = re.compile(r'(?<!\w)STRING\(')
+    _select_re = re.compile(r'SELECT (.*?) FROM ')
+    _nested_column_re = re.compile(r'^(?:file|details)(?:\.\w+)+$')
+    # replaced in order; USEC_TO_TIMESTAMP contains SEC_TO_TIMESTAMP
+    _functions = [
+        ('TIMESTAMP_TO_USEC(', 'UNIX_MICROS('),
+        ('USEC_TO_TIMESTAMP(', 'TIMESTAMP_MICROS('),
+        ('TIMESTAMP_TO_SEC(', 'UNIX_SECONDS('),
+        ('SEC_TO_TIMESTAMP(', 'TIMESTAMP_SECONDS('),
+        ('HASH(', 'FARM_FINGERPRINT(')
+    ]
+
+    def __init__(self, project_id, query_concurrency=1, table=None,
+                 discovery_cache_path=None):
+        """
+        Connect to BigQuery.
+
+        :param project_id: the Project ID for the user you're authenticating as;
+          if omitted will attempt to find this in the JSON file at the path
+          specified by the ``GOOGLE_APPLICATION_CREDENTIALS`` environment
+          variable.
+        :type project_id: str
+        :param query_concurrency: number of threads that will be running
+          queries concurrently
+        :type query_concurrency: int
+        :param table: ``project.dataset.table`` ID of the partitioned and
+          clustered downloads table to query; defaults to
+          :py:attr:`~.DEFAULT_TABLE`
+        :type table: str
+        :param discovery_cache_path: if not None, directory to cache the
+          BigQuery API discovery document in
+        :type discovery_cache_path: str
+        """
+        super(StandardSQLBackend, self).__init__(
+            project_id, query_concurrency,
+            discovery_cache_path=discovery_cache_path
+        )
+        if table is None:
+            table = self.DEFAULT_TABLE
+        self.table = table
+
+    @property
+    def identity(self):
+        """
+        Return a string identifying the table this backend queries.
+
+        :return: backend identity
+        :rtype: str
+        """
+        return '%s:%s' % (self.__class__.__name__, self.table)
+
+    def _from_partitions(self, start_date, end_date, projects, percent=None):
+        """
+        Return a subquery selecting the downloads from ``start_date`` to
+        ``end_date`` (inclusive) from ``self.table``, filtered such that
+        BigQuery prunes partitions by date and blocks by project.
+
+        :param start_date: first date (``YYYY-MM-DD``)
+        :type start_date: str
+        :param end_date: last date (``YYYY-MM-DD``)
+        :type end_date: str
+        :param projects: quoted, comma-separated project names to select, or
+          None to select all
+        :type projects: str
+        :param percent: if not None, only read a random sample of about this
+          percentage of the table's storage blocks, with ``TABLESAMPLE``
+        :type percent: str
+        :return: standard SQL subquery
+        :rtype: str
+        """
+        end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+        where = "timestamp >= TIMESTAMP('%s') AND timestamp < " \
+            "TIMESTAMP('%s')" % (start_date, end.strftime('%Y-%m-%d'))
+        if projects is not None:
+            where += ' AND project IN (%s)' % projects
+        table = '`%s`' % self.table
+        if percent is not None:
+            table += ' TABLESAMPLE SYSTEM (%s PERCENT)' % percent
+        return '(SELECT * FROM %s WHERE %s)' % (table, where)
+
+    @staticmethod
+    def _table_sample(m):
+        """
+        Replace a legacy SQL sampling condition on the rows read from a table
+        (see :py:attr:`~._sampled_ref_re`) with a ``TABLESAMPLE`` clause on the
+        table reference, for the same fraction, so that BigQuery only reads
+        (and bills for) the sampled blocks.
+
+        :param m: the match of :py:attr:`~._sampled_ref_re`
+        :type m: ``re.MatchObject``
+        :return: the table reference and WHERE clause
+        :rtype: str
+        """
+        percent = 100.0 * int(m.group('limit')) / int(m.group('buckets'))
+        return '%s TABLESAMPLE SYSTEM (%g PERCENT) %s' % (
+            m.group('ref'), percent, m.group('where')
+        )
+
+    def _alias_columns(self, select):
+        """
+        Alias the un-aliased nested columns in a select list with the names
+        legacy SQL gives them, i.e. ``file.project AS file_project``; standard
+        SQL would name that column ``project``.
+
+        :param select: the match of :py:attr:`~._select_re`
+        :type select: ``re.MatchObject``
+        :return: the select list with columns aliased
+        :rtype: str
+        """
+        items = select.group(1).split(', ')
+        for idx, item in enumerate(items):
+            if self._nested_column_re.match(item):
+                items[idx] = '%s AS %s' % (item, item.replace('.', '_'))
+        return 'SELECT %s FROM ' % ', '.join(items)
+
+    def _cast_strings(self, query):
+        """
+        Replace every legacy SQL ``STRING(x)`` call with ``CAST(x AS STRING)``.
+
+        :param query: query text
+        :type query: str
+        :return: query text
+        :rtype: str
+        """
+        while True:
+            m = self._string_re.search(query)
+            if m is None:
+                return query
+            depth = 0
+            for idx in range(m.end() - 1, len(query)):
+                if query[idx] == '(':
+                    depth += 1
+                elif query[idx] == ')':
+                    depth -= 1
+                    if depth == 0:
+                        break
+            query = '%sCAST(%s AS STRING)%s' % (
+                query[:m.start()], query[m.end():idx], query[idx + 1:]
+            )
+
+    def _translate(self, query):
+        """
+        Translate a legacy SQL query, as generated by :py:class:`~.DataQuery`,
+        to standard SQL against ``self.table``.
+
+        - Un-aliased nested columns in select lists are aliased as legacy SQL
+          names them (see :py:meth:`~._alias_columns`).
+        - ``FLATTEN()`` of a ``SPLIT()`` constant becomes a cross join with
+          ``UNNEST()`` of it.
+        - A comma-separated union of subqueries becomes a ``UNION ALL``.
+        - ``[project:dataset.downloadsYYYYMMDD]`` references and
+          ``TABLE_DATE_RANGE()`` become a subquery of the matching partitions
+          of ``self.table`` (see :py:meth:`~._from_partitions`), restricted
+          to the projects in the query's ``file.project IN (...)`` filter.
+        - Sampling by a hash of the timestamp in a table's WHERE clause
+          becomes ``TABLESAMPLE SYSTEM`` on the table (see
+          :py:meth:`~._table_sample`); sampled rows are then chosen by
+          storage block, at random, rather than deterministically.
+        - Legacy SQL functions and the ``%`` operator are replaced with their
+          standard SQL equivalents.
+
+        :param query: legacy SQL query
+        :type query: str
+        :return: standard SQL query
+        :rtype: str
+        """
+        projects = None
+        m = self._projects_re.search(query)
+        if m is not None:
+            projects = m.group(1)
+        query = self._sampled_ref_re.sub(self._table_sample, query)
+        query = self._select_re.sub(self._alias_columns, query)
+
+        def flatten(m):
+            return "(SELECT %s, %s %s CROSS JOIN UNNEST(SPLIT('%s', ',')) " \
+                "AS %s %s)" % (
+                    m.group('cols'), m.group('name'), m.group('source'),
+                    m.group('values'), m.group('name'), m.group('where')
+                )
+
+        query = _FLATTEN_RE.sub(flatten, query)
+        query = _union_all(query, '%s')
+
+        def table_ref(m):
+            date = datetime.strptime(m.group(1)[-8:], '%Y%m%d').strftime(
+                '%Y-%m-%d')
+            return self._from_partitions(
+                date, date, projects, m.group('percent')
+            )
+
+        query = self._table_ref_re.sub(table_ref, query)
+        query = self._date_range_re.sub(
+            lambda m: self._from_partitions(
+                m.group(1), m.group(2), projects, m.group('percent')
+            ),
+            query
+        )
+        query = self._sample_re.sub(r'MOD(\1, \2)', query)
+        query = self._cast_strings(query)
+        for legacy, standard in self._functions:
+            query = query.replace(legacy, standard)
+        return query
+
+    def run_query(self, query):
+        """
+        Translate a legacy SQL query to standard SQL (see
+        :py:meth:`~._translate`) and run it.
+
+        :param query: the query to run
+        :type query: str
+        :return: generator of per-row response dicts (key => value)
+        :rtype: ``generator``
+        """
+        return super(StandardSQLBackend, self).run_query(
+            self._translate(query)
+        )
+
+    def dry_run_query(self, query):
+        """
+        Translate a legacy SQL query to standard SQL (see
+        :py:meth:`~._translate`) and dry-run it.
+
+        :param query: the query to dry-run
+        :type query: str
+        :return: number of bytes the query would process, or None if the
+          table does not exist
+        :rtype: int
+        """
+        return super(StandardSQLBackend, self).dry_run_query(
+            self._translate(query)
+        )
+
+    def _partitions(self, partition_id=None):
+        """
+        Query ``INFORMATION_SCHEMA.PARTITIONS`` for the daily partitions of
+        ``self.table``.
+
+        :param partition_id: if not None, only return this partition
+          (``YYYYMMDD``)
+        :type partition_id: str
+        :return: list of dicts with ``partition_id``, ``total_rows`` and
+          ``last_modified`` (milliseconds since the epoch) keys, in partition
+          order
+        :rtype: ``list``
+        """
+        dataset, table_name = self.table.rsplit('.', 1)
+        where = "table_name = '%s'" % table_name
+        if partition_id is None:
+            where += " AND REGEXP_CONTAINS(partition_id, r'^[0-9]{8}$')"
+        else:
+            where += " AND partition_id = '%s'" % partition_id
+        return list(super(StandardSQLBackend, self).run_query(
+            'SELECT partition_id, total_rows, '
+            'UNIX_MILLIS(last_modified_time) AS last_modified '
+            'FROM `%s.INFORMATION_SCHEMA.PARTITIONS` WHERE %s '
+            'ORDER BY partition_id;' % (dataset, where)
+        ))
+
+    def get_table(self, dataset_project, dataset_id, table_id):
+        """
+        Get a table resource for one day's partition of ``self.table``, as if
+        it were a ``downloadsYYYYMMDD`` table (``dataset_project`` and
+        ``dataset_id`` are ignored).
+
+        :param dataset_project: ignored
+        :type dataset_project: str
+        :param dataset_id: ignored
+        :type dataset_id: str
+        :param table_id: name of the table, ``downloadsYYYYMMDD``
+        :type table_id: str
+        :return: dict with ``lastModifiedTime`` and ``numRows`` keys, or None
+          if the partition does not exist
+        :rtype: dict
+        """
+        m = self._partition_table_re.match(table_id)
+        if m is None:
+            return None
+        res = self._partitions(m.group(1))
+        if len(res) == 0:
+            logger.debug('Partition %s does not exist', m.group(1))
+            return None
+        return {
+            'lastModifiedTime': res[0]['last_modified'],
+            'numRows': res[0]['total_rows']
+        }
+
+    def list_tables(self, dataset_project, dataset_id):
+        """
+        List the daily partitions of ``self.table`` as ``downloadsYYYYMMDD``
+        table names (``dataset_project`` and ``dataset_id`` are ignored).
+
+        :param dataset_project: ignored
+        :type dataset_project: str
+        :param dataset_id: ignored
+        :type dataset_id: str
+        :return: list of table names (strings)
+        :rtype: ``list``
+        """
+        return ['downloads%s' % r['partition_id'] for r in self._partitions()]
+
+
+class CachingBackend(QueryBackend):
+    """
+    Wrap another :py:class:`~.QueryBackend`, persisting query results on disk
+    keyed by a hash of the wrapped backend's :py:attr:`~.QueryBackend.identity`
+    and the (whitespace-normalized) query text, so identical queries - i.e.
+    when re-running after a crash mid-backfill - are answered locally instead
+    of being run (and paid for) again. The same query text run by different
+    backends (i.e. legacy and standard SQL, or against another table) does not
+    share results.
+
+    Only the results of queries against closed days' tables (those more than
+    :py:attr:`~._OPEN_DAYS` days old, which no longer change) are cached
+    indefinitely. Results of other queries are only cached if
+    ``mutable_ttl`` is set, and only for that long. When the backend is
+    created (i.e. once per run), least-recently-used results are evicted if
+    the cache has grown beyond ``max_bytes``, and results not used for
+    ``max_age`` are evicted regardless.
+    """
+
+    # tables for this many of the most recent days (today and yesterday, UTC)
+    # may still be receiving data
+    _OPEN_DAYS = 2
+
+    _table_date_re = re.compile(r'\.downloads([0-9]{8})\]')
+    _range_end_re = re.compile(
+        r"TABLE_DATE_RANGE\(\[[\w-]+:\w+\.downloads\], "
+        r"TIMESTAMP\('[0-9-]+'\), TIMESTAMP\('([0-9-]+)'\)\)"
+    )
+
+    def __init__(self, backend, cache_path, max_bytes=1024 ** 3,
+                 max_age=timedelta(days=90), mutable_ttl=None):
+        """
+        :param backend: the backend to run queries against on a cache miss
+        :type backend: :py:class:`~.QueryBackend`
+        :param cache_path: directory to store query results in
+        :type cache_path: str
+        :param max_bytes: maximum total size of cached results
+        :type max_bytes: int
+        :param max_age: evict results not used for this long
+        :type max_age: datetime.timedelta
+        :param mutable_ttl: if not None, also cache the results of queries
+          against tables that may still change, for this long
+        :type mutable_ttl: datetime.timedelta
+        """
+        self.backend = backend
+        self.cache_path = os.path.abspath(os.path.expanduser(cache_path))
+        if not os.path.exists(self.cache_path):
+            logger.debug('Creating query result cache directory: %s',
+                         self.cache_path)
+            os.makedirs(self.cache_path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.mutable_ttl = mutable_ttl
+        self.evict()
+
+    @staticmethod
+    def _normalize(query):
+        """
+        Normalize a query's text for hashing: collapse whitespace and remove
+        any trailing semicolon.
+
+        :param query: query text
+        :type query: str
+        :return: normalized query
+        :rtype: str
+        """
+        return ' '.join(query.split()).rstrip(';').rstrip()
+
+    def _path_for_query(self, query):
+        """
+        Return the path of the cached result file for a query.
+
+        :param query: query text
+        :type query: str
+        :return: path to the result file
+        :rtype: str
+        """
+        key = hashlib.sha256(('%s\n%s' % (
+            self.backend.identity, self._normalize(query)
+        )).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_path, '%s.json' % key)
+
+    def _is_immutable(self, query):
+        """
+        Return True if a query only reads tables for closed days, whose data
+        will not change, False otherwise (including if we can't tell).
+
+        :param query: query text
+        :type query: str
+        :return: whether the query's result can be cached indefinitely
+        :rtype: bool
+        """
+        dates = [
+            datetime.strptime(d, '%Y%m%d')
+            for d in self._table_date_re.findall(query)
+        ] + [
+            datetime.strptime(d, '%Y-%m-%d')
+            for d in self._range_end_re.findall(query)
+        ]
+        if len(dates) == 0:
+            return False
+        newest_closed = datetime.utcnow().replace(
+            hour=0, minute=0, second=0, microsecond=0
+        ) - timedelta(days=self._OPEN_DAYS)
+        return max(dates) <= newest_closed
+
+    def _lookup(self, query):
+        """
+        Return the path of a usable cached result for a query, marking it as
+        recently used, or None if there is none.
+
+        :param query: query text
+        :type query: str
+        :return: path to the result file, or None
+        :rtype: str
+        """
+        path = self._path_for_query(query)
+        try:
+            with open(path, 'r') as fh:
+                meta = json.loads(fh.readline())
+        except (IOError, OSError, ValueError):
+            return None
+        if (
+            meta.get('query') != self._normalize(query) or
+            meta.get('backend') != self.backend.identity
+        ):
+            logger.warning('Query result cache hash collision for %s', path)
+            return None
+        if not meta.get('immutable', False) and (
+            self.mutable_ttl is None or
+            time.time() - meta.get('created', 0) >
+            self.mutable_ttl.total_seconds()
+        ):
+            return None
+        try:
+            # file modification time is our "last used" time, for eviction
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def run_query(self, query):
+        """
+        Return the cached result of a query if there is one; otherwise run it
+        with the wrapped backend, caching the result if it is cacheable. Rows
+        are streamed to the cache file as they are returned, and the file is
+        only put in place once the whole result has been read.
+
+        :param query: the query to run
+        :type query: str
+        :return: generator of per-row result dicts (column name => value)
+        :rtype: ``generator``
+        """
+        path = self._lookup(query)
+        if path is not None:
+            logger.info('Using cached result for query (%s)',
+                        os.path.basename(path))
+            with open(path, 'r') as fh:
+                fh.readline()
+                for line in fh:
+                    yield json.loads(line)
+            return
+        immutable = self._is_immutable(query)
+        if not immutable and self.mutable_ttl is None:
+            for row in self.backend.run_query(query):
+                yield row
+            return
+        path = self._path_for_query(query)
+        tmp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'w') as fh:
+                fh.write(json.dumps({
+                    'backend': self.backend.identity,
+                    'query': self._normalize(query),
+                    'created': time.time(),
+                    'immutable': immutable
+                }) + '\n')
+                for row in self.backend.run_query(query):
+                    fh.write(json.dumps(row) + '\n')
+                    yield row
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def evict(self):
+        """
+        Remove cached results not used for longer than ``self.max_age``, and
+        then the least-recently-used results until the total size of the cache
+        is no more than ``self.max_bytes``. This lists and stats every cached
+        result, so it is only called when the backend is created.
+        """
+        entries = []
+        now = time.time()
+        for fname in os.listdir(self.cache_path):
+            if not fname.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_path, fname)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        total = sum([e[1] for e in entries])
+        for mtime, size, path in entries:
+            if (
+                now - mtime <= self.max_age.total_seconds() and
+                total <= self.max_bytes
+            ):
+                break
+            logger.debug('Evicting cached query result %s', path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def dry_run_query(self, query):
+        """
+        Dry-run a query with the wrapped backend; if its result is cached, it
+        will not be run, so report zero bytes processed.
+
+        :param query: the query to dry-run
+        :type query: str
+        :return: number of bytes the query would process, or None if a table it
+          queries does not exist
+        :rtype: int
+        """
+        if self._lookup(query) is not None:
+            return 0
+        return self.backend.dry_run_query(query)
+
+    def get_table(self, dataset_project, dataset_id, table_id):
+        """
+        Get the table resource for one table, from the wrapped backend.
+
+        :param dataset_project: ID of the project the dataset belongs to
+        :type dataset_project: str
+        :param dataset_id: ID of the dataset the table is in
+        :type dataset_id: str
+        :param table_id: name of the table
+        :type table_id: str
+        :return: table resource (dict), or None if the table does not exist
+        :rtype: dict
+        """
+        return self.backend.get_table(dataset_project, dataset_id, table_id)
+
+    def list_tables(self, dataset_project, dataset_id):
+        """
+        List the names of all tables in a dataset, from the wrapped backend.
+
+        :param dataset_project: ID of the project the dataset belongs to
+        :type dataset_project: str
+        :param dataset_id: ID of the dataset
+        :type dataset_id: str
+        :return: list of table names (strings)
+        :rtype: ``list``
+        """
+        return self.backend.list_tables(dataset_project, dataset_id)
+
+    def is_table_not_found(self, exc):
+        """
+        Return True if the specified exception means that a table queried does
+        not exist, according to the wrapped backend.
+
+        :param exc: exception raised by :py:meth:`~.run_query`
+        :type exc: Exception
+        :return: whether the error is a "table not found" error
+        :rtype: bool
+        """
+        return self.backend.is_table_not_found(exc)
@@ -45,10 +45,16 @@ try:
 except ImportError:
     import xmlrpc.client as xmlrpclib
 
-from pypi_download_stats.dataquery import DataQuery
+from pypi_download_stats.dataquery import DataQuery, USD_PER_TIB
+from pypi_download_stats.arrowdatacache import ArrowDataCache
 from pypi_download_stats.diskdatacache import DiskDataCache
 from pypi_download_stats.outputgenerator import OutputGenerator
 from pypi_download_stats.projectstats import ProjectStats
+from pypi_download_stats.serializers import SERIALIZERS
+from pypi_download_stats.sqlitedatacache import SQLiteDataCache
+from pypi_download_stats.querybackends import (BigQueryBackend, CachingBackend,
+                                               SQLiteBackend,
+                                               StandardSQLBackend)
 from pypi_download_stats.version import PROJECT_URL, VERSION
 
 FORMAT = "[%(asctime)s %(levelname)s] %(message)s"
@@ -66,6 +72,46 @@ oauth2client_log.setLevel(logging.WARNING)
 oauth2client_log.propagate = True
 
 
+def _dimension_list(value):
+    """
+    Argparse type for ``--dimensions``; convert a comma-separated list of
+    breakdown names (i.e. ``version,implementation``) to a list of the
+    corresponding cache record keys (``by_version``, ``by_implementation``).
+
+    :param value: option value
+    :type value: str
+    :return: list of breakdown names
+    :rtype: ``list``
+    """
+    dims = ['by_%s' % x.strip() for x in value.split(',') if x.strip() != '']
+    unknown = [
+        x[3:] for x in dims if x not in DataQuery._DIMENSION_COLUMNS
+    ]
+    if len(dims) == 0 or len(unknown) > 0:
+        raise argparse.ArgumentTypeError(
+            'invalid dimension(s) "%s"; must be a comma-separated list of: '
+            '%s' % (value, ', '.join([
+                x[3:] for x in DataQuery._DIMENSION_COLUMNS
+            ]))
+        )
+    return dims
+
+
+def _compression(value):
+    """
+    Convert the value of a ``--cache-compression`` option to the
+    ``compression`` argument of :py:class:`~.DiskDataCache`.
+
+    :param value: option value
+    :type value: str
+    :return: compression name, or None for no compression
+    :rtype: str
+    """
+    if value == 'none':
+        return None
+    return value
+
+
 def parse_args(argv):
     """
     Use Argparse to parse command-line arguments.
@@ -104,11 +150,127 @@ def parse_args(argv):
     p.add_argument('-c', '--cache-dir', dest='cache_dir', action='store',
                    type=str, default='./pypi-stats-cache',
                    help='stats cache directory (default: ./pypi-stats-cache)')
+    cf = p.add_mutually_exclusive_group()
+    cf.add_argument('--cache-db', dest='cache_db', action='store', type=str,
+                    default=None,
+                    help='store cached stats in this SQLite database, instead '
+                         'of one JSON file per project per day in the cache '
+                         'directory (which is still used for query results)')
+    cf.add_argument('--arrow-cache', dest='arrow_cache', action='store_true',
+                    default=False,
+                    help='store cached stats in columnar Arrow files, one '
+                         'directory per project in the cache directory, '
+                         'instead of one JSON file per project per day '
+                         '(requires pyarrow)')
+    p.add_argument('--migrate-cache', dest='migrate_cache',
+                   action='store_true', default=False,
+                   help='copy all cached stats from the cache directory\'s '
+                        'JSON files into the --cache-db database or '
+                        '--arrow-cache files, then exit')
+    p.add_argument('--cache-compression', dest='cache_compression',
+                   action='store', type=str, default='none',
+                   choices=['none', 'gzip', 'zstd'],
+                   help='compression for cache files written to the cache '
+                        'directory; files are read however they were '
+                        'written (zstd requires zstandard; default: none)')
+    p.add_argument('--cache-serializer', dest='cache_serializer',
+                   action='store', type=str, default='json',
+                   choices=list(SERIALIZERS.keys()),
+                   help='serializer for cache files written to the cache '
+                        'directory; files are read however they were '
+                        'written (orjson and msgpack require the package of '
+                        'the same name; default: json)')
+    p.add_argument('--recompress', dest='recompress', action='store_true',
+                   default=False,
+                   help='rewrite every cache file in the cache directory '
+                        'with --cache-compression and --cache-serializer, '
+                        'then exit (not with --arrow-cache)')
+    p.add_argument('--rebuild-index', dest='rebuild_index',
+                   action='store_true', default=False,
+                   help='rebuild the cache directory\'s date index from its '
+                        'cache files (e.g. after adding or removing files by '
+                        'hand), then exit (not with --arrow-cache)')
     p.add_argument('-B', '--backfill-num-days', dest='backfill_days', type=int,
                    action='store', default=7,
                    help='number of days of historical data to backfill, if '
                         'missing (defaut: 7). Note this may incur BigQuery '
                         'charges. Set to -1 to backfill all available history.')
+    p.add_argument('--single-scan', dest='single_scan', action='store_true',
+                   default=False,
+                   help='compute all breakdowns for a day with one query (one '
+                        'table scan) instead of one query per breakdown')
+    p.add_argument('--backfill-range-days', dest='backfill_range_days',
+                   type=int, action='store', default=1,
+                   help='when backfilling history, query up to this many '
+                        'consecutive missing days with one query (default: '
+                        '1, one query batch per day)')
+    p.add_argument('--query-concurrency', dest='query_concurrency', type=int,
+                   action='store', default=1,
+                   help='number of days (or date ranges) to query '
+                        'concurrently (default: 1)')
+    p.add_argument('--incremental', dest='incremental', action='store_true',
+                   default=False,
+                   help='when re-querying today/yesterday, only query '
+                        'downloads newer than the cached data and add them '
+                        'to the cached counts')
+    p.add_argument('--cube', dest='cube', action='store_true', default=False,
+                   help='query one fine-grained count per project per day, '
+                        'grouped by every breakdown column, cache it, and '
+                        'derive all breakdowns from it locally')
+    p.add_argument('--project-batch-size', dest='project_batch_size',
+                   type=int, action='store', default=None,
+                   help='query for at most this many projects per query; '
+                        'longer project lists (i.e. from -U) are queried in '
+                        'batches. Each batch scans the full table, so this '
+                        'increases query cost (default: only split very long '
+                        'lists)')
+    p.add_argument('--top-k', dest='top_k', type=int, action='store',
+                   default=None,
+                   help='only cache counts for this many versions, '
+                        'installers, distros etc. with the most downloads per '
+                        'project per day, and sum the rest into "other" '
+                        '(default: keep all)')
+    p.add_argument('--dimensions', dest='dimensions', type=_dimension_list,
+                   action='store', default=None,
+                   help='comma-separated list of the breakdowns to query and '
+                        'graph, of: version, file_type, installer, '
+                        'implementation, system, distro, country; cached '
+                        'data for the others is kept (default: all)')
+    p.add_argument('--sample-rate', dest='sample_rate', type=float,
+                   action='store', default=None,
+                   help='for quick previews, only count this fraction (e.g. '
+                        '0.01) of downloads and scale the counts up; the '
+                        'cached data is marked approximate and replaced by '
+                        'the next run without this option. Only reduces the '
+                        'bytes billed with --standard-sql, which samples the '
+                        'table\'s storage blocks with TABLESAMPLE.')
+    p.add_argument('--plan', dest='plan', action='store_true', default=False,
+                   help='do not query or generate; list the queries that '
+                        'would be run, with the bytes each would process and '
+                        'estimated cost (via free BigQuery dry-run jobs)')
+    p.add_argument('--max-bytes', dest='max_bytes', type=int, action='store',
+                   default=None,
+                   help='dry-run all queries first, and abort without '
+                        'querying if they would process more than this many '
+                        'bytes in total')
+    p.add_argument('--result-cache', dest='result_cache',
+                   action='store_true', default=False,
+                   help='store the results of queries against tables more '
+                        'than two days old in the cache directory, and reuse '
+                        'them when the identical query is run again against '
+                        'the same table, e.g. after a failed backfill (never '
+                        'with --sqlite-db)')
+    p.add_argument('--standard-sql', dest='standard_sql', action='store_true',
+                   default=False,
+                   help='query the partitioned and project-clustered '
+                        'bigquery-public-data.pypi.file_downloads table with '
+                        'standard SQL, instead of the per-day tables; only '
+                        'the queried projects\' data is scanned')
+    p.add_argument('--sqlite-db', dest='sqlite_db', action='store', type=str,
+                   default=None,
+                   help='run queries against a local SQLite database of '
+                        'download events (i.e. synthetic data for offline '
+                        'runs and benchmarks) instead of BigQuery')
     g = p.add_mutually_exclusive_group()
     g.add_argument('-P', '--project', dest='PROJECT', action='append', type=str,
                    help='project name to query/generate stats for (can be '
@@ -118,6 +280,11 @@ def parse_args(argv):
                    help='Run for all PyPI projects owned by the specified'
                         'user.')
     args = p.parse_args(argv)
+    if args.migrate_cache and args.cache_db is None and not args.arrow_cache:
+        p.error('--migrate-cache requires --cache-db or --arrow-cache')
+    if args.arrow_cache and (args.recompress or args.rebuild_index):
+        p.error('--recompress and --rebuild-index only apply to the JSON '
+                'cache files, not --arrow-cache')
     return args
 
 
@@ -167,6 +334,44 @@ def _pypi_get_projects_for_user(username):
     return [x[1] for x in pkgs]
 
 
+def _format_bytes(num_bytes):
+    """
+    Format a number of bytes as a human-readable string.
+
+    :param num_bytes: number of bytes
+    :type num_bytes: int
+    :return: human-readable size
+    :rtype: str
+    """
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if num_bytes < 1024.0:
+            return '%.1f %s' % (num_bytes, unit)
+        num_bytes /= 1024.0
+    return '%.1f TiB' % num_bytes
+
+
+def print_query_plan(plan):
+    """
+    Print a query plan, as returned by :py:meth:`~.DataQuery.plan_queries`,
+    to STDOUT.
+
+    :param plan: query plan
+    :type plan: ``list``
+    """
+    total = 0
+    for entry in plan:
+        if entry['bytes'] is None:
+            size = 'table not found'
+        else:
+            size = _format_bytes(entry['bytes'])
+            total += entry['bytes']
+        print('%s %s: %s' % (entry['target'], entry['description'], size))
+    print('Total: %d queries, %s (%d bytes); estimated cost: $%.2f' % (
+        len(plan), _format_bytes(total), total,
+        (total / (1024.0 ** 4)) * USD_PER_TIB
+    ))
+
+
 def main(args=None):
     """
     Main entry point
@@ -183,14 +388,78 @@ def main(args=None):
 
     outpath = os.path.abspath(os.path.expanduser(args.out_dir))
     cachepath = os.path.abspath(os.path.expanduser(args.cache_dir))
-    cache = DiskDataCache(cache_path=cachepath)
+    cache = DiskDataCache(
+        cache_path=cachepath,
+        compression=_compression(args.cache_compression),
+        serializer=args.cache_serializer
+    )
+    if args.recompress:
+        count = cache.recompress()
+        print('Recompressed %d cache record(s) in %s' % (count, cachepath))
+        raise SystemExit(0)
+    if args.rebuild_index:
+        count = cache.rebuild_index()
+        print('Indexed %d cache record(s) in %s' % (count, cachepath))
+        raise SystemExit(0)
+    if args.cache_db is not None or args.arrow_cache:
+        if args.cache_db is not None:
+            new_cache = SQLiteDataCache(args.cache_db)
+            dest = new_cache.db_path
+        else:
+            new_cache = ArrowDataCache(cachepath)
+            dest = 'Arrow files'
+        if args.migrate_cache:
+            count = new_cache.migrate(cache)
+            print('Migrated %d cache record(s) from %s to %s' % (
+                count, cachepath, dest
+            ))
+            raise SystemExit(0)
+        cache = new_cache
 
     if args.user:
         args.PROJECT = _pypi_get_projects_for_user(args.user)
 
     if args.query:
-        DataQuery(args.project_id, args.PROJECT, cache).run_queries(
-            backfill_num_days=args.backfill_days)
+        if args.sqlite_db is not None:
+            backend = SQLiteBackend(
+                os.path.abspath(os.path.expanduser(args.sqlite_db))
+            )
+        elif args.standard_sql:
+            backend = StandardSQLBackend(
+                args.project_id, args.query_concurrency,
+                discovery_cache_path=os.path.join(cachepath, '_discovery')
+            )
+        else:
+            backend = BigQueryBackend(
+                args.project_id, args.query_concurrency,
+                discovery_cache_path=os.path.join(cachepath, '_discovery')
+            )
+        if args.result_cache and args.sqlite_db is None:
+            # local SQLite queries are cheap, and its results must not be
+            # mistaken for those of the real dataset
+            backend = CachingBackend(
+                backend, os.path.join(cachepath, '_query_results')
+            )
+        dq = DataQuery(
+            args.project_id, args.PROJECT, cache,
+            single_scan=args.single_scan,
+            backfill_range_days=args.backfill_range_days,
+            query_concurrency=args.query_concurrency,
+            max_bytes=args.max_bytes,
+            incremental=args.incremental,
+            cube=args.cube,
+            backend=backend,
+            project_batch_size=args.project_batch_size,
+            sample_rate=args.sample_rate,
+            top_k=args.top_k,
+            dimensions=args.dimensions
+        )
+        if args.plan:
+            print_query_plan(
+                dq.plan_queries(backfill_num_days=args.backfill_days)
+            )
+            raise SystemExit(0)
+        dq.run_queries(backfill_num_days=args.backfill_days)
     else:
         logger.warning('Query disabled by command-line flag; operating on '
                        'cached data only.')
@@ -200,9 +469,11 @@ def main(args=None):
         raise SystemExit(0)
     for proj in args.PROJECT:
         logger.info('Generating output for: %s', proj)
-        stats = ProjectStats(proj, cache)
+        stats = ProjectStats(proj, cache, dimensions=args.dimensions)
         outdir = os.path.join(outpath, proj)
-        OutputGenerator(proj, stats, outdir).generate()
+        OutputGenerator(
+            proj, stats, outdir, dimensions=args.dimensions
+        ).generate()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import json
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JSONSerializer(object):
+    """
+    Serializes cache records as JSON with the standard library ``json``
+    module. Also the base class, and interface, of the other serializers.
+    """
+
+    #: name of the serializer, as passed to :py:func:`~.get_serializer`
+    name = 'json'
+
+    #: file name extension of records written with this serializer (before
+    #: any compression extension); records are read back with a serializer
+    #: for their extension
+    extension = '.json'
+
+    def dumps(self, data):
+        """
+        Serialize a cache record.
+
+        :param data: cache record
+        :type data: dict
+        :return: serialized record
+        :rtype: bytes
+        """
+        return json.dumps(data).encode('utf-8')
+
+    def loads(self, raw):
+        """
+        Deserialize a cache record.
+
+        :param raw: serialized record
+        :type raw: bytes
+        :return: cache record
+        :rtype: dict
+        """
+        return json.loads(raw.decode('utf-8'))
+
+
+class OrjsonSerializer(JSONSerializer):
+    """
+    Serializes cache records as JSON, identical in content to
+    :py:class:`~.JSONSerializer` output, with the much faster ``orjson``
+    package. Requires ``orjson``.
+    """
+
+    name = 'orjson'
+    extension = '.json'
+
+    def __init__(self):
+        if orjson is None:
+            raise Exception('ERROR: the orjson cache serializer requires '
+                            'orjson; please "pip install orjson"')
+
+    def dumps(self, data):
+        """
+        Serialize a cache record. As with ``json``, ``None`` keys are written
+        as ``null``.
+
+        :param data: cache record
+        :type data: dict
+        :return: serialized record
+        :rtype: bytes
+        """
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, raw):
+        """
+        Deserialize a cache record.
+
+        :param raw: serialized record
+        :type raw: bytes
+        :return: cache record
+        :rtype: dict
+        """
+        return orjson.loads(raw)
+
+
+class MsgpackSerializer(JSONSerializer):
+    """
+    Serializes cache records as MessagePack, which is more compact and faster
+    to decode than JSON. Requires ``msgpack``.
+    """
+
+    name = 'msgpack'
+    extension = '.msgpack'
+
+    def __init__(self):
+        if msgpack is None:
+            raise Exception('ERROR: the msgpack cache serializer requires '
+                            'msgpack; please "pip install msgpack"')
+
+    @classmethod
+    def _json_keys(cls, data):
+        """
+        Return a copy of ``data`` with every dict key converted to a string
+        as ``json`` would (i.e. ``None`` to ``null``), so that records read
+        back are the same as those written by :py:class:`~.JSONSerializer`.
+
+        :param data: cache record, or part of one
+        :return: converted copy
+        """
+        if isinstance(data, dict):
+            return {
+                cls._json_key(k): cls._json_keys(v) for k, v in data.items()
+            }
+        if isinstance(data, (list, tuple)):
+            return [cls._json_keys(x) for x in data]
+        return data
+
+    @staticmethod
+    def _json_key(key):
+        """
+        Convert one dict key to a string as ``json`` would.
+
+        :param key: dict key
+        :return: string key
+        :rtype: str
+        """
+        if key is None or isinstance(key, (bool, int, float)):
+            return json.dumps(key)
+        return key
+
+    def dumps(self, data):
+        """
+        Serialize a cache record.
+
+        :param data: cache record
+        :type data: dict
+        :return: serialized record
+        :rtype: bytes
+        """
+        return msgpack.packb(self._json_keys(data), use_bin_type=True)
+
+    def loads(self, raw):
+        """
+        Deserialize a cache record.
+
+        :param raw: serialized record
+        :type raw: bytes
+        :return: cache record
+        :rtype: dict
+        """
+        return msgpack.unpackb(raw, raw=False)
+
+
+#: serializer classes, by name
+SERIALIZERS = OrderedDict([
+    (cls.name, cls) for cls in [
+        JSONSerializer, OrjsonSerializer, MsgpackSerializer
+    ]
+])
+
+
+def get_serializer(name):
+    """
+    Return an instance of the named serializer.
+
+    :param name: serializer name; one of the keys of :py:data:`~.SERIALIZERS`
+    :type name: str
+    :return: serializer instance
+    :rtype: :py:class:`~.JSONSerializer`
+    """
+    if name not in SERIALIZERS:
+        raise Exception('ERROR: unknown cache serializer: %s' % name)
+    return SERIALIZERS[name]()
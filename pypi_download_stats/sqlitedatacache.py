@@ -0,0 +1,361 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import logging
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from pypi_download_stats.diskdatacache import DiskDataCache
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteDataCache(object):
+    """
+    Drop-in alternative to :py:class:`~.DiskDataCache` that stores every cache
+    record (and piece of non-project state) in one SQLite database, keyed by
+    (project, date), instead of one JSON file per project per day. The
+    database is used in WAL mode, so readers do not block the writer, and
+    :py:meth:`~.set_many` writes all of its records in one transaction.
+    """
+
+    # maximum number of dates per query in :py:meth:`~.get_many`, to stay
+    # under SQLite's limit on the number of query parameters
+    _MAX_QUERY_DATES = 500
+
+    def __init__(self, db_path):
+        """
+        Connect to (or create) the cache database.
+
+        :param db_path: path to the SQLite database file. Each thread uses its
+          own connection, so this should not be ``:memory:`` when querying
+          concurrently.
+        :type db_path: str
+        """
+        if db_path != ':memory:':
+            db_path = os.path.abspath(os.path.expanduser(db_path))
+            db_dir = os.path.dirname(db_path)
+            if not os.path.exists(db_dir):
+                logger.debug('Creating cache directory: %s', db_dir)
+                os.makedirs(db_dir)
+        self.db_path = db_path
+        self._thread_local = threading.local()
+        with self._get_conn() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS records (project TEXT NOT NULL, '
+                'date TEXT NOT NULL, record TEXT NOT NULL, '
+                'PRIMARY KEY (project, date))'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS state (name TEXT NOT NULL '
+                'PRIMARY KEY, data TEXT NOT NULL)'
+            )
+        logger.info('Initialized SQLiteDataCache db_path=%s', db_path)
+
+    def _get_conn(self):
+        """
+        Return the database connection for the current thread, connecting (and
+        enabling WAL mode) if needed.
+
+        :return: database connection
+        :rtype: sqlite3.Connection
+        """
+        conn = getattr(self._thread_local, 'conn', None)
+        if conn is None:
+            logger.debug('Connecting to %s for thread %s', self.db_path,
+                         threading.current_thread().name)
+            conn = sqlite3.connect(self.db_path, timeout=60)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._thread_local.conn = conn
+        return conn
+
+    def get(self, project, date):
+        """
+        Get the cache data for a specified project for the specified date.
+        Returns None if the data cannot be found in the cache.
+
+        :param project: PyPi project name to get data for
+        :type project: str
+        :param date: date to get data for
+        :type date: datetime.datetime
+        :return: dict of per-date data for project
+        :rtype: :py:obj:`dict` or ``None``
+        """
+        logger.debug('Cache GET project=%s date=%s', project,
+                     date.strftime('%Y-%m-%d'))
+        row = self._get_conn().execute(
+            'SELECT record FROM records WHERE project = ? AND date = ?',
+            (project, date.strftime('%Y%m%d'))
+        ).fetchone()
+        if row is None:
+            logger.debug('No cache record for project=%s date=%s',
+                         project, date.strftime('%Y-%m-%d'))
+            return None
+        return DiskDataCache._parse_metadata(json.loads(row[0]))
+
+    def get_many(self, keys):
+        """
+        Get the cache data for several projects and/or dates at once, with
+        one query per project (per :py:attr:`~._MAX_QUERY_DATES` dates).
+
+        :param keys: list of 2-tuples of (project name, date), each as the
+          arguments to :py:meth:`~.get`
+        :type keys: ``list``
+        :return: dict of (project name, date) 2-tuple to the cache data for
+          it, as returned by :py:meth:`~.get`, for each of ``keys`` that is
+          found in the cache
+        :rtype: dict
+        """
+        by_project = {}
+        for project, date in keys:
+            by_project.setdefault(project, set()).add(date.strftime('%Y%m%d'))
+        result = {}
+        conn = self._get_conn()
+        for project, dates in by_project.items():
+            dates = sorted(dates)
+            for i in range(0, len(dates), self._MAX_QUERY_DATES):
+                chunk = dates[i:i + self._MAX_QUERY_DATES]
+                for date, record in conn.execute(
+                    'SELECT date, record FROM records WHERE project = ? AND '
+                    'date IN (%s)' % ', '.join(['?'] * len(chunk)),
+                    [project] + chunk
+                ):
+                    result[
+                        (project, datetime.strptime(date, '%Y%m%d'))
+                    ] = DiskDataCache._parse_metadata(json.loads(record))
+        logger.debug('Cache GET %d of %d record(s)', len(result), len(keys))
+        return result
+
+    def get_range(self, project, start_date, end_date):
+        """
+        Get the cache data for a specified project for every date in a range
+        (inclusive) that we have in cache, with one query.
+
+        :param project: PyPi project name to get data for
+        :type project: str
+        :param start_date: first date to get data for
+        :type start_date: datetime.datetime
+        :param end_date: last date to get data for
+        :type end_date: datetime.datetime
+        :return: dict of date to the cache data for it, as returned by
+          :py:meth:`~.get`
+        :rtype: dict
+        """
+        logger.debug('Cache GET project=%s dates %s to %s', project,
+                     start_date.strftime('%Y-%m-%d'),
+                     end_date.strftime('%Y-%m-%d'))
+        return {
+            datetime.strptime(date, '%Y%m%d'):
+            DiskDataCache._parse_metadata(json.loads(record))
+            for date, record in self._get_conn().execute(
+                'SELECT date, record FROM records WHERE project = ? AND '
+                'date >= ? AND date <= ?',
+                (project, start_date.strftime('%Y%m%d'),
+                 end_date.strftime('%Y%m%d'))
+            )
+        }
+
+    def set(self, project, date, data, data_ts, metadata=None):
+        """
+        Set the cache data for a specified project for the specified date.
+
+        :param project: project name to set data for
+        :type project: str
+        :param date: date to set data for
+        :type date: datetime.datetime
+        :param data: data to cache
+        :type data: dict
+        :param data_ts: maximum timestamp in the BigQuery data table
+        :type data_ts: int
+        :param metadata: additional metadata to store in the record's
+          ``cache_metadata`` dict
+        :type metadata: dict
+        """
+        self.set_many([(project, date, data, data_ts, metadata)])
+
+    def set_many(self, records):
+        """
+        Set the cache data for several projects and/or dates at once, in one
+        transaction.
+
+        :param records: list of 5-tuples of (project name, date, data,
+          data_ts, metadata), each as the arguments to :py:meth:`~.set`
+        :type records: ``list``
+        """
+        rows = []
+        for project, date, data, data_ts, metadata in records:
+            DiskDataCache._add_metadata(project, date, data, data_ts, metadata)
+            rows.append(
+                (project, date.strftime('%Y%m%d'), json.dumps(data))
+            )
+        logger.debug('Cache SET %d record(s)', len(rows))
+        self._put_records(rows)
+
+    def _put_records(self, rows):
+        """
+        Insert or replace serialized cache records, in one transaction.
+
+        :param rows: list of 3-tuples of (project name, ``YYYYMMDD`` date
+          string, JSON record)
+        :type rows: ``list``
+        """
+        with self._get_conn() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO records (project, date, record) '
+                'VALUES (?, ?, ?)', rows
+            )
+
+    def get_state(self, name):
+        """
+        Get a named piece of non-project state (such as the BigQuery table
+        listing). Returns None if the state cannot be found.
+
+        :param name: state name
+        :type name: str
+        :return: the JSON-serializable state that was stored
+        :rtype: object
+        """
+        logger.debug('Cache GET state %s', name)
+        row = self._get_conn().execute(
+            'SELECT data FROM state WHERE name = ?', (name, )
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set_state(self, name, data):
+        """
+        Set a named piece of non-project state.
+
+        :param name: state name
+        :type name: str
+        :param data: JSON-serializable state to store
+        :type data: object
+        """
+        logger.debug('Cache SET state %s', name)
+        with self._get_conn() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO state (name, data) VALUES (?, ?)',
+                (name, json.dumps(data))
+            )
+
+    def get_state_names(self):
+        """
+        Return the names of all of the non-project state stored in the cache.
+
+        :return: sorted list of state names
+        :rtype: ``list``
+        """
+        return [
+            row[0] for row in self._get_conn().execute(
+                'SELECT name FROM state ORDER BY name'
+            )
+        ]
+
+    def get_dates_for_project(self, project):
+        """
+        Return a list of the dates we have in cache for the specified project,
+        sorted in ascending date order.
+
+        :param project: project name
+        :type project: str
+        :return: list of datetime.datetime objects
+        :rtype: datetime.datetime
+        """
+        return [
+            datetime.strptime(row[0], '%Y%m%d')
+            for row in self._get_conn().execute(
+                'SELECT date FROM records WHERE project = ? ORDER BY date',
+                (project, )
+            )
+        ]
+
+    def get_all_dates(self):
+        """
+        Return the dates we have in cache for every project.
+
+        :return: dict of project name to list of datetime.datetime objects,
+          sorted in ascending date order
+        :rtype: dict
+        """
+        result = {}
+        for project, date in self._get_conn().execute(
+            'SELECT project, date FROM records ORDER BY project, date'
+        ):
+            result.setdefault(project, []).append(
+                datetime.strptime(date, '%Y%m%d')
+            )
+        return result
+
+    def migrate(self, disk_cache):
+        """
+        Copy every cache record and piece of non-project state from a
+        :py:class:`~.DiskDataCache` (JSON file per project per day) into this
+        cache, as stored (i.e. keeping their ``cache_metadata``). Each
+        project's records are written in one transaction; existing records for
+        the same project and date are replaced. The JSON files are left in
+        place.
+
+        :param disk_cache: cache to copy records from
+        :type disk_cache: :py:class:`~.DiskDataCache`
+        :return: number of records copied
+        :rtype: int
+        """
+        count = 0
+        for project, dates in sorted(disk_cache.get_all_dates().items()):
+            rows = []
+            for dt in dates:
+                rec = disk_cache._read_record(project, dt)
+                if rec is None:
+                    logger.warning('Could not read cache record for project=%s '
+                                   'date=%s; skipping', project,
+                                   dt.strftime('%Y-%m-%d'))
+                    continue
+                rows.append((project, dt.strftime('%Y%m%d'), json.dumps(rec)))
+            self._put_records(rows)
+            logger.info('Migrated %d cache record(s) for project %s',
+                        len(rows), project)
+            count += len(rows)
+        for name in disk_cache.get_state_names():
+            state = disk_cache.get_state(name)
+            if state is not None:
+                self.set_state(name, state)
+        return count
@@ -0,0 +1,309 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import os
+import sys
+import threading
+from datetime import datetime
+
+import pytest
+
+from pypi_download_stats.diskdatacache import DiskDataCache
+from pypi_download_stats.arrowdatacache import ArrowDataCache
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch
+else:
+    from unittest.mock import patch
+
+pbm = 'pypi_download_stats.arrowdatacache'
+
+pytest.importorskip('pyarrow')
+
+
+def _tables(path):
+    """table file names in a project directory, without fragment names"""
+    return sorted([f.split('.', 2)[2] for f in os.listdir(path)])
+
+
+class TestArrowDataCache(object):
+
+    def test_no_pyarrow(self, tmpdir):
+        with patch('%s.pa' % pbm, None):
+            with pytest.raises(Exception) as excinfo:
+                ArrowDataCache(str(tmpdir))
+        assert 'requires pyarrow' in str(excinfo.value)
+
+    def test_get_set(self, tmpdir):
+        cls = ArrowDataCache(str(tmpdir.join('sub')))
+        dt = datetime(2016, 8, 22)
+        assert cls.get('foo', dt) is None
+        cls.set('foo', dt, {'by_version': {'1.0': 3}}, 1471910399,
+                metadata={'table_rows': 5})
+        res = cls.get('foo', dt)
+        assert res['by_version'] == {'1.0': 3}
+        assert res['cache_metadata']['date'] == dt
+        assert res['cache_metadata']['data_ts'] == 1471910399
+        assert res['cache_metadata']['table_rows'] == 5
+        assert isinstance(res['cache_metadata']['updated'], datetime)
+        assert cls.get_dates_for_project('foo') == [dt]
+        assert cls.get_dates_for_project('bar') == []
+        cls.set('foo', dt, {'by_version': {'1.0': 4}}, 1471910400)
+        assert cls.get('foo', dt)['by_version'] == {'1.0': 4}
+        # the second write's fragment was merged with the first
+        assert _tables(str(tmpdir.join('sub', 'foo'))) == [
+            'by_version.arrow', 'records.arrow'
+        ]
+
+    def test_same_as_disk(self, tmpdir):
+        data = {
+            'by_version': {'1.0': 3, None: 1},
+            'by_installer': {'pip': {'8.1.2': 2, None: 1}, None: {None: 4}},
+            'by_country': {},
+            'cube': {'columns': ['by_version'], 'rows': [['1.0', 3]]}
+        }
+        dt = datetime(2016, 8, 22)
+        disk = DiskDataCache(str(tmpdir.join('json')))
+        disk.set('foo', dt, data, 1471910399)
+        cls = ArrowDataCache(str(tmpdir.join('arrow')))
+        cls.set('foo', dt, data, 1471910399)
+        res = cls.get('foo', dt)
+        expected = disk.get('foo', dt)
+        for r in [res, expected]:
+            del r['cache_metadata']['updated']
+        assert res == expected
+        assert res['by_installer'] == {
+            'pip': {'8.1.2': 2, 'null': 1}, 'null': {'null': 4}
+        }
+
+    def test_get_returns_copy(self, tmpdir):
+        cls = ArrowDataCache(str(tmpdir))
+        dt = datetime(2016, 8, 22)
+        cls.set('foo', dt, {'by_version': {'1.0': 3}}, 1)
+        cls.get('foo', dt)['by_version']['1.0'] = 10
+        assert cls.get('foo', dt)['by_version'] == {'1.0': 3}
+
+    def test_set_many(self, tmpdir):
+        cls = ArrowDataCache(str(tmpdir))
+        cls.set_many([
+            ('foo', datetime(2016, 8, 22), {'by_version': {'1.0': 2}}, 2, None),
+            ('foo', datetime(2016, 8, 21), {'by_version': {'1.0': 1}}, 1, None),
+            ('bar', datetime(2016, 8, 22), {'by_version': {}}, 2, None)
+        ])
+        assert cls.get_dates_for_project('foo') == [
+            datetime(2016, 8, 21), datetime(2016, 8, 22)
+        ]
+        assert cls.get_all_dates() == {
+            'foo': [datetime(2016, 8, 21), datetime(2016, 8, 22)],
+            'bar': [datetime(2016, 8, 22)]
+        }
+        assert cls.get('foo', datetime(2016, 8, 21))['by_version'] == {
+            '1.0': 1
+        }
+        assert cls.get('bar', datetime(2016, 8, 22))['by_version'] == {}
+
+    def test_removes_unused_breakdowns(self, tmpdir):
+        cls = ArrowDataCache(str(tmpdir))
+        dt = datetime(2016, 8, 22)
+        cls.set('foo', dt, {'by_version': {'1.0': 3}, 'by_system': {'L': 1}},
+                1)
+        cls.set('foo', dt, {'by_version': {'1.0': 3}}, 2)
+        assert _tables(str(tmpdir.join('foo'))) == [
+            'by_version.arrow', 'records.arrow'
+        ]
+        assert 'by_system' not in cls.get('foo', dt)
+
+    def test_reads_other_writers(self, tmpdir):
+        cls = ArrowDataCache(str(tmpdir))
+        other = ArrowDataCache(str(tmpdir))
+        dt = datetime(2016, 8, 22)
+        cls.set('foo', dt, {'by_version': {'1.0': 3}}, 1)
+        assert other.get('foo', dt)['by_version'] == {'1.0': 3}
+        cls.set('foo', dt, {'by_version': {'1.0': 4}}, 2)
+        assert other.get('foo', dt)['by_version'] == {'1.0': 4}
+
+    def test_fragments(self, tmpdir):
+        cls = ArrowDataCache(str(tmpdir))
+        for day in range(1, 32):
+            cls.set('foo', datetime(2016, 8, day),
+                    {'by_version': {'1.0': day}}, day)
+        frags = cls._list_fragments(str(tmpdir.join('foo')))[0]
+        # 31 = 16 + 8 + 4 + 2 + 1
+        assert len(frags) == 5
+        sizes = [
+            len(f['dates']) for f in cls._load('foo')['fragments']
+        ]
+        assert sizes == [16, 8, 4, 2, 1]
+        other = ArrowDataCache(str(tmpdir))
+        res = other.get_range('foo', datetime(2016, 8, 1),
+                              datetime(2016, 8, 31))
+        assert len(res) == 31
+        for day in range(1, 32):
+            assert res[datetime(2016, 8, day)]['by_version'] == {'1.0': day}
+        # newer fragments' records replace older ones'
+        cls.set_many([
+            ('foo', datetime(2016, 8, day), {'by_version': {'2.0': day}}, day,
+             None) for day in [2, 30]
+        ])
+        res = other.get_range('foo', datetime(2016, 8, 1),
+                              datetime(2016, 8, 31))
+        assert len(res) == 31
+        assert res[datetime(2016, 8, 1)]['by_version'] == {'1.0': 1}
+        assert res[datetime(2016, 8, 2)]['by_version'] == {'2.0': 2}
+        assert res[datetime(2016, 8, 30)]['by_version'] == {'2.0': 30}
+        assert res[datetime(2016, 8, 31)]['by_version'] == {'1.0': 31}
+
+    def test_incomplete_fragment(self, tmpdir):
+        cls = ArrowDataCache(str(tmpdir))
+        dt = datetime(2016, 8, 22)
+        cls.set('foo', dt, {'by_version': {'1.0': 3}}, 1)
+        # a crashed writer's fragment, without its records table
+        frag = cls._new_fragment()
+        pdir = str(tmpdir.join('foo'))
+        cls._write_fragment('foo', {dt: {
+            'by_version': {'1.0': 4}, 'cache_metadata': {'data_ts': 2}
+        }}, frag)
+        os.remove(cls._path_for_table(pdir, frag, 'records'))
+        other = ArrowDataCache(str(tmpdir))
+        assert other.get('foo', dt)['by_version'] == {'1.0': 3}
+        assert len(os.listdir(pdir)) == 3
+        orphan = cls._path_for_table(pdir, frag, 'by_version')
+        os.utime(orphan, (1, 1))
+        cls.set('foo', dt, {'by_version': {'1.0': 5}}, 2)
+        assert not os.path.exists(orphan)
+        assert _tables(pdir) == ['by_version.arrow', 'records.arrow']
+        assert other.get('foo', dt)['by_version'] == {'1.0': 5}
+
+    def test_get_many_get_range(self, tmpdir):
+        cls = ArrowDataCache(str(tmpdir))
+        cls.set_many([
+            ('foo', datetime(2016, 8, x), {'by_version': {'1.0': x}}, x, None)
+            for x in range(1, 6)
+        ] + [('bar', datetime(2016, 8, 2), {'by_version': {}}, 2, None)])
+        res = cls.get_range('foo', datetime(2016, 8, 2), datetime(2016, 8, 4))
+        assert sorted(res.keys()) == [
+            datetime(2016, 8, 2), datetime(2016, 8, 3), datetime(2016, 8, 4)
+        ]
+        assert res[datetime(2016, 8, 3)]['by_version'] == {'1.0': 3}
+        assert res[datetime(2016, 8, 3)]['cache_metadata']['date'] == \
+            datetime(2016, 8, 3)
+        assert cls.get_range(
+            'bar', datetime(2016, 8, 3), datetime(2016, 8, 4)) == {}
+        res = cls.get_many([
+            ('foo', datetime(2016, 8, 1)), ('bar', datetime(2016, 8, 2)),
+            ('bar', datetime(2016, 8, 3)), ('baz', datetime(2016, 8, 1))
+        ])
+        assert sorted(res.keys()) == [
+            ('bar', datetime(2016, 8, 2)), ('foo', datetime(2016, 8, 1))
+        ]
+        assert res[('foo', datetime(2016, 8, 1))] == cls.get(
+            'foo', datetime(2016, 8, 1))
+
+    def test_state(self, tmpdir):
+        cls = ArrowDataCache(str(tmpdir))
+        assert cls.get_state('tables') is None
+        cls.set_state('tables', {'tables': ['downloads20160822']})
+        cls.set('foo', datetime(2016, 8, 22), {}, 1)
+        assert cls.get_state('tables') == {'tables': ['downloads20160822']}
+        assert cls.get_state_names() == ['tables']
+        assert cls.get_all_dates() == {'foo': [datetime(2016, 8, 22)]}
+        assert DiskDataCache(str(tmpdir)).get_all_dates() == {}
+
+    def test_threads(self, tmpdir):
+        cls = ArrowDataCache(str(tmpdir))
+
+        def worker(day):
+            cls.set('foo', datetime(2016, 8, day), {}, day)
+
+        threads = [
+            threading.Thread(target=worker, args=(d, )) for d in range(1, 9)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(cls.get_dates_for_project('foo')) == 8
+
+    def test_migrate(self, tmpdir):
+        disk = DiskDataCache(str(tmpdir))
+        disk.set('foo', datetime(2016, 8, 21), {'by_version': {'1.0': 1}}, 1)
+        disk.set('foo', datetime(2016, 8, 22), {'by_version': {'1.0': 2}}, 2,
+                 metadata={'table_rows': 5})
+        disk.set('bar', datetime(2016, 8, 22), {'by_version': {}}, 2)
+        disk.set_state('tables', {'tables': ['downloads20160822']})
+        tmpdir.join('baz_20160822.json').write('not json')
+        cls = ArrowDataCache(str(tmpdir))
+        assert cls.migrate(disk) == 3
+        for proj, dates in disk.get_all_dates().items():
+            if proj == 'baz':
+                continue
+            assert cls.get_dates_for_project(proj) == dates
+            for dt in dates:
+                assert cls.get(proj, dt) == disk.get(proj, dt)
+        assert cls.get_dates_for_project('baz') == []
+        assert cls.get_state('tables') == {'tables': ['downloads20160822']}
+        assert os.path.exists(str(tmpdir.join('foo_20160822.json')))
+
+    def test_get_date_index(self, tmpdir):
+        disk = DiskDataCache(str(tmpdir.join('json')))
+        cls = ArrowDataCache(str(tmpdir.join('arrow')))
+        for c in [disk, cls]:
+            c.set('foo', datetime(2016, 8, 21), {'by_version': {'1.0': 1}}, 1)
+            c.set('foo', datetime(2016, 8, 22), {'by_version': {}}, 2)
+        assert cls.get_date_index('foo') == disk.get_date_index('foo')
+        assert cls.get_date_index('foo') == {
+            datetime(2016, 8, 21): {'data_ts': 1, 'empty': False},
+            datetime(2016, 8, 22): {'data_ts': 2, 'empty': True}
+        }
+        assert cls.get_date_index('bar') == {}
+
+    def test_rebuild_index_recompress(self, tmpdir):
+        disk = DiskDataCache(str(tmpdir))
+        disk.set('foo', datetime(2016, 8, 21), {'by_version': {'1.0': 1}}, 1)
+        cls = ArrowDataCache(str(tmpdir))
+        with pytest.raises(Exception) as excinfo:
+            cls.rebuild_index()
+        assert 'no date index' in str(excinfo.value)
+        with pytest.raises(Exception) as excinfo:
+            cls.recompress()
+        assert 'cannot be recompressed' in str(excinfo.value)
+        assert os.path.exists(str(tmpdir.join('foo_20160821.json')))
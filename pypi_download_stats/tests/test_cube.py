@@ -0,0 +1,97 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import pytest
+
+from pypi_download_stats import cube
+
+
+class TestCube(object):
+
+    def setup_method(self):
+        self.cube = {
+            'columns': ['file.version', 'details.implementation.name',
+                        'country_code'],
+            'rows': [
+                ['1.0', 'CPython', 'US', 3],
+                ['1.0', 'PyPy', 'US', 1],
+                ['1.0', 'CPython', 'DE', 2],
+                ['0.9', None, None, 4]
+            ]
+        }
+
+    def test_rollup_one(self):
+        assert cube.rollup(self.cube, ['file.version']) == {
+            '1.0': 6, '0.9': 4
+        }
+        assert cube.rollup(self.cube, ['country_code']) == {
+            'US': 4, 'DE': 2, None: 4
+        }
+
+    def test_rollup_two(self):
+        assert cube.rollup(
+            self.cube, ['file.version', 'details.implementation.name']
+        ) == {
+            '1.0': {'CPython': 5, 'PyPy': 1},
+            '0.9': {None: 4}
+        }
+
+    def test_rollup_empty(self):
+        self.cube['rows'] = []
+        assert cube.rollup(self.cube, ['file.version']) == {}
+
+    def test_merge(self):
+        delta = {
+            'columns': self.cube['columns'],
+            'rows': [['1.0', 'PyPy', 'US', 2], ['1.1', 'PyPy', 'FR', 1]]
+        }
+        res = cube.merge(self.cube, delta)
+        assert res['columns'] == self.cube['columns']
+        assert res['rows'] == [
+            ['1.0', 'CPython', 'US', 3],
+            ['1.0', 'PyPy', 'US', 3],
+            ['1.0', 'CPython', 'DE', 2],
+            ['0.9', None, None, 4],
+            ['1.1', 'PyPy', 'FR', 1]
+        ]
+        # original is unchanged
+        assert self.cube['rows'][1] == ['1.0', 'PyPy', 'US', 1]
+
+    def test_merge_different_columns(self):
+        with pytest.raises(Exception) as excinfo:
+            cube.merge(self.cube, {'columns': ['file.version'], 'rows': []})
+        assert 'different columns' in str(excinfo.value)
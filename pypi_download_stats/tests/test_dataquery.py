@@ -0,0 +1,1197 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import sys
+import threading
+from datetime import datetime
+
+import pytest
+from freezegun import freeze_time
+
+from pypi_download_stats.dataquery import DataQuery
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT  # noqa
+
+pbm = 'pypi_download_stats.dataquery'
+pb = '%s.DataQuery' % pbm
+
+
+class DataQueryTester(object):
+
+    def setup_method(self):
+        self.mock_cache = Mock()
+        with patch('%s.BigQueryBackend' % pbm) as mock_backend:
+            self.cls = DataQuery('myproj', ['foo', 'bar'], self.mock_cache)
+        self.mock_backend = mock_backend
+
+
+class TestQuerySingleScan(DataQueryTester):
+
+    def test_query(self):
+        rows = [
+            {'dimension': 'data_ts', 'file_project': None,
+             'key1': '1471900000', 'key2': None, 'dl_count': '12'},
+            {'dimension': 'by_version', 'file_project': 'foo',
+             'key1': '1.0.0', 'key2': None, 'dl_count': '5'},
+            {'dimension': 'by_version', 'file_project': 'bar',
+             'key1': '0.1', 'key2': None, 'dl_count': '7'},
+            {'dimension': 'by_installer', 'file_project': 'foo',
+             'key1': 'pip', 'key2': '8.1.2', 'dl_count': '3'},
+            {'dimension': 'by_installer', 'file_project': 'foo',
+             'key1': 'pip', 'key2': '8.0.0', 'dl_count': '2'},
+            {'dimension': 'by_country', 'file_project': 'bar',
+             'key1': None, 'key2': None, 'dl_count': '7'},
+        ]
+        with patch('%s._run_query' % pb) as mock_run:
+            mock_run.return_value = rows
+            ts, res = self.cls._query_single_scan('downloads20160822')
+        assert ts == 1471900000
+        assert res['foo']['by_version'] == {'1.0.0': 5}
+        assert res['foo']['by_installer'] == {'pip': {'8.1.2': 3, '8.0.0': 2}}
+        assert res['foo']['by_country'] == {}
+        assert res['bar']['by_version'] == {'0.1': 7}
+        assert res['bar']['by_country'] == {None: 7}
+        assert res['bar']['by_distro'] == {}
+        assert sorted(res['foo'].keys()) == sorted(
+            DataQuery._DIMENSION_COLUMNS.keys())
+        assert len(mock_run.mock_calls) == 1
+        q = mock_run.mock_calls[0][1][0]
+        assert q.count('[the-psf:pypi.downloads20160822]') == 2
+        assert "SPLIT('by_version,by_file_type,by_installer," \
+               "by_implementation,by_system,by_distro,by_country', ',')" in q
+        assert "WHEN dimension = 'by_installer' THEN " \
+               "details_installer_version" in q
+        assert "file.project IN ('foo', 'bar')" in q
+
+
+class TestQueryOneTable(DataQueryTester):
+
+    def test_single_scan(self):
+        self.cls.single_scan = True
+        data = {'foo': {'by_version': {'1.0': 2}}, 'bar': {'by_version': {}}}
+        with patch('%s._query_single_scan' % pb) as mock_single:
+            with patch('%s._query_per_dimension' % pb) as mock_per:
+                mock_single.return_value = (1234567890, data)
+                self.cls.query_one_table('downloads20160822')
+        assert mock_single.mock_calls == [
+            call('downloads20160822', None, None)
+        ]
+        assert mock_per.mock_calls == []
+        assert len(self.mock_cache.mock_calls) == 1
+        assert sorted(self.mock_cache.set_many.mock_calls[0][1][0]) == sorted([
+            ('foo', datetime(2016, 8, 22), data['foo'], 1234,
+             {'data_ts_usec': 1234567890}),
+            ('bar', datetime(2016, 8, 22), data['bar'], 1234,
+             {'data_ts_usec': 1234567890})
+        ])
+
+    def test_table_metadata(self):
+        data = {'foo': {'by_version': {'1.0': 2}}}
+        table = {'lastModifiedTime': '1471900000123', 'numRows': '456'}
+        with patch('%s._query_per_dimension' % pb) as mock_per:
+            mock_per.return_value = (1234567890, data)
+            self.cls.query_one_table('downloads20160822', table=table)
+        assert self.mock_cache.mock_calls == [
+            call.set_many([
+                ('foo', datetime(2016, 8, 22), data['foo'], 1234, {
+                    'data_ts_usec': 1234567890,
+                    'table_modified': 1471900000123, 'table_rows': 456
+                })
+            ])
+        ]
+
+    def test_per_dimension(self):
+        data = {'foo': {'by_version': {'1.0': 2}}, 'bar': {'by_version': {}}}
+        with patch('%s._query_single_scan' % pb) as mock_single:
+            with patch('%s._query_per_dimension' % pb) as mock_per:
+                mock_per.return_value = (1234, data)
+                self.cls.query_one_table('downloads20160822')
+        assert mock_single.mock_calls == []
+        assert mock_per.mock_calls == [call('downloads20160822', None, None)]
+        assert len(self.mock_cache.mock_calls) == 1
+        assert len(self.mock_cache.set_many.mock_calls[0][1][0]) == 2
+
+
+class TestQueryDateRange(DataQueryTester):
+
+    def test_query(self):
+        rows = [
+            {'download_date': '2016-08-21', 'dimension': 'data_ts',
+             'file_project': None, 'key1': '1471823999', 'key2': None,
+             'dl_count': '12'},
+            {'download_date': '2016-08-22', 'dimension': 'data_ts',
+             'file_project': None, 'key1': '1471910399', 'key2': None,
+             'dl_count': '12'},
+            {'download_date': '2016-08-21', 'dimension': 'by_version',
+             'file_project': 'foo', 'key1': '1.0.0', 'key2': None,
+             'dl_count': '5'},
+            {'download_date': '2016-08-22', 'dimension': 'by_version',
+             'file_project': 'foo', 'key1': '1.0.0', 'key2': None,
+             'dl_count': '6'},
+        ]
+        with patch('%s._run_query' % pb) as mock_run:
+            mock_run.return_value = rows
+            res = self.cls._query_date_range(
+                datetime(2016, 8, 20), datetime(2016, 8, 22))
+        assert sorted(res.keys()) == [
+            datetime(2016, 8, 21), datetime(2016, 8, 22)
+        ]
+        assert res[datetime(2016, 8, 21)][0] == 1471823999
+        assert res[datetime(2016, 8, 21)][1]['foo']['by_version'] == {
+            '1.0.0': 5}
+        assert res[datetime(2016, 8, 22)][1]['foo']['by_version'] == {
+            '1.0.0': 6}
+        assert res[datetime(2016, 8, 22)][1]['bar']['by_version'] == {}
+        q = mock_run.mock_calls[0][1][0]
+        assert "FROM TABLE_DATE_RANGE([the-psf:pypi.downloads], " \
+               "TIMESTAMP('2016-08-20'), TIMESTAMP('2016-08-22'))" in q
+        assert 'GROUP BY download_date, dimension, file_project' in q
+
+
+class TestBackfillHistory(DataQueryTester):
+
+    def test_date_ranges(self):
+        self.cls.backfill_range_days = 3
+        both = ['foo', 'bar']
+        dates = [
+            (datetime(2016, 8, 1), both), (datetime(2016, 8, 2), both),
+            (datetime(2016, 8, 3), both), (datetime(2016, 8, 4), both),
+            (datetime(2016, 8, 6), both), (datetime(2016, 8, 7), ['bar']),
+            (datetime(2016, 8, 8), ['bar'])
+        ]
+        assert self.cls._date_ranges(dates) == [
+            (datetime(2016, 8, 1), datetime(2016, 8, 3), both),
+            (datetime(2016, 8, 4), datetime(2016, 8, 4), both),
+            (datetime(2016, 8, 6), datetime(2016, 8, 6), both),
+            (datetime(2016, 8, 7), datetime(2016, 8, 8), ['bar'])
+        ]
+
+    def test_cache_gaps(self):
+        dates = {
+            'foo': [datetime(2016, 8, 1), datetime(2016, 8, 2)],
+            'bar': [datetime(2016, 8, 2)]
+        }
+        self.mock_cache.get_dates_for_project.side_effect = dates.get
+        self.mock_cache.get_many.side_effect = lambda keys: {
+            k: {'cache_metadata': {}} for k in keys
+        }
+        assert self.cls._cache_gaps([
+            datetime(2016, 8, 1), datetime(2016, 8, 2), datetime(2016, 8, 3)
+        ]) == {
+            datetime(2016, 8, 1): ['bar'],
+            datetime(2016, 8, 2): [],
+            datetime(2016, 8, 3): ['foo', 'bar']
+        }
+
+    def test_backfill_per_day(self):
+        tables = ['downloads201608%02d' % x for x in range(1, 6)]
+        with patch('%s._cache_gaps' % pb) as mock_gaps:
+            with patch('%s._backfill_date_range' % pb) as mock_range:
+                with patch('%s.query_one_table' % pb) as mock_qot:
+                    mock_gaps.return_value = {
+                        datetime(2016, 8, 1): ['foo'],
+                        datetime(2016, 8, 2): [],
+                        datetime(2016, 8, 3): ['foo', 'bar']
+                    }
+                    self.cls.backfill_history(5, tables)
+        assert mock_gaps.mock_calls == [call([
+            datetime(2016, 8, 1), datetime(2016, 8, 2), datetime(2016, 8, 3)
+        ])]
+        assert mock_range.mock_calls == []
+        assert mock_qot.mock_calls == [
+            call('downloads20160801', ['foo']),
+            call('downloads20160803', ['foo', 'bar'])
+        ]
+
+    def test_backfill_ranges(self):
+        self.cls.backfill_range_days = 30
+        tables = [
+            'downloads201608%02d' % x for x in range(1, 11) if x != 5
+        ]
+        gaps = {
+            datetime(2016, 8, x): ['foo'] for x in range(1, 9)
+        }
+        gaps[datetime(2016, 8, 3)] = []
+        gaps[datetime(2016, 8, 8)] = ['foo', 'bar']
+        with patch('%s._cache_gaps' % pb) as mock_gaps:
+            with patch('%s._backfill_date_range' % pb) as mock_range:
+                with patch('%s.query_one_table' % pb) as mock_qot:
+                    mock_gaps.return_value = gaps
+                    self.cls.backfill_history(9, tables)
+        assert mock_qot.mock_calls == []
+        assert mock_range.mock_calls == [
+            call(datetime(2016, 8, 1), datetime(2016, 8, 2), ['foo']),
+            call(datetime(2016, 8, 4), datetime(2016, 8, 4), ['foo']),
+            call(datetime(2016, 8, 6), datetime(2016, 8, 7), ['foo']),
+            call(datetime(2016, 8, 8), datetime(2016, 8, 8), ['foo', 'bar'])
+        ]
+
+    def test_backfill_date_range(self):
+        data = {'foo': {'by_version': {}}, 'bar': {'by_version': {}}}
+        with patch('%s._query_date_range' % pb) as mock_query:
+            mock_query.return_value = {
+                datetime(2016, 8, 2): (1234000000, data),
+                datetime(2016, 8, 3): (5678000000, data)
+            }
+            self.cls._backfill_date_range(
+                datetime(2016, 8, 1), datetime(2016, 8, 3))
+        assert mock_query.mock_calls == [
+            call(datetime(2016, 8, 1), datetime(2016, 8, 3), None)
+        ]
+        assert len(self.mock_cache.mock_calls) == 1
+        assert sorted(self.mock_cache.set_many.mock_calls[0][1][0]) == sorted([
+            ('foo', datetime(2016, 8, 2), data['foo'], 1234,
+             {'data_ts_usec': 1234000000}),
+            ('bar', datetime(2016, 8, 2), data['bar'], 1234,
+             {'data_ts_usec': 1234000000}),
+            ('foo', datetime(2016, 8, 3), data['foo'], 5678,
+             {'data_ts_usec': 5678000000}),
+            ('bar', datetime(2016, 8, 3), data['bar'], 5678,
+             {'data_ts_usec': 5678000000})
+        ])
+
+
+class TestRunInPool(DataQueryTester):
+
+    def test_serial(self):
+        func = Mock()
+        self.cls._run_in_pool(func, [(1, ), (2, ), (3, )])
+        assert func.mock_calls == [call(1), call(2), call(3)]
+
+    def test_concurrent(self):
+        self.cls.query_concurrency = 3
+        names = set()
+        res = []
+
+        def func(x):
+            names.add(threading.current_thread().name)
+            res.append(x)
+
+        self.cls._run_in_pool(func, [(x, ) for x in range(20)])
+        assert sorted(res) == list(range(20))
+        assert names.issubset(
+            set(['query-worker-0', 'query-worker-1', 'query-worker-2']))
+
+    def test_concurrent_error(self):
+        self.cls.query_concurrency = 2
+
+        def func(x):
+            if x == 1:
+                raise RuntimeError('foo')
+
+        with pytest.raises(RuntimeError):
+            self.cls._run_in_pool(func, [(x, ) for x in range(5)])
+
+
+class TestQueryDimension(DataQueryTester):
+
+    def test_two_column(self):
+        rows = [
+            {'file_project': 'foo', 'details_installer_name': 'pip',
+             'details_installer_version': '8.1.2', 'dl_count': '3'},
+            {'file_project': 'foo', 'details_installer_name': None,
+             'details_installer_version': None, 'dl_count': '1'},
+        ]
+        with patch('%s._run_query' % pb) as mock_run:
+            mock_run.return_value = iter(rows)
+            res = self.cls._query_dimension('downloads20160822',
+                                            'by_installer')
+        assert res == {
+            'foo': {'pip': {'8.1.2': 3}, None: {None: 1}},
+            'bar': {}
+        }
+        assert mock_run.mock_calls == [call(
+            "SELECT file.project, details.installer.name, "
+            "details.installer.version, COUNT(*) as dl_count "
+            "FROM [the-psf:pypi.downloads20160822] "
+            "WHERE file.project IN ('foo', 'bar') "
+            "GROUP BY file.project, details.installer.name, "
+            "details.installer.version;"
+        )]
+
+
+class TestPlanQueries(DataQueryTester):
+
+    def test_plan(self):
+        self.cls.single_scan = True
+        tables = ['downloads201608%02d' % x for x in range(1, 11)]
+
+        def se_dry_run(query):
+            if 'downloads20160810' in query:
+                return None
+            return 100
+
+        with patch('%s._backfill_plan' % pb) as mock_backfill:
+            with patch('%s._dry_run_query' % pb) as mock_dry_run:
+                mock_backfill.return_value = (
+                    [('downloads20160808', ['bar'])],
+                    [(datetime(2016, 8, 1), datetime(2016, 8, 3), ['foo'])]
+                )
+                mock_dry_run.side_effect = se_dry_run
+                res = self.cls.plan_queries(7, tables, [
+                    ('downloads20160810', {}), ('downloads20160809', None)
+                ])
+        assert mock_backfill.mock_calls == [call(7, tables)]
+        assert [(x['target'], x['description'], x['bytes']) for x in res] == [
+            ('downloads20160810', 'all breakdowns', None),
+            ('downloads20160809', 'all breakdowns', 100),
+            ('downloads20160808', 'all breakdowns', 100),
+            ('2016-08-01 to 2016-08-03', 'all breakdowns', 100)
+        ]
+        assert "file.project IN ('foo', 'bar')" in \
+            res[0]['query']
+        assert "file.project IN ('bar')" in res[2]['query']
+        assert 'TABLE_DATE_RANGE' in res[3]['query']
+        assert "file.project IN ('foo')" in res[3]['query']
+
+    def test_check_budget(self):
+        self.cls.max_bytes = 150
+        with patch('%s.plan_queries' % pb) as mock_plan:
+            mock_plan.return_value = [{'bytes': 100}, {'bytes': None}]
+            self.cls._check_budget(7, [], [])
+            mock_plan.return_value = [{'bytes': 100}, {'bytes': 100}]
+            with pytest.raises(Exception) as excinfo:
+                self.cls._check_budget(7, [], [])
+        assert 'more than the per-run budget of 150 bytes' in str(
+            excinfo.value)
+
+
+class TestGetDownloadTableIds(DataQueryTester):
+
+    @freeze_time('2016-08-22 12:00:00')
+    def test_no_listing(self):
+        self.mock_cache.get_state.return_value = None
+        with patch('%s._list_download_tables' % pb) as mock_list:
+            with patch('%s._get_table' % pb) as mock_get:
+                mock_list.return_value = ['downloads20160821']
+                res = self.cls._get_download_table_ids()
+        assert res == ['downloads20160821']
+        assert mock_get.mock_calls == []
+        assert self.mock_cache.mock_calls == [
+            call.get_state('tables'),
+            call.set_state('tables', {
+                'updated': 1471867200.0, 'tables': ['downloads20160821']
+            })
+        ]
+
+    @freeze_time('2016-08-22 12:00:00')
+    def test_expired_listing(self):
+        self.mock_cache.get_state.return_value = {
+            'updated': 1471867200 - (8 * 86400),
+            'tables': ['downloads20160812']
+        }
+        with patch('%s._list_download_tables' % pb) as mock_list:
+            with patch('%s._get_table' % pb) as mock_get:
+                mock_list.return_value = ['downloads20160821']
+                res = self.cls._get_download_table_ids()
+        assert res == ['downloads20160821']
+        assert mock_get.mock_calls == []
+
+    @freeze_time('2016-08-22 12:00:00')
+    def test_listing(self):
+        self.mock_cache.get_state.return_value = {
+            'updated': 1471867200 - 86400,
+            'tables': ['downloads20160818', 'downloads20160819']
+        }
+        with patch('%s._list_download_tables' % pb) as mock_list:
+            with patch('%s._get_table' % pb) as mock_get:
+                mock_get.side_effect = [{}, None, {}]
+                res = self.cls._get_download_table_ids()
+        assert res == [
+            'downloads20160818', 'downloads20160819', 'downloads20160820',
+            'downloads20160822'
+        ]
+        assert mock_list.mock_calls == []
+        assert mock_get.mock_calls == [
+            call('downloads20160820'),
+            call('downloads20160821'),
+            call('downloads20160822')
+        ]
+        assert self.mock_cache.mock_calls == [
+            call.get_state('tables'),
+            call.set_state('tables', {
+                'updated': 1471867200 - 86400,
+                'tables': res
+            })
+        ]
+
+
+class TestProjectSubset(DataQueryTester):
+
+    def test_query_single_scan(self):
+        rows = [
+            {'dimension': 'data_ts', 'file_project': None,
+             'key1': '1471900000', 'key2': None, 'dl_count': '12'},
+            {'dimension': 'by_version', 'file_project': 'bar',
+             'key1': '0.1', 'key2': None, 'dl_count': '7'},
+        ]
+        with patch('%s._run_query' % pb) as mock_run:
+            mock_run.return_value = rows
+            ts, res = self.cls._query_single_scan(
+                'downloads20160822', ['bar'])
+        assert list(res.keys()) == ['bar']
+        assert res['bar']['by_version'] == {'0.1': 7}
+        q = mock_run.mock_calls[0][1][0]
+        assert "WHERE file.project IN ('bar')" in q
+        assert 'foo' not in q
+
+    def test_query_per_dimension(self):
+        def se_query(table_name, name, projects, since_ts, until_ts):
+            return {p: {} for p in projects}
+
+        with patch('%s._get_newest_ts_in_table' % pb) as mock_ts:
+            with patch('%s._query_dimension' % pb) as mock_dim:
+                mock_ts.return_value = 1234
+                mock_dim.side_effect = se_query
+                ts, res = self.cls._query_per_dimension(
+                    'downloads20160822', ['foo'])
+        assert ts == 1234
+        assert list(res.keys()) == ['foo']
+        assert len(res['foo']) == 7
+        assert mock_dim.mock_calls[0] == call(
+            'downloads20160822', 'by_version', ['foo'], None, 1234)
+
+
+class TestRefresh(DataQueryTester):
+
+    def test_is_cache_current(self):
+        table = {'lastModifiedTime': '1471900000123', 'numRows': '456'}
+        current = {'cache_metadata': {
+            'table_modified': 1471900000123, 'table_rows': 456
+        }}
+        old = {'cache_metadata': {
+            'table_modified': 1471800000123, 'table_rows': 400
+        }}
+        self.mock_cache.get.side_effect = [current, current]
+        assert self.cls._is_cache_current('downloads20160822', table)
+        self.mock_cache.get.side_effect = [current, old]
+        assert not self.cls._is_cache_current('downloads20160822', table)
+        self.mock_cache.get.side_effect = [current, None]
+        assert not self.cls._is_cache_current('downloads20160822', table)
+        self.mock_cache.get.side_effect = [{'cache_metadata': {}}]
+        assert not self.cls._is_cache_current('downloads20160822', table)
+
+    def test_tables_to_refresh(self):
+        tables = ['downloads20160820', 'downloads20160821',
+                  'downloads20160822']
+        t21 = {'lastModifiedTime': '1', 'numRows': '2'}
+        t22 = {'lastModifiedTime': '3', 'numRows': '4'}
+        with patch('%s._get_table' % pb) as mock_get:
+            with patch('%s._is_cache_current' % pb) as mock_current:
+                mock_get.side_effect = [t22, t21]
+                mock_current.side_effect = [False, True]
+                res = self.cls._tables_to_refresh(tables)
+        assert res == [('downloads20160822', t22)]
+        assert mock_current.mock_calls == [
+            call('downloads20160822', t22), call('downloads20160821', t21)
+        ]
+
+    def test_run_queries(self):
+        tables = ['downloads20160820', 'downloads20160821',
+                  'downloads20160822']
+        t22 = {'lastModifiedTime': '3', 'numRows': '4'}
+        with patch.multiple(
+            pb,
+            _get_download_table_ids=DEFAULT,
+            _tables_to_refresh=DEFAULT,
+            _check_budget=DEFAULT,
+            query_one_table=DEFAULT,
+            backfill_history=DEFAULT
+        ) as mocks:
+            mocks['_get_download_table_ids'].return_value = tables
+            mocks['_tables_to_refresh'].return_value = [
+                ('downloads20160822', t22)
+            ]
+            self.cls.run_queries(backfill_num_days=3)
+        assert mocks['_check_budget'].mock_calls == []
+        assert mocks['query_one_table'].mock_calls == [
+            call('downloads20160822', None, t22)
+        ]
+        assert mocks['backfill_history'].mock_calls == [call(3, tables)]
+
+
+class TestProjectBatches(DataQueryTester):
+
+    def test_no_split(self):
+        assert self.cls._project_batches() == [None]
+        assert self.cls._project_batches(['bar']) == [['bar']]
+
+    def test_batch_size(self):
+        self.cls.projects = ['p%d' % x for x in range(5)]
+        self.cls.project_batch_size = 2
+        assert self.cls._project_batches() == [
+            ['p0', 'p1'], ['p2', 'p3'], ['p4']
+        ]
+        assert self.cls._project_batches(['p0', 'p1']) == [['p0', 'p1']]
+
+    def test_max_length(self):
+        self.cls.projects = ['a' * 6, 'b' * 6, 'c' * 6]
+        self.cls._MAX_PROJECTS_LENGTH = 20
+        assert self.cls._project_batches() == [
+            ['a' * 6, 'b' * 6], ['c' * 6]
+        ]
+
+    def test_batch_args(self):
+        self.cls.project_batch_size = 1
+        assert self.cls._batch_args([
+            ('downloads20160821', None, {}),
+            ('downloads20160822', ['bar'], None)
+        ], 1) == [
+            ('downloads20160821', ['foo'], {}),
+            ('downloads20160821', ['bar'], {}),
+            ('downloads20160822', ['bar'], None)
+        ]
+
+    def test_run_queries(self):
+        self.cls.project_batch_size = 1
+        with patch.multiple(
+            pb,
+            _get_download_table_ids=DEFAULT,
+            _tables_to_refresh=DEFAULT,
+            query_one_table=DEFAULT,
+            backfill_history=DEFAULT
+        ) as mocks:
+            mocks['_get_download_table_ids'].return_value = []
+            mocks['_tables_to_refresh'].return_value = [
+                ('downloads20160822', None)
+            ]
+            self.cls.run_queries(backfill_num_days=3)
+        assert mocks['query_one_table'].mock_calls == [
+            call('downloads20160822', ['foo'], None),
+            call('downloads20160822', ['bar'], None)
+        ]
+
+    def test_backfill_plan(self):
+        self.cls.project_batch_size = 1
+        self.cls.backfill_range_days = 2
+        tables = ['downloads201608%02d' % x for x in range(1, 11)]
+        self.mock_cache.get_dates_for_project.return_value = [
+            datetime(2016, 8, x) for x in range(1, 7)
+        ]
+        self.mock_cache.get_many.side_effect = lambda keys: {
+            k: {'cache_metadata': {}} for k in keys
+        }
+        _, ranges = self.cls._backfill_plan(5, tables)
+        assert ranges == [
+            (datetime(2016, 8, 7), datetime(2016, 8, 8), ['foo']),
+            (datetime(2016, 8, 7), datetime(2016, 8, 8), ['bar'])
+        ]
+
+
+class TestIncremental(DataQueryTester):
+
+    def test_merge_counts(self):
+        cached = {
+            'pip': {'8.1.2': 3, 'null': 1},
+            'null': {'null': 2}
+        }
+        delta = {
+            'pip': {'8.1.2': 1, '8.0.0': 4, None: 1},
+            None: {None: 1},
+            'setuptools': {'20.0': 1}
+        }
+        assert DataQuery._merge_counts(cached, delta) == {
+            'pip': {'8.1.2': 4, '8.0.0': 4, 'null': 2},
+            'null': {'null': 3},
+            'setuptools': {'20.0': 1}
+        }
+        assert cached['pip']['8.1.2'] == 3
+        assert DataQuery._merge_counts({'1.0': 2}, {'1.0': 1, '1.1': 1}) == {
+            '1.0': 3, '1.1': 1
+        }
+
+    def test_cached_records(self):
+        recs = {
+            'foo': {'cache_metadata': {'data_ts_usec': 10}},
+            'bar': {'cache_metadata': {'data_ts_usec': 10}}
+        }
+        self.mock_cache.get.side_effect = lambda p, d: recs.get(p, None)
+        assert self.cls._cached_records(datetime(2016, 8, 22)) == recs
+        recs['bar']['cache_metadata']['data_ts_usec'] = 11
+        assert self.cls._cached_records(datetime(2016, 8, 22)) is None
+        del recs['bar']
+        assert self.cls._cached_records(datetime(2016, 8, 22)) is None
+
+    def test_query_one_table(self):
+        self.cls.incremental = True
+        self.cls.single_scan = True
+        recs = {
+            'foo': {'by_version': {'1.0': 2},
+                    'cache_metadata': {'data_ts_usec': 10}},
+            'bar': {'by_version': {},
+                    'cache_metadata': {'data_ts_usec': 10}}
+        }
+        self.mock_cache.get.side_effect = lambda p, d: recs.get(p, None)
+        delta = {
+            'foo': {'by_version': {'1.0': 1, '1.1': 1}},
+            'bar': {'by_version': {'0.1': 1}}
+        }
+        with patch('%s._query_single_scan' % pb) as mock_single:
+            mock_single.return_value = (20000000, delta)
+            self.cls.query_one_table('downloads20160822')
+        assert mock_single.mock_calls == [
+            call('downloads20160822', None, 10)
+        ]
+        assert len(self.mock_cache.set_many.mock_calls) == 1
+        sets = sorted(self.mock_cache.set_many.mock_calls[0][1][0])
+        assert sets == sorted([
+            ('foo', datetime(2016, 8, 22),
+             {'by_version': {'1.0': 3, '1.1': 1}}, 20,
+             {'data_ts_usec': 20000000}),
+            ('bar', datetime(2016, 8, 22),
+             {'by_version': {'0.1': 1}}, 20, {'data_ts_usec': 20000000})
+        ])
+
+    def test_queries_for_table(self):
+        self.cls.single_scan = True
+        recs = {
+            'foo': {'by_version': {'1.0': 2},
+                    'cache_metadata': {'data_ts_usec': 10}},
+            'bar': {'by_version': {},
+                    'cache_metadata': {'data_ts_usec': 10}}
+        }
+        self.mock_cache.get.side_effect = lambda p, d: recs.get(p, None)
+        since = 'timestamp > USEC_TO_TIMESTAMP(10)'
+        q = self.cls._queries_for_table('downloads20160822')
+        assert since not in q[0][1]
+        self.cls.incremental = True
+        q = self.cls._queries_for_table('downloads20160822')
+        assert q[0][1] == self.cls._single_scan_query(
+            self.cls._from_for_table('downloads20160822'), since_ts=10
+        )
+        self.cls.single_scan = False
+        q = self.cls._queries_for_table('downloads20160822')
+        assert since not in q[0][1]
+        assert len(q) > 1
+        for _, query in q[1:]:
+            assert since in query
+        del recs['bar']
+        q = self.cls._queries_for_table('downloads20160822')
+        for _, query in q:
+            assert since not in query
+
+    def test_since_ts_query(self):
+        q = self.cls._single_scan_query('FROM [x]', since_ts=1471900000)
+        assert "WHERE file.project IN ('foo', 'bar') AND " \
+               "timestamp > USEC_TO_TIMESTAMP(1471900000)" in q
+        q = self.cls._dimension_query(
+            'downloads20160822', 'by_version', since_ts=1471900000)
+        assert "WHERE file.project IN ('foo', 'bar') AND " \
+               "timestamp > USEC_TO_TIMESTAMP(1471900000)" in q
+
+
+class TestCube(DataQueryTester):
+
+    def _row(self, project, values, count, row_type='counts'):
+        row = {'row_type': row_type, 'file_project': project,
+               'dl_count': str(count)}
+        for c in DataQuery._all_dimension_columns():
+            row[DataQuery._column_alias(c)] = values.get(c, None)
+        return row
+
+    def test_query_cube(self):
+        rows = [
+            self._row(None, {}, 1471900000, row_type='data_ts'),
+            self._row('foo', {'file.version': '1.0',
+                              'details.implementation.name': 'CPython',
+                              'country_code': 'US'}, 3),
+            self._row('foo', {'file.version': '1.0',
+                              'details.implementation.name': 'PyPy',
+                              'country_code': 'US'}, 2),
+            self._row('foo', {'file.version': '0.9',
+                              'details.implementation.name': 'CPython'}, 1)
+        ]
+        with patch('%s._run_query' % pb) as mock_run:
+            mock_run.return_value = rows
+            ts, res = self.cls._query_cube('downloads20160822')
+        assert ts == 1471900000
+        assert res['foo']['by_version'] == {'1.0': 5, '0.9': 1}
+        assert res['foo']['by_implementation'] == {
+            'CPython': {None: 4}, 'PyPy': {None: 2}
+        }
+        assert res['foo']['by_country'] == {'US': 5, None: 1}
+        assert res['foo']['cube']['columns'] == \
+            DataQuery._all_dimension_columns()
+        assert len(res['foo']['cube']['rows']) == 3
+        assert res['foo']['cube']['rows'][0][-1] == 3
+        assert res['bar']['by_version'] == {}
+        assert res['bar']['cube']['rows'] == []
+        q = mock_run.mock_calls[0][1][0]
+        assert q.count('[the-psf:pypi.downloads20160822]') == 2
+        assert 'GROUP BY row_type, file_project, file_version, file_type, ' \
+               'details_installer_name' in q
+        assert 'details.distro.version AS details_distro_version' in q
+        assert "file.project IN ('foo', 'bar')" in q
+
+    def test_query_one_table(self):
+        self.cls.cube = True
+        self.cls.single_scan = True
+        data = {'foo': {'by_version': {'1.0': 2}}}
+        with patch.multiple(
+            pb, autospec=True, _query_cube=DEFAULT,
+            _query_single_scan=DEFAULT
+        ) as mocks:
+            mocks['_query_cube'].return_value = (1234, data)
+            self.cls.query_one_table('downloads20160822')
+        assert mocks['_query_cube'].mock_calls == [
+            call(self.cls, 'downloads20160822', None, None)
+        ]
+        assert mocks['_query_single_scan'].mock_calls == []
+
+    def test_date_range(self):
+        self.cls.cube = True
+        rows = [
+            dict(self._row(None, {}, 1471910000, row_type='data_ts'),
+                 download_date='2016-08-21'),
+            dict(self._row('foo', {'file.version': '1.0'}, 3),
+                 download_date='2016-08-21')
+        ]
+        with patch('%s._run_query' % pb) as mock_run:
+            mock_run.return_value = rows
+            res = self.cls._query_date_range(
+                datetime(2016, 8, 21), datetime(2016, 8, 22)
+            )
+        assert list(res.keys()) == [datetime(2016, 8, 21)]
+        assert res[datetime(2016, 8, 21)][0] == 1471910000
+        assert res[datetime(2016, 8, 21)][1]['foo']['by_version'] == {
+            '1.0': 3
+        }
+        q = mock_run.mock_calls[0][1][0]
+        assert 'GROUP BY row_type, file_project' not in q
+        assert 'GROUP BY download_date, row_type, file_project' in q
+
+    def test_incremental(self):
+        self.cls.cube = True
+        self.cls.incremental = True
+        cols = DataQuery._all_dimension_columns()
+        cached = {
+            'cache_metadata': {'data_ts_usec': 1000},
+            'cube': {'columns': cols,
+                     'rows': [['1.0'] + [None] * (len(cols) - 1) + [3]]},
+            'by_version': {'1.0': 3}
+        }
+        self.mock_cache.get.return_value = cached
+        delta_cube = {
+            'columns': cols,
+            'rows': [['1.0'] + [None] * (len(cols) - 1) + [2],
+                     ['1.1'] + [None] * (len(cols) - 1) + [1]]
+        }
+        delta = {
+            'foo': {'cube': delta_cube, 'by_version': {'1.0': 2, '1.1': 1}},
+            'bar': {'cube': delta_cube, 'by_version': {'1.0': 2, '1.1': 1}}
+        }
+        with patch('%s._query_cube' % pb) as mock_cube:
+            mock_cube.return_value = (2000000000, delta)
+            self.cls.query_one_table('downloads20160822')
+        assert mock_cube.mock_calls == [
+            call('downloads20160822', None, 1000)
+        ]
+        args = self.mock_cache.set_many.mock_calls[0][1][0][0]
+        assert args[1] == datetime(2016, 8, 22)
+        assert args[3] == 2000
+        assert args[4]['data_ts_usec'] == 2000000000
+        assert args[2]['by_version'] == {'1.0': 5, '1.1': 1}
+        assert len(args[2]['cube']['rows']) == 2
+
+    def test_cached_records_no_cube(self):
+        self.cls.cube = True
+        self.mock_cache.get.return_value = {
+            'cache_metadata': {'data_ts_usec': 1000}, 'by_version': {}
+        }
+        assert self.cls._cached_records(datetime(2016, 8, 22)) is None
+
+
+class TestSample(DataQueryTester):
+
+    def test_invalid_rate(self):
+        for rate in [0, 1, 1.5]:
+            with pytest.raises(Exception) as excinfo:
+                DataQuery('myproj', ['foo'], self.mock_cache, backend=Mock(),
+                          sample_rate=rate)
+            assert 'sample rate must be' in str(excinfo.value)
+
+    def test_where(self):
+        self.cls.sample_rate = 0.01
+        assert self.cls._where_for_projects(['foo'], 1471900000) == \
+            "WHERE file.project IN ('foo') AND " \
+            "timestamp > USEC_TO_TIMESTAMP(1471900000) AND " \
+            "ABS(HASH(STRING(timestamp))) % 1000000 < 10000"
+        q = self.cls._cube_query('FROM [x]')
+        assert q.count('ABS(HASH(STRING(timestamp)))') == 1
+
+    def test_scale_counts(self):
+        self.cls.sample_rate = 0.25
+        data = {
+            'foo': {
+                'by_version': {'1.0': 3, '1.1': 1},
+                'by_installer': {'pip': {'8.1.2': 2}},
+                'cube': {'columns': ['file.version'],
+                         'rows': [['1.0', 3], ['1.1', 1]]}
+            }
+        }
+        self.cls._scale_counts(data)
+        assert data == {
+            'foo': {
+                'by_version': {'1.0': 12, '1.1': 4},
+                'by_installer': {'pip': {'8.1.2': 8}},
+                'cube': {'columns': ['file.version'],
+                         'rows': [['1.0', 12], ['1.1', 4]]}
+            }
+        }
+
+    def test_query_one_table(self):
+        self.cls.sample_rate = 0.5
+        data = {'foo': {'by_version': {'1.0': 2}}}
+        table = {'lastModifiedTime': '1471900000123', 'numRows': '456'}
+        with patch('%s._query_per_dimension' % pb) as mock_per:
+            mock_per.return_value = (1234000000, data)
+            self.cls.query_one_table('downloads20160822', table=table)
+        assert self.mock_cache.mock_calls == [
+            call.set_many([
+                ('foo', datetime(2016, 8, 22), {'by_version': {'1.0': 4}},
+                 1234, {
+                     'data_ts_usec': 1234000000,
+                     'table_modified': 1471900000123, 'table_rows': 456,
+                     'approximate': True, 'sample_rate': 0.5
+                 })
+            ])
+        ]
+
+    def test_is_usable_record(self):
+        exact = {'cache_metadata': {}}
+        sampled = {'cache_metadata': {'approximate': True,
+                                      'sample_rate': 0.1}}
+        assert self.cls._is_usable_record(exact)
+        assert not self.cls._is_usable_record(sampled)
+        self.cls.sample_rate = 0.1
+        assert self.cls._is_usable_record(exact)
+        assert self.cls._is_usable_record(sampled)
+        self.cls.sample_rate = 0.5
+        assert not self.cls._is_usable_record(sampled)
+
+    def test_exact_run_replaces_approximate(self):
+        table = {'lastModifiedTime': '1471900000123', 'numRows': '456'}
+        sampled = {'cache_metadata': {
+            'table_modified': 1471900000123, 'table_rows': 456,
+            'approximate': True, 'sample_rate': 0.1
+        }}
+        self.mock_cache.get.return_value = sampled
+        assert not self.cls._is_cache_current('downloads20160822', table)
+        self.mock_cache.get_dates_for_project.return_value = [
+            datetime(2016, 8, 1)
+        ]
+        self.mock_cache.get_many.side_effect = lambda keys: {
+            k: sampled for k in keys
+        }
+        assert self.cls._cache_gaps([datetime(2016, 8, 1)]) == {
+            datetime(2016, 8, 1): ['foo', 'bar']
+        }
+        self.cls.sample_rate = 0.1
+        assert self.cls._is_cache_current('downloads20160822', table)
+        assert self.cls._cache_gaps([datetime(2016, 8, 1)]) == {
+            datetime(2016, 8, 1): []
+        }
+
+    def test_cached_records_rate_mismatch(self):
+        recs = {
+            'foo': {'cache_metadata': {'data_ts_usec': 10, 'sample_rate': 0.1}},
+            'bar': {'cache_metadata': {'data_ts_usec': 10, 'sample_rate': 0.1}}
+        }
+        self.mock_cache.get.side_effect = lambda p, d: recs.get(p, None)
+        assert self.cls._cached_records(datetime(2016, 8, 22)) is None
+        self.cls.sample_rate = 0.1
+        assert self.cls._cached_records(datetime(2016, 8, 22)) == recs
+
+
+class TestTopK(DataQueryTester):
+
+    def setup_method(self):
+        super(TestTopK, self).setup_method()
+        self.cls.top_k = 2
+
+    def test_dimension_query(self):
+        q = self.cls._dimension_query('downloads20160822', 'by_installer')
+        assert q == (
+            "SELECT file_project, details_installer_name, "
+            "details_installer_version, SUM(dl_count) AS dl_count FROM "
+            "(SELECT file_project, CASE WHEN dl_rank > 2 THEN 'other' "
+            "WHEN details_installer_name = 'other' THEN 'other (value)' "
+            "ELSE details_installer_name END AS details_installer_name, "
+            "CASE WHEN dl_rank > 2 THEN 'other' "
+            "WHEN details_installer_version = 'other' THEN 'other (value)' "
+            "ELSE details_installer_version END AS "
+            "details_installer_version, dl_count FROM "
+            "(SELECT file_project, details_installer_name, "
+            "details_installer_version, dl_count, ROW_NUMBER() OVER "
+            "(PARTITION BY file_project ORDER BY dl_count DESC, "
+            "details_installer_name, details_installer_version) AS dl_rank "
+            "FROM (SELECT file.project AS file_project, details.installer.name "
+            "AS details_installer_name, details.installer.version AS "
+            "details_installer_version, COUNT(*) AS dl_count "
+            "FROM [the-psf:pypi.downloads20160822] "
+            "WHERE file.project IN ('foo', 'bar') GROUP BY file_project, "
+            "details_installer_name, details_installer_version))) "
+            "GROUP BY file_project, details_installer_name, "
+            "details_installer_version;"
+        )
+
+    def test_single_scan_query(self):
+        q = self.cls._single_scan_query('FROM [x]', by_date=True)
+        assert 'ROW_NUMBER() OVER (PARTITION BY download_date, dimension, ' \
+            'file_project ORDER BY dl_count DESC, key1, key2)' in q
+        assert q.count('ROW_NUMBER()') == 1
+        assert q.endswith(", (SELECT DATE(timestamp) AS download_date, "
+                          "'data_ts' AS dimension, STRING(NULL) AS "
+                          "file_project, STRING(TIMESTAMP_TO_USEC(MAX("
+                          "timestamp))) AS key1, STRING(NULL) AS key2, "
+                          "COUNT(*) AS dl_count FROM [x] GROUP BY "
+                          "download_date);")
+
+    def test_limit_breakdown(self):
+        assert self.cls._limit_breakdown({'1.0': 3, '1.1': 1}, 1) == {
+            '1.0': 3, '1.1': 1
+        }
+        assert self.cls._limit_breakdown(
+            {'1.0': 3, '1.1': 1, '1.2': 2, '0.9': 1, 'other': 4}, 1
+        ) == {'other (value)': 4, '1.0': 3, 'other': 4}
+        assert self.cls._limit_breakdown({
+            'pip': {'8.1.2': 3, '8.0.0': 1},
+            'setuptools': {'20.0': 2},
+            'other': {'other': 1}
+        }, 2) == {
+            'pip': {'8.1.2': 3},
+            'setuptools': {'20.0': 2},
+            'other': {'other': 2}
+        }
+
+    def test_limit_breakdown_ties(self):
+        # ties are broken as ORDER BY dl_count DESC, key1, key2 does, with
+        # NULL first
+        assert self.cls._limit_breakdown(
+            {'b': 2, 'a': 2, None: 2, 'Z': 2, 'c': 5}, 1
+        ) == {'c': 5, None: 2, 'other': 6}
+        assert self.cls._limit_breakdown({
+            'pip': {'9.0': 1, '8.1': 1, None: 1},
+            None: {None: 1}
+        }, 2) == {
+            None: {None: 1},
+            'pip': {None: 1},
+            'other': {'other': 2}
+        }
+
+    def test_sort_key(self):
+        assert sorted(
+            ['b', None, 'B', 'a', '\xe9', '10', '9'],
+            key=self.cls._sort_key
+        ) == [None, '10', '9', 'B', 'a', 'b', '\xe9']
+
+    def test_cube_breakdowns(self):
+        cube_data = {
+            'columns': ['file.version', 'file.type'],
+            'rows': [['1.0', 'sdist', 3], ['1.1', 'sdist', 1],
+                     ['1.2', 'bdist_wheel', 2]]
+        }
+        with patch.dict('%s._DIMENSION_COLUMNS' % pb, clear=True) as dims:
+            dims['by_version'] = ['file.version']
+            dims['by_file_type'] = ['file.type']
+            res = self.cls._cube_breakdowns(cube_data)
+        assert res == {
+            'by_version': {'1.0': 3, '1.2': 2, 'other': 1},
+            'by_file_type': {'sdist': 4, 'bdist_wheel': 2}
+        }
+
+    def test_cube_breakdowns_other_value(self):
+        cube_data = {
+            'columns': ['file.version', 'details.installer.name',
+                        'details.installer.version'],
+            'rows': [['other', 'other', 'other', 5], ['1.0', 'pip', '9.0', 3],
+                     ['1.1', 'pip', '8.1', 1], ['1.2', 'other', '1.0', 2]]
+        }
+        with patch.dict('%s._DIMENSION_COLUMNS' % pb, clear=True) as dims:
+            dims['by_version'] = ['file.version']
+            dims['by_installer'] = ['details.installer.name',
+                                    'details.installer.version']
+            res = self.cls._cube_breakdowns(cube_data)
+        assert res == {
+            'by_version': {'other (value)': 5, '1.0': 3, 'other': 3},
+            'by_installer': {
+                'other (value)': {'other (value)': 5},
+                'pip': {'9.0': 3},
+                'other': {'other': 3}
+            }
+        }
+
+    def test_incremental(self):
+        self.cls.incremental = True
+        self.cls.single_scan = True
+        recs = {
+            'foo': {'by_version': {'1.0': 2, '1.1': 2},
+                    'cache_metadata': {'data_ts_usec': 10}},
+            'bar': {'by_version': {}, 'cache_metadata': {'data_ts_usec': 10}}
+        }
+        self.mock_cache.get.side_effect = lambda p, d: recs.get(p, None)
+        delta = {
+            'foo': {'by_version': {'1.2': 3, '1.1': 1}},
+            'bar': {'by_version': {}}
+        }
+        with patch('%s._query_single_scan' % pb) as mock_single:
+            mock_single.return_value = (20000000, delta)
+            self.cls.query_one_table('downloads20160822')
+        # limited breakdowns can't be merged; the whole day is queried again
+        assert mock_single.mock_calls == [
+            call('downloads20160822', None, None)
+        ]
+        sets = {
+            r[0]: r[2] for r in self.mock_cache.set_many.mock_calls[0][1][0]
+        }
+        assert sets['foo'] == {'by_version': {'1.2': 3, '1.1': 1}}
+        assert self.cls._cached_records(datetime(2016, 8, 22)) is None
+
+
+class TestDimensions(DataQueryTester):
+
+    def setup_method(self):
+        super(TestDimensions, self).setup_method()
+        self.cls.dimensions = ['by_implementation', 'by_version']
+
+    def test_invalid(self):
+        with pytest.raises(Exception) as excinfo:
+            DataQuery('myproj', ['foo'], self.mock_cache, backend=Mock(),
+                      dimensions=['by_version', 'by_foo'])
+        assert 'unknown dimension(s): by_foo' in str(excinfo.value)
+
+    def test_dimensions(self):
+        assert list(self.cls._dimensions().keys()) == [
+            'by_version', 'by_implementation'
+        ]
+        assert self.cls._query_columns() == [
+            'file.version', 'details.implementation.name',
+            'details.implementation.version'
+        ]
+
+    def test_query_per_dimension(self):
+        with patch.multiple(
+            pb,
+            autospec=True,
+            _get_newest_ts_in_table=DEFAULT,
+            _query_dimension=DEFAULT
+        ) as mocks:
+            mocks['_get_newest_ts_in_table'].return_value = 1234
+            mocks['_query_dimension'].return_value = {'foo': {}, 'bar': {}}
+            res = self.cls._query_per_dimension('downloads20160822')
+        assert mocks['_query_dimension'].mock_calls == [
+            call(self.cls, 'downloads20160822', 'by_version', None, None,
+                 1234),
+            call(self.cls, 'downloads20160822', 'by_implementation', None,
+                 None, 1234)
+        ]
+        assert res == (1234, {
+            'foo': {'by_version': {}, 'by_implementation': {}},
+            'bar': {'by_version': {}, 'by_implementation': {}}
+        })
+
+    def test_single_scan_query(self):
+        q = self.cls._single_scan_query('FROM [x]')
+        assert "SPLIT('by_version,by_implementation', ',')" in q
+        assert 'country_code' not in q
+        assert 'file.type' not in q
+        self.cls.dimensions = ['by_version']
+        q = self.cls._single_scan_query('FROM [x]')
+        assert "CASE WHEN dimension = 'by_version' THEN file_version " \
+            "ELSE NULL END AS key1, STRING(NULL) AS key2" in q
+
+    def test_cube_query(self):
+        q = self.cls._cube_query('FROM [x]')
+        assert 'file_version, details_implementation_name, ' \
+            'details_implementation_version, dl_count FROM' in q
+        assert 'country_code' not in q
+
+    def test_set_cache(self):
+        self.mock_cache.get.side_effect = lambda p, d: {
+            'foo': {
+                'by_version': {'0.9': 1},
+                'by_country': {'US': 1},
+                'cube': {'columns': [], 'rows': []},
+                'cache_metadata': {'data_ts_usec': 10}
+            }
+        }.get(p, None)
+        self.cls._set_cache(datetime(2016, 8, 22), 20, {
+            'foo': {'by_version': {'1.0': 2}, 'by_implementation': {}},
+            'bar': {'by_version': {}, 'by_implementation': {}}
+        })
+        meta = {'dimensions': ['by_version', 'by_implementation']}
+        assert self.mock_cache.set_many.mock_calls == [
+            call([
+                ('foo', datetime(2016, 8, 22), {
+                    'by_version': {'1.0': 2}, 'by_implementation': {},
+                    'by_country': {'US': 1}
+                }, 20, meta),
+                ('bar', datetime(2016, 8, 22), {
+                    'by_version': {}, 'by_implementation': {}
+                }, 20, meta)
+            ])
+        ]
+
+    def test_is_usable_record(self):
+        full = {'cache_metadata': {}}
+        partial = {'cache_metadata': {'dimensions': ['by_version']}}
+        assert self.cls._is_usable_record(full)
+        assert not self.cls._is_usable_record(partial)
+        self.cls.dimensions = ['by_version']
+        assert self.cls._is_usable_record(partial)
+        self.cls.dimensions = None
+        assert not self.cls._is_usable_record(partial)
+
+    def test_cached_records(self):
+        recs = {
+            'foo': {'cache_metadata': {
+                'data_ts_usec': 10, 'dimensions': ['by_version']
+            }},
+            'bar': {'cache_metadata': {'data_ts_usec': 10}}
+        }
+        self.mock_cache.get.side_effect = lambda p, d: recs.get(p, None)
+        assert self.cls._cached_records(datetime(2016, 8, 22)) is None
+        self.cls.dimensions = ['by_version']
+        assert self.cls._cached_records(datetime(2016, 8, 22)) == recs
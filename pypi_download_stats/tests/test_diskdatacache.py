@@ -0,0 +1,291 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import os
+import sys
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+
+from pypi_download_stats.diskdatacache import DiskDataCache, CacheMetadata
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call
+else:
+    from unittest.mock import patch, call
+
+pbm = 'pypi_download_stats.diskdatacache'
+
+
+class TestDiskDataCache(object):
+
+    def test_get_set(self, tmpdir):
+        cls = DiskDataCache(str(tmpdir))
+        dt = datetime(2016, 8, 22)
+        assert cls.get('foo', dt) is None
+        cls.set('foo', dt, {'by_version': {'1.0': 3}}, 1471910399)
+        assert os.path.exists(str(tmpdir.join('foo_20160822.json')))
+        res = cls.get('foo', dt)
+        assert res['by_version'] == {'1.0': 3}
+        assert res['cache_metadata']['date'] == dt
+        assert res['cache_metadata']['data_ts'] == 1471910399
+        assert cls.get_dates_for_project('foo') == [dt]
+        assert cls.get_dates_for_project('bar') == []
+
+    def test_get_many_get_range(self, tmpdir):
+        cls = DiskDataCache(str(tmpdir))
+        cls.set_many([
+            ('foo', datetime(2016, 8, x), {'by_version': {'1.0': x}}, x, None)
+            for x in range(1, 6)
+        ] + [('bar', datetime(2016, 8, 2), {'by_version': {}}, 2, None)])
+        res = cls.get_range('foo', datetime(2016, 8, 2), datetime(2016, 8, 4))
+        assert sorted(res.keys()) == [
+            datetime(2016, 8, 2), datetime(2016, 8, 3), datetime(2016, 8, 4)
+        ]
+        assert res[datetime(2016, 8, 3)]['by_version'] == {'1.0': 3}
+        assert res[datetime(2016, 8, 3)]['cache_metadata']['date'] == \
+            datetime(2016, 8, 3)
+        assert cls.get_range(
+            'bar', datetime(2016, 8, 3), datetime(2016, 8, 4)) == {}
+        res = cls.get_many([
+            ('foo', datetime(2016, 8, 1)), ('bar', datetime(2016, 8, 2)),
+            ('bar', datetime(2016, 8, 3)), ('baz', datetime(2016, 8, 1))
+        ])
+        assert sorted(res.keys()) == [
+            ('bar', datetime(2016, 8, 2)), ('foo', datetime(2016, 8, 1))
+        ]
+        assert res[('foo', datetime(2016, 8, 1))] == cls.get(
+            'foo', datetime(2016, 8, 1))
+
+    def test_get_many_get_range_indexed(self, tmpdir):
+        cls = DiskDataCache(str(tmpdir))
+        cls.set_many([
+            ('foo', datetime(2016, 8, x), {'by_version': {'1.0': x}}, x, None)
+            for x in [1, 3]
+        ])
+        with patch.object(cls, '_read_record',
+                          wraps=cls._read_record) as mock_read:
+            res = cls.get_many([
+                ('foo', datetime(2016, 8, x)) for x in range(1, 5)
+            ] + [('bar', datetime(2016, 8, 1))])
+            assert sorted(res.keys()) == [
+                ('foo', datetime(2016, 8, 1)), ('foo', datetime(2016, 8, 3))
+            ]
+            assert mock_read.mock_calls == [
+                call('foo', datetime(2016, 8, 1)),
+                call('foo', datetime(2016, 8, 3))
+            ]
+            mock_read.reset_mock()
+            res = cls.get_range(
+                'foo', datetime(2016, 8, 2), datetime(2016, 8, 4))
+            assert list(res.keys()) == [datetime(2016, 8, 3)]
+            assert mock_read.mock_calls == [
+                call('foo', datetime(2016, 8, 3))
+            ]
+
+    def test_state(self, tmpdir):
+        cls = DiskDataCache(str(tmpdir))
+        assert cls.get_state('tables') is None
+        cls.set_state('tables', {'tables': ['downloads20160822']})
+        assert os.path.exists(str(tmpdir.join('_tables.json')))
+        assert cls.get_state('tables') == {'tables': ['downloads20160822']}
+        assert cls.get_dates_for_project('tables') == []
+
+    def test_set_many(self, tmpdir):
+        cls = DiskDataCache(str(tmpdir))
+        cls.set_many([
+            ('foo', datetime(2016, 8, 21), {'by_version': {}}, 1, None),
+            ('foo', datetime(2016, 8, 22), {'by_version': {}}, 2,
+             {'table_rows': 5}),
+            ('bar', datetime(2016, 8, 22), {'by_version': {}}, 2, None)
+        ])
+        res = cls.get('foo', datetime(2016, 8, 22))
+        assert res['cache_metadata']['data_ts'] == 2
+        assert res['cache_metadata']['table_rows'] == 5
+        cls.set_state('tables', {})
+        tmpdir.mkdir('_query_results')
+        assert cls.get_all_dates() == {
+            'foo': [datetime(2016, 8, 21), datetime(2016, 8, 22)],
+            'bar': [datetime(2016, 8, 22)]
+        }
+        assert cls.get_state_names() == ['tables']
+
+    def test_date_index(self, tmpdir):
+        cls = DiskDataCache(str(tmpdir))
+        cls.set_many([
+            ('foo', datetime(2016, 8, 22), {'by_version': {'1.0': 3}}, 2,
+             None),
+            ('foo', datetime(2016, 8, 21), {'by_version': {}}, 1, None)
+        ])
+        assert cls.get_date_index('foo') == {
+            datetime(2016, 8, 21): {'data_ts': 1, 'empty': True},
+            datetime(2016, 8, 22): {'data_ts': 2, 'empty': False}
+        }
+        assert cls.get_date_index('bar') == {}
+        assert sorted(os.listdir(str(tmpdir.join('_index')))) == ['foo.json']
+        # the index is used instead of listing the cache directory
+        os.remove(str(tmpdir.join('foo_20160821.json')))
+        assert cls.get_dates_for_project('foo') == [
+            datetime(2016, 8, 21), datetime(2016, 8, 22)
+        ]
+        assert cls.rebuild_index() == 1
+        assert cls.get_all_dates() == {'foo': [datetime(2016, 8, 22)]}
+
+    def test_date_index_built_for_old_cache(self, tmpdir):
+        tmpdir.join('foo_20160822.json').write(
+            '{"by_version": {}, "cache_metadata": {"data_ts": 2}}'
+        )
+        tmpdir.join('bar_20160822.json').write('not json')
+        cls = DiskDataCache(str(tmpdir))
+        assert cls.get_all_dates() == {'foo': [datetime(2016, 8, 22)]}
+        assert os.path.isdir(str(tmpdir.join('_index')))
+        assert cls.get_state_names() == []
+
+    def test_compression_invalid(self, tmpdir):
+        with pytest.raises(Exception) as excinfo:
+            DiskDataCache(str(tmpdir), compression='bz2')
+        assert 'unknown cache compression' in str(excinfo.value)
+        with patch('%s.zstandard' % pbm, None):
+            with pytest.raises(Exception) as excinfo:
+                DiskDataCache(str(tmpdir), compression='zstd')
+        assert 'requires zstandard' in str(excinfo.value)
+
+    def test_gzip(self, tmpdir):
+        dt = datetime(2016, 8, 22)
+        DiskDataCache(str(tmpdir)).set(
+            'foo', dt, {'by_version': {'1.0': 3}}, 1)
+        cls = DiskDataCache(str(tmpdir), compression='gzip')
+        assert cls.get('foo', dt)['by_version'] == {'1.0': 3}
+        cls.set('foo', dt, {'by_version': {'1.0': 4}}, 2)
+        assert not os.path.exists(str(tmpdir.join('foo_20160822.json')))
+        with gzip.open(str(tmpdir.join('foo_20160822.json.gz')), 'rb') as fh:
+            raw = json.loads(fh.read().decode('utf-8'))
+        assert raw['by_version'] == {'1.0': 4}
+        assert DiskDataCache(str(tmpdir)).get(
+            'foo', dt)['by_version'] == {'1.0': 4}
+        assert cls.rebuild_index() == 1
+        assert cls.get_dates_for_project('foo') == [dt]
+
+    def test_zstd(self, tmpdir):
+        pytest.importorskip('zstandard')
+        dt = datetime(2016, 8, 22)
+        cls = DiskDataCache(str(tmpdir), compression='zstd')
+        cls.set('foo', dt, {'by_version': {'1.0': 3}}, 1)
+        assert os.listdir(str(tmpdir.join('_index'))) == ['foo.json']
+        assert os.path.exists(str(tmpdir.join('foo_20160822.json.zst')))
+        assert DiskDataCache(str(tmpdir)).get(
+            'foo', dt)['by_version'] == {'1.0': 3}
+
+    def test_recompress(self, tmpdir):
+        cls = DiskDataCache(str(tmpdir))
+        for x in range(1, 4):
+            cls.set('foo', datetime(2016, 8, x), {'by_version': {}}, x)
+        cls.set_state('tables', {})
+        tmpdir.join('foo_20160804.json').write('not json')
+        gz = DiskDataCache(str(tmpdir), compression='gzip')
+        gz.set('foo', datetime(2016, 8, 3), {'by_version': {'1.0': 1}}, 4)
+        # older copy of a record that is also stored compressed
+        tmpdir.join('foo_20160803.json').write(json.dumps(
+            {'by_version': {}, 'cache_metadata': {'updated': 1}}
+        ))
+        assert gz.recompress() == 2
+        assert sorted(f for f in os.listdir(str(tmpdir)) if '.' in f) == [
+            '_tables.json', 'foo_20160801.json.gz', 'foo_20160802.json.gz',
+            'foo_20160803.json.gz', 'foo_20160804.json'
+        ]
+        assert gz.get('foo', datetime(2016, 8, 3))['by_version'] == {'1.0': 1}
+        assert cls.recompress() == 3
+        assert cls.get('foo', datetime(2016, 8, 1))['by_version'] == {}
+
+    def test_serializers(self, tmpdir):
+        pytest.importorskip('msgpack')
+        pytest.importorskip('orjson')
+        data = {'by_version': {'1.0': 3, None: 1}}
+        DiskDataCache(str(tmpdir), serializer='orjson').set(
+            'foo', datetime(2016, 8, 21), dict(data), 1)
+        cls = DiskDataCache(str(tmpdir), serializer='msgpack',
+                            compression='gzip')
+        cls.set('foo', datetime(2016, 8, 22), dict(data), 2)
+        assert os.path.exists(str(tmpdir.join('foo_20160822.msgpack.gz')))
+        assert cls.get_dates_for_project('foo') == [
+            datetime(2016, 8, 21), datetime(2016, 8, 22)
+        ]
+        disk = DiskDataCache(str(tmpdir))
+        for dt in [datetime(2016, 8, 21), datetime(2016, 8, 22)]:
+            assert cls.get('foo', dt)['by_version'] == {'1.0': 3, 'null': 1}
+            assert disk.get('foo', dt) == cls.get('foo', dt)
+        assert disk.recompress() == 1
+        assert disk.rebuild_index() == 2
+        assert disk.get('foo', datetime(2016, 8, 22))['by_version'] == {
+            '1.0': 3, 'null': 1
+        }
+
+    def test_cache_metadata(self):
+        meta = CacheMetadata({'date': '20160822', 'updated': 1471910399,
+                              'data_ts': 5})
+        assert meta['date'] == datetime(2016, 8, 22)
+        assert meta.get('updated') == datetime.fromtimestamp(1471910399)
+        assert meta.get('data_ts') == 5
+        assert meta.get('sample_rate', 1) == 1
+        assert json.loads(json.dumps(meta)) == {
+            'date': '20160822', 'updated': 1471910399, 'data_ts': 5
+        }
+
+    def test_optional_codecs_missing(self, tmpdir):
+        dt = datetime(2016, 8, 22)
+        tmpdir.join('bar_20160822.msgpack').write('x')
+        tmpdir.join('baz_20160822.json.zst').write('x')
+        with patch('pypi_download_stats.serializers.msgpack', None):
+            with patch('%s.zstandard' % pbm, None):
+                cls = DiskDataCache(str(tmpdir))
+                assert cls.get('foo', dt) is None
+                assert cls.get('bar', dt) is None
+                assert cls.get('baz', dt) is None
+                cls.set('foo', dt, {'by_version': {'1.0': 3}}, 1)
+                assert cls.get('foo', dt)['by_version'] == {'1.0': 3}
+                with patch('%s.open' % pbm, create=True,
+                           side_effect=IOError) as mock_open:
+                    assert cls.get('qux', dt) is None
+                # only the path for the configured settings is opened
+                assert len(mock_open.mock_calls) == 1
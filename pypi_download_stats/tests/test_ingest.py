@@ -0,0 +1,281 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import csv
+import gzip
+import json
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+from pypi_download_stats import ingest
+from pypi_download_stats.dataquery import DataQuery
+from pypi_download_stats.diskdatacache import DiskDataCache
+from pypi_download_stats.querybackends import SQLiteBackend
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT  # noqa
+
+pbm = 'pypi_download_stats.ingest'
+
+PROJECTS = ['foo', 'bar']
+
+
+def _nest(flat):
+    """turn a dict keyed by dotted field names into nested dicts"""
+    event = {}
+    for k, v in flat.items():
+        d = event
+        parts = k.split('.')
+        for part in parts[:-1]:
+            d = d.setdefault(part, {})
+        d[parts[-1]] = v
+    return event
+
+
+class TestIngest(object):
+
+    def setup_method(self):
+        self.backend = SQLiteBackend(':memory:')
+        self.backend.generate_synthetic_data(
+            ['foo', 'bar', 'baz'], datetime(2016, 8, 21), 2, 150, seed=2
+        )
+        self.events = []
+        for table in self.backend.list_tables('the-psf', 'pypi'):
+            cursor = self.backend._get_conn().execute(
+                'SELECT * FROM "%s"' % table
+            )
+            for row in cursor:
+                self.events.append(dict(zip(SQLiteBackend.COLUMNS, row)))
+
+    def _expected(self, tmpdir):
+        """records written by DataQuery, querying the same events"""
+        cache = DiskDataCache(str(tmpdir.join('expected')))
+        dq = DataQuery(None, PROJECTS, cache, backend=self.backend)
+        for table in self.backend.list_tables('the-psf', 'pypi'):
+            dq.query_one_table(table)
+        return cache
+
+    def _assert_same(self, expected, actual):
+        dates = [datetime(2016, 8, 21), datetime(2016, 8, 22)]
+        for project in PROJECTS:
+            assert actual.get_dates_for_project(project) == dates
+            for dt in dates:
+                exp = expected.get(project, dt)
+                act = actual.get(project, dt)
+                for rec in [exp, act]:
+                    del rec['cache_metadata']['updated']
+                # only queried records carry the incremental watermark
+                assert exp['cache_metadata'].pop('data_ts_usec') == \
+                    exp['cache_metadata']['data_ts'] * 1000000
+                assert act == exp
+
+    def test_ndjson(self, tmpdir):
+        # nested, with BigQuery-style timestamps
+        path = str(tmpdir.join('events.json'))
+        with open(path, 'w') as fh:
+            for e in self.events:
+                e = dict(e)
+                e['timestamp'] += ' UTC'
+                fh.write(json.dumps(_nest(e)) + '\n')
+        cache = DiskDataCache(str(tmpdir.join('actual')))
+        # small chunks, so the file is split into many byte ranges
+        res = ingest.ingest([path], cache, projects=PROJECTS, jobs=1,
+                            chunk_size=1000)
+        assert res == [datetime(2016, 8, 21), datetime(2016, 8, 22)]
+        self._assert_same(self._expected(tmpdir), cache)
+        assert cache.get_dates_for_project('baz') == []
+
+    def test_csv_multiprocess(self, tmpdir):
+        # split across a plain and a gzipped file, in a directory
+        os.makedirs(str(tmpdir.join('logs')))
+        half = len(self.events) // 2
+        for fname, opener, events in [
+            ('a.csv', open, self.events[:half]),
+            ('b.csv.gz', gzip.open, self.events[half:])
+        ]:
+            with opener(str(tmpdir.join('logs', fname)), 'wt') as fh:
+                writer = csv.writer(fh)
+                writer.writerow(SQLiteBackend.COLUMNS)
+                for e in events:
+                    writer.writerow([
+                        '' if e[c] is None else e[c]
+                        for c in SQLiteBackend.COLUMNS
+                    ])
+        cache = DiskDataCache(str(tmpdir.join('actual')))
+        ingest.ingest([str(tmpdir.join('logs'))], cache, projects=PROJECTS,
+                      jobs=2, chunk_size=2000)
+        self._assert_same(self._expected(tmpdir), cache)
+
+    def test_parquet(self, tmpdir):
+        pa = pytest.importorskip('pyarrow')
+        pq = pytest.importorskip('pyarrow.parquet')
+        path = str(tmpdir.join('events.parquet'))
+        events = [_nest(e) for e in self.events]
+        pq.write_table(pa.Table.from_pylist(events), path, row_group_size=100)
+        assert len(ingest.plan_tasks([path])) == 9
+        cache = DiskDataCache(str(tmpdir.join('actual')))
+        ingest.ingest([path], cache, jobs=1)
+        self._assert_same(self._expected(tmpdir), cache)
+        assert len(cache.get_dates_for_project('baz')) == 2
+
+    def _write_ndjson(self, path, events):
+        with open(path, 'w') as fh:
+            for e in events:
+                fh.write(json.dumps(e) + '\n')
+
+    def test_split_runs(self, tmpdir):
+        # both files have downloads for both days
+        paths = [str(tmpdir.join('a.json')), str(tmpdir.join('b.json'))]
+        self._write_ndjson(paths[0], self.events[::2])
+        self._write_ndjson(paths[1], self.events[1::2])
+        second = len([
+            e for e in self.events[1::2]
+            if e['file.project'] == 'foo' and e['timestamp'] < '2016-08-22'
+        ])
+        # by default, the second run replaces the first run's records
+        cache = DiskDataCache(str(tmpdir.join('replaced')))
+        for path in paths:
+            ingest.ingest([path], cache, projects=PROJECTS, jobs=1)
+        rec = cache.get('foo', datetime(2016, 8, 21))
+        assert sum(rec['by_version'].values()) == second
+        # with merge, the counts of both runs are added up
+        cache = DiskDataCache(str(tmpdir.join('actual')))
+        for path in paths:
+            ingest.ingest([path], cache, projects=PROJECTS, jobs=1,
+                          merge=True)
+        self._assert_same(self._expected(tmpdir), cache)
+
+    def test_flush(self, tmpdir):
+        # both files have downloads for both days, so every part's results
+        # are written, and the second file's are merged with the first's
+        paths = [str(tmpdir.join('a.json')), str(tmpdir.join('b.json'))]
+        self._write_ndjson(paths[0], self.events[::2])
+        self._write_ndjson(paths[1], self.events[1::2])
+        cache = DiskDataCache(str(tmpdir.join('actual')))
+        with patch.object(cache, 'set_many', wraps=cache.set_many) as m_set:
+            res = ingest.ingest(paths, cache, projects=PROJECTS, jobs=1,
+                                flush_days=2)
+        assert res == [datetime(2016, 8, 21), datetime(2016, 8, 22)]
+        assert len(m_set.mock_calls) == 2
+        self._assert_same(self._expected(tmpdir), cache)
+
+    def test_flush_interrupted(self, tmpdir):
+        paths = [str(tmpdir.join('a.json')), str(tmpdir.join('b.json'))]
+        self._write_ndjson(paths[0], [
+            e for e in self.events if e['timestamp'] < '2016-08-22'
+        ])
+        self._write_ndjson(paths[1], [
+            e for e in self.events if e['timestamp'] >= '2016-08-22'
+        ])
+        aggregate = ingest.aggregate_task
+
+        def se_aggregate(task, projects=None):
+            if task[0] == paths[1]:
+                raise KeyboardInterrupt()
+            return aggregate(task, projects)
+
+        cache = DiskDataCache(str(tmpdir.join('actual')))
+        with patch('%s.aggregate_task' % pbm) as mock_agg:
+            mock_agg.side_effect = se_aggregate
+            with pytest.raises(KeyboardInterrupt):
+                ingest.ingest(paths, cache, projects=PROJECTS, jobs=1,
+                              flush_days=1)
+        # the first day was written before the interruption
+        assert cache.get_dates_for_project('foo') == [datetime(2016, 8, 21)]
+
+    def test_merge_cached(self):
+        dt = datetime(2016, 8, 21)
+        cache = Mock()
+        cache.get_many.return_value = {
+            ('foo', dt): {
+                'cache_metadata': {'data_ts': 1471823000},
+                'by_version': {'1.0': 2, 'null': 1},
+                'by_installer': {'pip': {'8.1.2': 1}},
+                'cube': {'columns': ['file.version'], 'rows': [['1.0', 2]]}
+            }
+        }
+        records = [
+            ('foo', dt, {
+                'by_version': {'1.0': 1, '1.1': 3},
+                'by_installer': {'pip': {'8.1.2': 2, '9.0.1': 1}}
+            }, 1471822000, None),
+            ('bar', dt, {'by_version': {'1.0': 1}, 'by_installer': {}},
+             1471822000, None)
+        ]
+        assert ingest._merge_cached(cache, records) == [
+            ('foo', dt, {
+                'by_version': {'1.0': 3, '1.1': 3, 'null': 1},
+                'by_installer': {'pip': {'8.1.2': 3, '9.0.1': 1}}
+            }, 1471823000, None),
+            records[1]
+        ]
+        assert cache.get_many.mock_calls == [
+            call([('foo', dt), ('bar', dt)])
+        ]
+
+    def test_parse_timestamp(self):
+        expected = 1471873512
+        for val in [
+            '2016-08-22 13:45:12 UTC', '2016-08-22 13:45:12.123456 UTC',
+            '2016-08-22T13:45:12Z', '2016-08-22T13:45:12+00:00',
+            1471873512, 1471873512.5, '1471873512',
+            datetime(2016, 8, 22, 13, 45, 12)
+        ]:
+            assert ingest._parse_timestamp(val) == expected
+
+    def test_plan_tasks(self, tmpdir):
+        path = str(tmpdir.join('a.ndjson'))
+        with open(path, 'w') as fh:
+            fh.write('x' * 250)
+        assert ingest.plan_tasks([path], chunk_size=100) == [
+            (path, 'ndjson', (0, 100)),
+            (path, 'ndjson', (100, 200)),
+            (path, 'ndjson', (200, 250))
+        ]
+        with pytest.raises(Exception) as excinfo:
+            ingest.plan_tasks([str(tmpdir.join('a.txt'))])
+        assert 'unsupported file type' in str(excinfo.value)
@@ -0,0 +1,110 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import sys
+from datetime import datetime
+
+from pypi_download_stats.outputgenerator import OutputGenerator
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT  # noqa
+
+pbm = 'pypi_download_stats.outputgenerator'
+pb = '%s.OutputGenerator' % pbm
+
+
+class OutputGeneratorTester(object):
+
+    def setup_method(self):
+        self.mock_stats = Mock(
+            as_of_datetime=datetime(2016, 8, 22, 23, 59, 59),
+            approximate_dates=[]
+        )
+
+    def _cls(self, tmpdir):
+        return OutputGenerator(
+            'foo', self.mock_stats, str(tmpdir.join('foo')), dimensions=[]
+        )
+
+
+class TestGenerateHtml(OutputGeneratorTester):
+
+    def test_approximate_notice(self, tmpdir):
+        self.mock_stats.approximate_dates = [
+            datetime(2016, 8, 20), datetime(2016, 8, 21), datetime(2016, 8, 22)
+        ]
+        with patch('%s.Resources' % pbm) as mock_res:
+            mock_res.return_value.render.return_value = ''
+            html = self._cls(tmpdir)._generate_html()
+        assert '<div id="approximate">' in html
+        assert 'Note: download counts for 3 day(s) between 2016-08-20 and ' \
+            '2016-08-22 are approximate' in html
+
+    def test_no_approximate_notice(self, tmpdir):
+        with patch('%s.Resources' % pbm) as mock_res:
+            mock_res.return_value.render.return_value = ''
+            html = self._cls(tmpdir)._generate_html()
+        assert '<div id="approximate">' not in html
+        assert 'are approximate' not in html
+
+
+class TestLimitData(OutputGeneratorTester):
+
+    def test_few_keys(self, tmpdir):
+        data = {'a': [1, 2], 'b': [3, 4], 'other': [5, 6]}
+        assert self._cls(tmpdir)._limit_data(data) == data
+
+    def test_limit(self, tmpdir):
+        data = {'v%d' % x: [x, x] for x in range(12)}
+        data['other'] = [100, 200]
+        data['other (value)'] = [50, 50]
+        res = self._cls(tmpdir)._limit_data(data)
+        assert sorted(res.keys()) == sorted(
+            ['v%d' % x for x in range(3, 12)] + ['other (value)', 'other']
+        )
+        # the existing 'other' series is summed with the dropped ones
+        assert res['other'] == [103, 203]
+        assert res['other (value)'] == [50, 50]
+        # original data is unchanged
+        assert data['other'] == [100, 200]
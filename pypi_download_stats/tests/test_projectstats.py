@@ -0,0 +1,328 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import sys
+from datetime import datetime
+
+from pypi_download_stats.projectstats import ProjectStats
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT  # noqa
+
+pbm = 'pypi_download_stats.projectstats'
+pb = '%s.ProjectStats' % pbm
+
+
+class ProjectStatsTester(object):
+
+    def setup_method(self):
+        # the oldest cached date is never used (see _get_cache_dates())
+        self.records = {datetime(2016, 8, 20): self._record()}
+        self.mock_cache = Mock()
+        self.mock_cache.get_dates_for_project.side_effect = \
+            lambda p: list(self.records.keys())
+        self.mock_cache.get_range.side_effect = lambda p, start, end: {
+            d: r for d, r in self.records.items() if start <= d <= end
+        }
+        self.mock_cache.get.side_effect = \
+            lambda p, d: self.records.get(d, None)
+
+    @staticmethod
+    def _record(data_ts=1471910399, **kwargs):
+        rec = {'cache_metadata': {'data_ts': data_ts}}
+        rec.update(kwargs)
+        return rec
+
+    def _stats(self, dimensions=None):
+        return ProjectStats('foo', self.mock_cache, dimensions=dimensions)
+
+
+class TestCrosstab(ProjectStatsTester):
+
+    def test_crosstab_data(self):
+        self.records[datetime(2016, 8, 21)] = self._record(
+            by_version={'1.0': 6, '0.9': 5},
+            cube={
+                'columns': ['file.version', 'details.implementation.name',
+                            'country_code'],
+                'rows': [
+                    ['1.0', 'CPython', 'US', 3],
+                    ['1.0', 'PyPy', 'US', 1],
+                    ['1.0', None, 'DE', 2],
+                    ['0.9', 'CPython', 'US', 1],
+                    [None, None, None, 4],
+                    ['null', None, 'US', 1]
+                ]
+            }
+        )
+        # records queried without cube mode have no cross-tabulated data
+        self.records[datetime(2016, 8, 22)] = self._record(
+            by_version={'1.0': 2}
+        )
+        stats = self._stats()
+        assert stats.crosstab_data(
+            ['file.version', 'details.implementation.name']
+        ) == {
+            datetime(2016, 8, 21): {
+                '1.0 CPython': 3,
+                '1.0 PyPy': 1,
+                '1.0 unknown': 2,
+                '0.9 CPython': 1,
+                'unknown': 5
+            },
+            datetime(2016, 8, 22): {'unknown': 0}
+        }
+        assert stats.crosstab_data(
+            ['country_code', 'details.implementation.name', 'file.version']
+        )[datetime(2016, 8, 21)] == {
+            'US CPython 1.0': 3,
+            'US PyPy 1.0': 1,
+            'DE unknown 1.0': 2,
+            'US CPython 0.9': 1,
+            'unknown': 4,
+            'US unknown unknown': 1
+        }
+
+    def test_crosstab_data_one_column(self):
+        self.records[datetime(2016, 8, 21)] = self._record(
+            by_version={'1.0': 3},
+            cube={
+                'columns': ['file.version', 'file.type'],
+                'rows': [['1.0', 'sdist', 2], ['1.0', None, 1]]
+            }
+        )
+        assert self._stats().crosstab_data(['file.type']) == {
+            datetime(2016, 8, 21): {'sdist': 2, 'unknown': 1}
+        }
+
+
+class TestApproximate(ProjectStatsTester):
+
+    def test_approximate_dates(self):
+        self.records[datetime(2016, 8, 21)] = self._record(
+            by_version={'1.0': 20}
+        )
+        self.records[datetime(2016, 8, 22)] = self._record(
+            by_version={'1.0': 30}
+        )
+        self.records[datetime(2016, 8, 22)]['cache_metadata'].update(
+            {'approximate': True, 'sample_rate': 0.1}
+        )
+        self.records[datetime(2016, 8, 23)] = self._record(
+            by_version={'1.0': 10}
+        )
+        self.records[datetime(2016, 8, 23)]['cache_metadata'].update(
+            {'approximate': False}
+        )
+        assert self._stats().approximate_dates == [datetime(2016, 8, 22)]
+
+    def test_approximate_dates_none(self):
+        self.records[datetime(2016, 8, 21)] = self._record(
+            by_version={'1.0': 20}
+        )
+        assert self._stats().approximate_dates == []
+
+
+class TestOther(ProjectStatsTester):
+
+    def test_compound_column_value(self):
+        assert ProjectStats._compound_column_value('other', 'other') == \
+            'other'
+        assert ProjectStats._compound_column_value('other', '1.0') == \
+            'other 1.0'
+        assert ProjectStats._compound_column_value(None, 'null') == 'unknown'
+        assert ProjectStats._compound_column_value(
+            'other (value)', 'other (value)'
+        ) == 'other (value) other (value)'
+
+    def test_per_country_data(self):
+        self.records[datetime(2016, 8, 21)] = self._record(
+            by_country={'US': 3, 'DE': 2, None: 1, 'other': 4}
+        )
+        self.records[datetime(2016, 8, 22)] = self._record(by_country={})
+        assert self._stats().per_country_data == {
+            datetime(2016, 8, 21): {
+                'United States of America (US)': 3,
+                'Germany (DE)': 2,
+                'unknown (None)': 1,
+                'other': 4
+            },
+            datetime(2016, 8, 22): {'unknown': 0}
+        }
+
+    def test_per_installer_data(self):
+        self.records[datetime(2016, 8, 21)] = self._record(
+            by_installer={
+                'pip': {'8.1.2': 3},
+                'other (value)': {'1.0': 2},
+                'other': {'other': 4}
+            }
+        )
+        assert self._stats().per_installer_data == {
+            datetime(2016, 8, 21): {
+                'pip 8.1': 3,
+                'other (value) 1.0': 2,
+                'other': 4
+            }
+        }
+
+    def test_per_version_data(self):
+        self.records[datetime(2016, 8, 21)] = self._record(
+            by_version={'1.0': 3, 'other (value)': 2, 'other': 4}
+        )
+        self.records[datetime(2016, 8, 22)] = self._record(by_version={})
+        assert self._stats().per_version_data == {
+            datetime(2016, 8, 21): {'1.0': 3, 'other (value)': 2, 'other': 4},
+            datetime(2016, 8, 22): {'other': 0}
+        }
+
+
+class TestDimensions(ProjectStatsTester):
+
+    def setup_method(self):
+        super(TestDimensions, self).setup_method()
+        # only by_system was queried for this date
+        self.records[datetime(2016, 8, 21)] = self._record(
+            by_system={'Linux': 5}
+        )
+        for day in range(22, 25):
+            self.records[datetime(2016, 8, day)] = self._record(
+                by_version={'1.0': day, '1.1': 1},
+                by_installer={'pip': {'8.1.2': 2, '9.0.1': 3}, None: {None: 1}}
+            )
+
+    def test_dimensions(self):
+        # DataQuery._DIMENSION_COLUMNS order; by_version totals downloads
+        assert ProjectStats.DIMENSIONS == [
+            'by_version', 'by_file_type', 'by_installer', 'by_implementation',
+            'by_system', 'by_distro', 'by_country'
+        ]
+
+    def test_all(self):
+        stats = self._stats()
+        assert stats.dimensions == ProjectStats.DIMENSIONS
+        assert stats.cache_dates[0] == datetime(2016, 8, 21)
+        # breakdowns missing from records are empty
+        assert stats.per_version_data[datetime(2016, 8, 21)] == {'other': 0}
+        assert stats.per_system_data[datetime(2016, 8, 22)] == {'unknown': 0}
+
+    def test_filtered(self):
+        stats = self._stats(dimensions=['by_installer', 'by_version', 'foo'])
+        assert stats.dimensions == ['by_version', 'by_installer']
+        # dates with data only for other breakdowns are skipped
+        assert stats.cache_dates == [
+            datetime(2016, 8, 22), datetime(2016, 8, 23), datetime(2016, 8, 24)
+        ]
+
+    def test_downloads_for_num_days(self):
+        stats = self._stats()
+        assert stats._downloads_for_num_days(2) == (49, 2)
+        assert stats._downloads_for_num_days(7) == (72, 4)
+        assert stats.downloads_per_day == 18
+
+    def test_downloads_for_num_days_first_dimension(self):
+        stats = self._stats(dimensions=['by_system', 'by_installer'])
+        assert stats.dimensions == ['by_installer', 'by_system']
+        assert stats._downloads_for_num_days(2) == (12, 2)
+        stats = self._stats(dimensions=['by_system'])
+        assert stats._downloads_for_num_days(7) == (5, 4)
+
+
+class TestCacheLoad(ProjectStatsTester):
+
+    def test_init(self):
+        for day in range(21, 24):
+            self.records[datetime(2016, 8, day)] = self._record(
+                data_ts=1471910399 + day, by_version={'1.0': day}
+            )
+        stats = self._stats()
+        assert self.mock_cache.mock_calls == [
+            call.get_dates_for_project('foo'),
+            call.get_range(
+                'foo', datetime(2016, 8, 21), datetime(2016, 8, 23)
+            )
+        ]
+        assert stats.as_of_timestamp == 1471910422
+        assert stats.per_version_data == {
+            datetime(2016, 8, day): {'1.0': day} for day in range(21, 24)
+        }
+        assert self.mock_cache.get.mock_calls == []
+
+    def test_cache_load(self):
+        self.records[datetime(2016, 8, 21)] = self._record(
+            by_version={'1.0': 1}
+        )
+        stats = self._stats()
+        self.records[datetime(2016, 8, 23)] = self._record(
+            by_version={'1.0': 3}
+        )
+        self.mock_cache.reset_mock()
+        stats._cache_load([datetime(2016, 8, 22), datetime(2016, 8, 23)])
+        assert self.mock_cache.mock_calls == [
+            call.get_range(
+                'foo', datetime(2016, 8, 22), datetime(2016, 8, 23)
+            )
+        ]
+        # dates not in the cache are stored as None
+        assert stats.cache_data[datetime(2016, 8, 22)] is None
+        assert stats._cache_get(datetime(2016, 8, 23)) == {
+            'cache_metadata': {'data_ts': 1471910399},
+            'by_version': {'1.0': 3},
+            'by_file_type': {},
+            'by_installer': {},
+            'by_implementation': {},
+            'by_system': {},
+            'by_distro': {},
+            'by_country': {}
+        }
+        assert self.mock_cache.get.mock_calls == []
+
+    def test_cache_load_empty(self):
+        self.records[datetime(2016, 8, 21)] = self._record(
+            by_version={'1.0': 1}
+        )
+        stats = self._stats()
+        self.mock_cache.reset_mock()
+        stats._cache_load([])
+        assert self.mock_cache.mock_calls == []
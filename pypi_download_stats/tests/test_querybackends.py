@@ -0,0 +1,972 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import sys
+import os
+import re
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from freezegun import freeze_time
+from googleapiclient.errors import HttpError
+
+from pypi_download_stats.dataquery import DataQuery
+from pypi_download_stats.diskdatacache import DiskDataCache
+from pypi_download_stats.querybackends import (BigQueryBackend, CachingBackend,
+                                               SQLiteBackend,
+                                               StandardSQLBackend)
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch, call, Mock, DEFAULT  # noqa
+else:
+    from unittest.mock import patch, call, Mock, DEFAULT  # noqa
+
+pbm = 'pypi_download_stats.querybackends'
+pb = '%s.BigQueryBackend' % pbm
+
+
+class BigQueryBackendTester(object):
+
+    def setup_method(self):
+        with patch('%s._get_bigquery_service' % pb):
+            self.cls = BigQueryBackend('myproj')
+
+
+def _http_error(status, reason):
+    content = {'error': {'errors': [{'reason': reason}], 'message': reason}}
+    return HttpError(Mock(status=status, reason=reason),
+                     json.dumps(content).encode('utf-8'))
+
+
+class TestExecute(BigQueryBackendTester):
+
+    def test_is_retryable(self):
+        assert self.cls._is_retryable(_http_error(503, 'backendError'))
+        assert self.cls._is_retryable(_http_error(403, 'rateLimitExceeded'))
+        assert self.cls._is_retryable(_http_error(403, 'quotaExceeded'))
+        assert not self.cls._is_retryable(_http_error(403, 'accessDenied'))
+        assert not self.cls._is_retryable(_http_error(404, 'notFound'))
+
+    def test_retry(self):
+        req = Mock()
+        req.execute.side_effect = [
+            _http_error(403, 'rateLimitExceeded'),
+            _http_error(503, 'backendError'),
+            {'foo': 'bar'}
+        ]
+        with patch('%s.time.sleep' % pbm) as mock_sleep:
+            res = self.cls._execute(req)
+        assert res == {'foo': 'bar'}
+        assert len(mock_sleep.mock_calls) == 2
+        assert req.execute.mock_calls == [call(), call(), call()]
+
+    def test_no_retry(self):
+        req = Mock()
+        req.execute.side_effect = _http_error(403, 'accessDenied')
+        with patch('%s.time.sleep' % pbm) as mock_sleep:
+            with pytest.raises(HttpError):
+                self.cls._execute(req)
+        assert mock_sleep.mock_calls == []
+        assert req.execute.mock_calls == [call()]
+
+    def test_per_thread_http(self):
+        self.cls.query_concurrency = 2
+        self.cls._credentials = Mock()
+        req = Mock()
+        req.execute.return_value = {}
+        with patch('%s.httplib2.Http' % pbm) as mock_http:
+            self.cls._execute(req)
+            self.cls._execute(req)
+        assert mock_http.mock_calls == [call()]
+        http = self.cls._credentials.authorize.return_value
+        assert req.execute.mock_calls == [call(http=http), call(http=http)]
+
+
+class TestBigQueryService(object):
+
+    doc = json.dumps({'name': 'bigquery', 'version': 'v2'})
+
+    def test_reuse(self):
+        with patch.dict('%s._services' % pb, clear=True):
+            with patch.multiple(
+                pbm,
+                GoogleCredentials=DEFAULT,
+                build=DEFAULT,
+                build_from_document=DEFAULT
+            ) as mocks:
+                first = BigQueryBackend('myproj')
+                second = BigQueryBackend('myproj')
+        creds = mocks['GoogleCredentials'].get_application_default
+        assert creds.mock_calls == [call()]
+        assert mocks['build'].mock_calls == [
+            call('bigquery', 'v2', credentials=creds.return_value)
+        ]
+        assert mocks['build_from_document'].mock_calls == []
+        assert first.service == mocks['build'].return_value
+        assert second.service == mocks['build'].return_value
+        assert second._credentials == creds.return_value
+
+    def test_discovery_cached(self, tmpdir):
+        path = str(tmpdir.join('discovery'))
+        with patch.dict('%s._services' % pb, clear=True):
+            with patch.multiple(
+                pbm,
+                GoogleCredentials=DEFAULT,
+                build=DEFAULT,
+                build_from_document=DEFAULT
+            ) as mocks:
+                with patch('%s._fetch_discovery_document' % pb,
+                           autospec=True) as mock_fetch:
+                    mock_fetch.return_value = self.doc
+                    BigQueryBackend('myproj', discovery_cache_path=path)
+                    BigQueryBackend._services.clear()
+                    BigQueryBackend('myproj', discovery_cache_path=path)
+        assert len(mock_fetch.mock_calls) == 1
+        assert mocks['build'].mock_calls == []
+        creds = mocks['GoogleCredentials'].get_application_default
+        assert mocks['build_from_document'].mock_calls == [
+            call(self.doc, credentials=creds.return_value),
+            call(self.doc, credentials=creds.return_value)
+        ]
+        with open(os.path.join(path, 'bigquery_v2.json'), 'r') as fh:
+            cached = json.loads(fh.read())
+        assert cached['document'] == self.doc
+
+    def test_is_discovery_current(self):
+        with patch('%s._get_bigquery_service' % pb):
+            cls = BigQueryBackend('myproj')
+        with patch('%s.googleapiclient_version' % pbm, '1.5.3'):
+            with freeze_time('2016-08-22 12:00:00'):
+                now = 1471867200
+                cached = {
+                    'client_version': '1.5.3', 'fetched': now - 3600,
+                    'document': self.doc
+                }
+                assert cls._is_discovery_current(cached)
+                cached['fetched'] = now - (8 * 86400)
+                assert not cls._is_discovery_current(cached)
+                cached['fetched'] = now - 3600
+                cached['client_version'] = '1.5.2'
+                assert not cls._is_discovery_current(cached)
+                cached['client_version'] = '1.5.3'
+                cached['document'] = json.dumps(
+                    {'name': 'bigquery', 'version': 'v1'}
+                )
+                assert not cls._is_discovery_current(cached)
+                cached['document'] = 'foo'
+                assert not cls._is_discovery_current(cached)
+
+    def test_fetch_error_uses_expired(self, tmpdir):
+        with patch('%s._get_bigquery_service' % pb):
+            cls = BigQueryBackend(
+                'myproj', discovery_cache_path=str(tmpdir)
+            )
+        with patch('%s._fetch_discovery_document' % pb,
+                   autospec=True) as mock_fetch:
+            mock_fetch.side_effect = RuntimeError('foo')
+            with pytest.raises(RuntimeError):
+                cls._get_discovery_document()
+            with patch('%s.googleapiclient_version' % pbm, '1.5.3'):
+                tmpdir.join('bigquery_v2.json').write(json.dumps({
+                    'client_version': '1.5.3', 'fetched': 0,
+                    'document': self.doc
+                }))
+                assert cls._get_discovery_document() == self.doc
+            with pytest.raises(RuntimeError):
+                cls._get_discovery_document()
+
+    def test_fetch(self):
+        with patch('%s._get_bigquery_service' % pb):
+            cls = BigQueryBackend('myproj')
+        with patch('%s.httplib2.Http' % pbm) as mock_http:
+            mock_http.return_value.request.return_value = (
+                Mock(status=200), self.doc.encode('utf-8')
+            )
+            assert cls._fetch_discovery_document() == self.doc
+            mock_http.return_value.request.return_value = (
+                Mock(status=503), b''
+            )
+            with pytest.raises(Exception) as excinfo:
+                cls._fetch_discovery_document()
+        assert 'got status 503 fetching discovery document' in str(
+            excinfo.value)
+        assert mock_http.return_value.request.mock_calls[0] == call(
+            'https://www.googleapis.com/discovery/v1/apis/bigquery/v2/rest'
+        )
+
+
+class TestRunQuery(BigQueryBackendTester):
+
+    def test_paged(self):
+        schema = {'fields': [{'name': 'a'}, {'name': 'b'}]}
+        mock_jobs = self.cls.service.jobs.return_value
+        mock_jobs.getQueryResults.return_value.execute.side_effect = [
+            {'jobComplete': False},
+            {'jobComplete': True, 'schema': schema, 'totalRows': '3',
+             'pageToken': 'tok1',
+             'rows': [{'f': [{'v': '1'}, {'v': 'x'}]},
+                      {'f': [{'v': '2'}, {'v': None}]}]},
+            {'jobComplete': True, 'schema': schema, 'totalRows': '3',
+             'rows': [{'f': [{'v': '3'}, {'v': 'z'}]}]}
+        ]
+        with patch('%s.uuid.uuid4' % pbm) as mock_uuid:
+            mock_uuid.return_value.hex = 'abcd'
+            res = self.cls.run_query('SELECT foo;')
+            assert mock_jobs.mock_calls == []
+            res = list(res)
+        assert res == [
+            {'a': '1', 'b': 'x'}, {'a': '2', 'b': None}, {'a': '3', 'b': 'z'}
+        ]
+        job_id = 'pypi_download_stats_abcd'
+        assert mock_jobs.insert.mock_calls == [
+            call(projectId='myproj', body={
+                'jobReference': {'projectId': 'myproj', 'jobId': job_id},
+                'configuration': {
+                    'query': {'query': 'SELECT foo;', 'useLegacySql': True}
+                }
+            }),
+            call().execute()
+        ]
+        kwargs = {
+            'projectId': 'myproj', 'jobId': job_id, 'maxResults': 10000,
+            'timeoutMs': 10000
+        }
+        assert mock_jobs.getQueryResults.mock_calls == [
+            call(**kwargs), call().execute(),
+            call(**kwargs), call().execute(),
+            call(pageToken='tok1', **kwargs), call().execute()
+        ]
+
+    def test_empty(self):
+        mock_jobs = self.cls.service.jobs.return_value
+        mock_jobs.getQueryResults.return_value.execute.return_value = {
+            'jobComplete': True, 'schema': {'fields': [{'name': 'a'}]},
+            'totalRows': '0'
+        }
+        assert list(self.cls.run_query('SELECT foo;')) == []
+
+    def test_table_not_found(self):
+        assert self.cls.is_table_not_found(
+            _http_error(404, 'Not found: Table the-psf:pypi.downloads20160822')
+        )
+        assert not self.cls.is_table_not_found(_http_error(404, 'notFound'))
+        assert not self.cls.is_table_not_found(RuntimeError('foo'))
+
+
+class TestBigQueryTables(BigQueryBackendTester):
+
+    def test_dry_run_query(self):
+        mock_jobs = self.cls.service.jobs.return_value
+        mock_jobs.query.return_value.execute.return_value = {
+            'totalBytesProcessed': '12345'
+        }
+        assert self.cls.dry_run_query('SELECT foo;') == 12345
+        assert mock_jobs.query.mock_calls == [
+            call(projectId='myproj', body={
+                'query': 'SELECT foo;', 'dryRun': True, 'useLegacySql': True
+            }),
+            call().execute()
+        ]
+
+    def test_get_table_not_found(self):
+        mock_tables = self.cls.service.tables.return_value
+        mock_tables.get.return_value.execute.side_effect = _http_error(
+            404, 'notFound')
+        assert self.cls.get_table(
+            'the-psf', 'pypi', 'downloads20160822') is None
+        assert mock_tables.get.mock_calls == [
+            call(projectId='the-psf', datasetId='pypi',
+                 tableId='downloads20160822'),
+            call().execute()
+        ]
+
+    def test_list_tables(self):
+        mock_tables = self.cls.service.tables.return_value
+        mock_tables.list.return_value.execute.return_value = {'tables': [
+            {'type': 'TABLE', 'tableReference': {'tableId': 'downloads1'}},
+            {'type': 'VIEW', 'tableReference': {'tableId': 'downloads2'}}
+        ]}
+        mock_tables.list_next.return_value = None
+        assert self.cls.list_tables('the-psf', 'pypi') == ['downloads1']
+
+
+class TestSQLiteBackend(object):
+
+    def setup_method(self):
+        self.cls = SQLiteBackend(':memory:')
+        self.cls.generate_synthetic_data(
+            ['foo', 'bar', 'baz'], datetime(2016, 8, 20), 3, 200, seed=1
+        )
+
+    def test_tables(self):
+        assert self.cls.list_tables('the-psf', 'pypi') == [
+            'downloads20160820', 'downloads20160821', 'downloads20160822'
+        ]
+        table = self.cls.get_table('the-psf', 'pypi', 'downloads20160821')
+        assert table['numRows'] == '600'
+        assert int(table['lastModifiedTime']) <= 1471823999000
+        assert self.cls.get_table('the-psf', 'pypi', 'downloads20160823') \
+            is None
+
+    def test_translate(self):
+        res = self.cls._translate(
+            "SELECT file.project, COUNT(*) AS dl_count FROM "
+            "(SELECT file.project FROM TABLE_DATE_RANGE("
+            "[the-psf:pypi.downloads], TIMESTAMP('2016-08-21'), "
+            "TIMESTAMP('2016-08-23'))), "
+            "(SELECT file.project FROM [the-psf:pypi.downloads20160820]) "
+            "WHERE details.installer.name = 'pip' GROUP BY file.project;"
+        )
+        assert res == (
+            'SELECT "file.project", COUNT(*) AS dl_count FROM '
+            '(SELECT * FROM (SELECT "file.project" FROM '
+            '(SELECT * FROM "downloads20160821" UNION ALL '
+            'SELECT * FROM "downloads20160822")) UNION ALL '
+            'SELECT * FROM (SELECT "file.project" FROM "downloads20160820")) '
+            'WHERE "details.installer.name" = \'pip\' '
+            'GROUP BY "file.project";'
+        )
+
+    def test_run_query(self):
+        res = list(self.cls.run_query(
+            "SELECT file.project, TIMESTAMP_TO_SEC(MAX(timestamp)) AS max_ts "
+            "FROM [the-psf:pypi.downloads20160822] "
+            "WHERE timestamp > SEC_TO_TIMESTAMP(1471824000) "
+            "GROUP BY file.project ORDER BY file.project;"
+        ))
+        assert [r['file_project'] for r in res] == ['bar', 'baz', 'foo']
+        assert res[0]['max_ts'] <= 1471910399
+
+    def test_table_not_found(self):
+        with pytest.raises(Exception) as excinfo:
+            list(self.cls.run_query(
+                'SELECT COUNT(*) FROM [the-psf:pypi.downloads20160823];'
+            ))
+        assert self.cls.is_table_not_found(excinfo.value)
+        assert self.cls.dry_run_query(
+            'SELECT COUNT(*) FROM [the-psf:pypi.downloads20160823];'
+        ) is None
+        assert self.cls.dry_run_query(
+            'SELECT COUNT(*) FROM [the-psf:pypi.downloads20160822];'
+        ) == 0
+
+    def test_query_modes(self):
+        def query(**kwargs):
+            cache = Mock()
+            dq = DataQuery(None, ['foo', 'bar'], cache, backend=self.cls,
+                           **kwargs)
+            dq.query_one_table('downloads20160821')
+            res = {}
+            for r in cache.set_many.mock_calls[0][1][0]:
+                data = dict(r[2])
+                data.pop('cube', None)
+                res[r[0]] = (r[3], data)
+            return res
+
+        per_dimension = query()
+        assert sorted(per_dimension.keys()) == ['bar', 'foo']
+        assert sum(per_dimension['foo'][1]['by_version'].values()) == 200
+        assert per_dimension['foo'][0] <= 1471823999
+        assert query(single_scan=True) == per_dimension
+        assert query(cube=True) == per_dimension
+
+    def test_top_k(self):
+        res = {}
+        for kwargs in [{}, {'single_scan': True}, {'cube': True}]:
+            cache = Mock()
+            dq = DataQuery(None, ['foo', 'bar'], cache, backend=self.cls,
+                           top_k=3, **kwargs)
+            dq.query_one_table('downloads20160821')
+            for r in cache.set_many.mock_calls[0][1][0]:
+                data = dict(r[2])
+                data.pop('cube', None)
+                res.setdefault(r[0], []).append(data)
+        for proj in ['foo', 'bar']:
+            assert res[proj][0] == res[proj][1] == res[proj][2]
+            data = res[proj][0]
+            assert len(data['by_version']) == 4
+            assert 'other' in data['by_version']
+            assert sum(data['by_version'].values()) == 200
+            assert data['by_installer']['other'] == {
+                'other': sum(data['by_file_type'].values()) - sum([
+                    sum(v.values()) for k, v in data['by_installer'].items()
+                    if k != 'other'
+                ])
+            }
+
+    def test_top_k_other_value(self):
+        # a real version named "other" is kept apart from the bucket of
+        # counts beyond the top versions
+        self.cls.add_downloads('downloads20160821', [
+            ('2016-08-21 12:00:00', 'US', 'foo', 'other', 'sdist', 'pip',
+             '9.0.1', 'CPython', '2.7.12', 'Linux', 'Ubuntu', '16.04')
+        ] * 500)
+        res = {}
+        for kwargs in [{}, {'single_scan': True}, {'cube': True}]:
+            cache = Mock()
+            dq = DataQuery(None, ['foo'], cache, backend=self.cls,
+                           top_k=3, **kwargs)
+            dq.query_one_table('downloads20160821')
+            data = cache.set_many.mock_calls[0][1][0][0][2]
+            data.pop('cube', None)
+            res[len(res)] = data
+        # including ties between NULL and other values
+        assert res[0] == res[1] == res[2]
+        assert res[0]['by_version']['other (value)'] == 500
+        assert sum(res[0]['by_version'].values()) == 700
+        assert len(res[0]['by_version']) == 4
+
+    def test_top_k_incremental(self, tmpdir):
+        conn = self.cls._get_conn()
+        # downloads of existing values, after the newest cached timestamp
+        late = [
+            ('2016-08-22 23:59:59.900000', ) + tuple(row[1:])
+            for row in conn.execute(
+                'SELECT * FROM "downloads20160822" WHERE "file.project" = '
+                '\'foo\' ORDER BY "timestamp" LIMIT 60'
+            )
+        ]
+        modes = [{}, {'single_scan': True}, {'cube': True}]
+        for idx, kwargs in enumerate(modes):
+            self.setup_method()
+            cache = DiskDataCache(str(tmpdir.join('incr%d' % idx)))
+            dq = DataQuery(None, ['foo'], cache, backend=self.cls,
+                           incremental=True, top_k=3, **kwargs)
+            dq.query_one_table('downloads20160822')
+            self.cls.add_downloads('downloads20160822', late)
+            dq.query_one_table('downloads20160822')
+            full_cache = DiskDataCache(str(tmpdir.join('full%d' % idx)))
+            full = DataQuery(None, ['foo'], full_cache, backend=self.cls,
+                             top_k=3, **kwargs)
+            full.query_one_table('downloads20160822')
+            recs = []
+            for c in [cache, full_cache]:
+                rec = c.get('foo', datetime(2016, 8, 22))
+                rec.pop('cache_metadata')
+                rec.pop('cube', None)
+                recs.append(rec)
+            assert sum(recs[0]['by_version'].values()) == 260
+            assert recs[0] == recs[1]
+
+    def test_sampled(self):
+        cache = Mock()
+        dq = DataQuery(None, ['foo', 'bar'], cache, backend=self.cls,
+                       single_scan=True, sample_rate=0.5)
+        dq.query_one_table('downloads20160821')
+        records = cache.set_many.mock_calls[0][1][0]
+        for r in records:
+            assert r[4] == {'approximate': True, 'sample_rate': 0.5,
+                            'data_ts_usec': r[3] * 1000000}
+            data = r[2]
+            total = sum(data['by_version'].values())
+            assert 100 <= total <= 300
+            assert sum(data['by_file_type'].values()) == total
+        assert len(records) == 2
+
+    def test_incremental_sub_second(self, tmpdir):
+        def rows(*stamps):
+            return [
+                ('2016-08-23 10:00:%s' % ts, 'US', 'foo', '1.0', 'sdist',
+                 'pip', '9.0.1', 'CPython', '3.5.2', 'Linux', 'Ubuntu',
+                 '16.04')
+                for ts in stamps
+            ]
+
+        modes = [{}, {'single_scan': True}, {'cube': True}]
+        for idx, kwargs in enumerate(modes):
+            self.setup_method()
+            self.cls.add_downloads(
+                'downloads20160823', rows('00.250000', '00.750000')
+            )
+            cache = DiskDataCache(str(tmpdir.join('cache%d' % idx)))
+            dq = DataQuery(None, ['foo'], cache, backend=self.cls,
+                           incremental=True, **kwargs)
+            dq.query_one_table('downloads20160823')
+            rec = cache.get('foo', datetime(2016, 8, 23))
+            assert rec['by_version'] == {'1.0': 2}
+            assert rec['cache_metadata']['data_ts'] == 1471946400
+            assert rec['cache_metadata']['data_ts_usec'] == 1471946400750000
+            # same second as the watermark, but newer
+            self.cls.add_downloads(
+                'downloads20160823', rows('00.900000', '01')
+            )
+            dq.query_one_table('downloads20160823')
+            rec = cache.get('foo', datetime(2016, 8, 23))
+            assert rec['by_version'] == {'1.0': 4}
+            assert rec['cache_metadata']['data_ts_usec'] == 1471946401000000
+
+    def test_per_dimension_bounded(self, tmpdir):
+        """rows landing while the breakdown queries run wait for the next
+        incremental query instead of being counted twice"""
+        cache = DiskDataCache(str(tmpdir))
+        dq = DataQuery(None, ['foo'], cache, backend=self.cls,
+                       incremental=True)
+        row = ('2016-08-22 23:59:59.500000', 'US', 'foo', '1.0', 'sdist',
+               'pip', '9.0.1', 'CPython', '3.5.2', 'Linux', 'Ubuntu', '16.04')
+        newest_ts = dq._get_newest_ts_in_table
+
+        def se_newest(table_name):
+            res = newest_ts(table_name)
+            self.cls.add_downloads(table_name, [row])
+            return res
+
+        with patch.object(dq, '_get_newest_ts_in_table') as mock_newest:
+            mock_newest.side_effect = se_newest
+            dq.query_one_table('downloads20160822')
+        rec = cache.get('foo', datetime(2016, 8, 22))
+        assert sum(rec['by_version'].values()) == 200
+        assert sum(rec['by_country'].values()) == 200
+        dq.query_one_table('downloads20160822')
+        rec = cache.get('foo', datetime(2016, 8, 22))
+        assert sum(rec['by_version'].values()) == 201
+        assert sum(rec['by_country'].values()) == 201
+        assert rec['cache_metadata']['data_ts_usec'] == 1471910399500000
+
+    def test_date_range(self):
+        cache = Mock()
+        dq = DataQuery(None, ['foo', 'bar'], cache, backend=self.cls,
+                       cube=True)
+        res = dq._query_date_range(datetime(2016, 8, 20),
+                                   datetime(2016, 8, 22))
+        assert sorted(res.keys()) == [
+            datetime(2016, 8, 20), datetime(2016, 8, 21), datetime(2016, 8, 22)
+        ]
+        for _, data in res.values():
+            assert sum(data['bar']['by_country'].values()) == 200
+
+
+class FakeRequest(object):
+
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self, http=None):
+        return self.response
+
+
+class FakeBigQueryService(object):
+    """
+    Local stand-in for the BigQuery API service, for StandardSQLBackend.
+    Every query submitted is checked to be standard SQL that only reads the
+    partitions (and, when it selects projects, the clustered blocks) it needs,
+    and is answered with the canned response for the first of ``responses``
+    - a list of 3-tuples of (regex, list of field names, list of row lists) -
+    whose regex it matches, paged ``maxResults`` rows at a time.
+    """
+
+    legacy_re = re.compile(
+        r'\[[\w-]+:|FLATTEN\(|TABLE_DATE_RANGE\(|TIMESTAMP_TO_U?SEC\(|'
+        r'U?SEC_TO_TIMESTAMP\(|(?<!\w)STRING\(|(?<!\w)HASH\(| % '
+    )
+    table_re = re.compile(
+        r'FROM `bigquery-public-data\.pypi\.file_downloads` '
+        r"WHERE timestamp >= TIMESTAMP\('[0-9-]+'\) AND "
+        r"timestamp < TIMESTAMP\('[0-9-]+'\)(?P<projects> AND project IN)?"
+    )
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.jobs_run = {}
+        self.queries = []
+
+    def jobs(self):
+        return self
+
+    def check_query(self, query):
+        assert self.legacy_re.search(query) is None, query
+        assert query.count('(') == query.count(')'), query
+        if 'INFORMATION_SCHEMA' not in query:
+            num_refs = query.count('file_downloads`')
+            matches = self.table_re.findall(query)
+            assert num_refs > 0 and len(matches) == num_refs, query
+            if 'file.project IN' in query:
+                assert all(matches), query
+        self.queries.append(query)
+
+    def insert(self, projectId, body):
+        conf = body['configuration']['query']
+        assert conf['useLegacySql'] is False
+        self.check_query(conf['query'])
+        for regex, fields, rows in self.responses:
+            if re.search(regex, conf['query']):
+                self.jobs_run[body['jobReference']['jobId']] = (fields, rows)
+                return FakeRequest({})
+        raise AssertionError('Unexpected query: %s' % conf['query'])
+
+    def getQueryResults(self, projectId, jobId, maxResults, timeoutMs,
+                        pageToken=None):
+        fields, rows = self.jobs_run[jobId]
+        start = int(pageToken or 0)
+        resp = {
+            'jobComplete': True,
+            'schema': {'fields': [{'name': f} for f in fields]},
+            'totalRows': str(len(rows)),
+            'rows': [
+                {'f': [{'v': v} for v in row]}
+                for row in rows[start:start + maxResults]
+            ]
+        }
+        if start + maxResults < len(rows):
+            resp['pageToken'] = str(start + maxResults)
+        return FakeRequest(resp)
+
+    def query(self, projectId, body):
+        assert body['dryRun'] is True and body['useLegacySql'] is False
+        self.check_query(body['query'])
+        return FakeRequest({'totalBytesProcessed': '1048576'})
+
+
+class TestStandardSQLBackend(object):
+
+    partitions = (
+        'INFORMATION_SCHEMA.PARTITIONS',
+        ['partition_id', 'total_rows', 'last_modified'],
+        [['20160821', '400', '1471824000123'],
+         ['20160822', '500', '1471910400123']]
+    )
+
+    def backend(self, responses):
+        self.service = FakeBigQueryService(responses)
+        with patch('%s._get_bigquery_service' % pb) as mock_service:
+            mock_service.return_value = self.service
+            cls = StandardSQLBackend('myproj')
+        cls._PAGE_SIZE = 2
+        return cls
+
+    def test_translate(self):
+        cls = self.backend([])
+        assert cls._translate(
+            "SELECT file.project, file.version, COUNT(*) as dl_count "
+            "FROM [the-psf:pypi.downloads20160822] "
+            "WHERE file.project IN ('foo', 'bar') AND "
+            "timestamp > SEC_TO_TIMESTAMP(1471900000) "
+            "GROUP BY file.project, file.version;"
+        ) == (
+            "SELECT file.project AS file_project, file.version AS "
+            "file_version, COUNT(*) as dl_count FROM (SELECT * FROM "
+            "`bigquery-public-data.pypi.file_downloads` WHERE "
+            "timestamp >= TIMESTAMP('2016-08-22') AND "
+            "timestamp < TIMESTAMP('2016-08-23') AND "
+            "project IN ('foo', 'bar')) "
+            "WHERE file.project IN ('foo', 'bar') AND "
+            "timestamp > TIMESTAMP_SECONDS(1471900000) "
+            "GROUP BY file.project, file.version;"
+        )
+        assert cls._translate(
+            "SELECT TIMESTAMP_TO_USEC(MAX(timestamp)) AS max_ts "
+            "FROM [the-psf:pypi.downloads20160822] "
+            "WHERE file.project IN ('foo') AND "
+            "timestamp > USEC_TO_TIMESTAMP(1471900000123456) AND "
+            "timestamp <= USEC_TO_TIMESTAMP(1471900001000000);"
+        ) == (
+            "SELECT UNIX_MICROS(MAX(timestamp)) AS max_ts FROM "
+            "(SELECT * FROM `bigquery-public-data.pypi.file_downloads` WHERE "
+            "timestamp >= TIMESTAMP('2016-08-22') AND "
+            "timestamp < TIMESTAMP('2016-08-23') AND project IN ('foo')) "
+            "WHERE file.project IN ('foo') AND "
+            "timestamp > TIMESTAMP_MICROS(1471900000123456) AND "
+            "timestamp <= TIMESTAMP_MICROS(1471900001000000);"
+        )
+        assert cls._translate(
+            "SELECT a FROM (SELECT STRING(NULL) AS a, "
+            "STRING(TIMESTAMP_TO_SEC(MAX(timestamp))) AS b "
+            "FROM TABLE_DATE_RANGE([the-psf:pypi.downloads], "
+            "TIMESTAMP('2016-08-30'), TIMESTAMP('2016-09-01'))), "
+            "(SELECT a FROM [the-psf:pypi.downloads20160901] WHERE "
+            "ABS(HASH(STRING(timestamp))) % 100 < 5);"
+        ) == (
+            "SELECT a FROM ((SELECT CAST(NULL AS STRING) AS a, "
+            "CAST(UNIX_SECONDS(MAX(timestamp)) AS STRING) AS b "
+            "FROM (SELECT * FROM `bigquery-public-data.pypi.file_downloads` "
+            "WHERE timestamp >= TIMESTAMP('2016-08-30') AND "
+            "timestamp < TIMESTAMP('2016-09-02'))) UNION ALL "
+            "(SELECT a FROM (SELECT * FROM "
+            "`bigquery-public-data.pypi.file_downloads` WHERE "
+            "timestamp >= TIMESTAMP('2016-09-01') AND "
+            "timestamp < TIMESTAMP('2016-09-02')) WHERE "
+            "MOD(ABS(FARM_FINGERPRINT(CAST(timestamp AS STRING))), 100) "
+            "< 5));"
+        )
+
+    def test_translate_sampled(self):
+        cls = self.backend([])
+        dq = DataQuery(None, ['foo'], Mock(), backend=cls, single_scan=True,
+                       sample_rate=0.005)
+        q = cls._translate(dq._single_scan_query(
+            dq._from_for_table('downloads20160822'), since_ts=1471900000
+        ))
+        assert q.count('TABLESAMPLE') == 1
+        assert "FROM (SELECT * FROM " \
+            "`bigquery-public-data.pypi.file_downloads` " \
+            "TABLESAMPLE SYSTEM (0.5 PERCENT) WHERE " \
+            "timestamp >= TIMESTAMP('2016-08-22') AND " \
+            "timestamp < TIMESTAMP('2016-08-23') AND project IN ('foo')) " \
+            "CROSS JOIN UNNEST(" in q
+        assert "AS dimension WHERE file.project IN ('foo') AND " \
+            "timestamp > TIMESTAMP_MICROS(1471900000)) GROUP BY" in q
+        # the newest timestamp is still taken from every row
+        assert q.endswith(
+            "FROM (SELECT * FROM `bigquery-public-data.pypi.file_downloads` "
+            "WHERE timestamp >= TIMESTAMP('2016-08-22') AND "
+            "timestamp < TIMESTAMP('2016-08-23') AND project IN ('foo'))));"
+        )
+        assert 'FARM_FINGERPRINT' not in q
+        q = cls._translate(dq._range_query(
+            datetime(2016, 8, 1), datetime(2016, 8, 3)
+        ))
+        assert "`bigquery-public-data.pypi.file_downloads` TABLESAMPLE " \
+            "SYSTEM (0.5 PERCENT) WHERE timestamp >= TIMESTAMP('2016-08-01') " \
+            "AND timestamp < TIMESTAMP('2016-08-04')" in q
+        assert 'FARM_FINGERPRINT' not in q
+
+    def test_tables(self):
+        cls = self.backend([self.partitions])
+        assert cls.list_tables('the-psf', 'pypi') == [
+            'downloads20160821', 'downloads20160822'
+        ]
+        assert "table_name = 'file_downloads'" in self.service.queries[0]
+        assert cls.get_table('the-psf', 'pypi', 'downloads20160821') == {
+            'lastModifiedTime': '1471824000123', 'numRows': '400'
+        }
+        assert "partition_id = '20160821'" in self.service.queries[1]
+        self.service.responses = [
+            ('INFORMATION_SCHEMA', ['partition_id'], [])
+        ]
+        assert cls.get_table('the-psf', 'pypi', 'downloads20160823') is None
+        assert cls.get_table('the-psf', 'pypi', 'foo') is None
+
+    def test_query_modes(self):
+        fields = ['row_type', 'file_project'] + [
+            DataQuery._column_alias(c)
+            for c in DataQuery._all_dimension_columns()
+        ] + ['dl_count']
+        nulls = [None] * 10
+        cube_rows = [
+            ['counts', 'foo', '1.0', 'sdist', 'pip', '8.1.2', 'CPython',
+             '2.7.12', 'Linux', 'Ubuntu', '16.04', 'US', '3'],
+            ['counts', 'foo', '1.1', 'sdist', 'pip', '8.1.2', 'CPython',
+             '3.5.2', 'Linux', 'Ubuntu', '16.04', 'US', '2'],
+            ['counts', 'bar', '0.1', 'bdist_wheel'] + nulls[:8] + ['1'],
+            ['data_ts', None] + nulls + ['1471910000123456']
+        ]
+        single_rows = [
+            ['by_version', 'foo', '1.0', None, '3'],
+            ['by_version', 'foo', '1.1', None, '2'],
+            ['by_version', 'bar', '0.1', None, '1'],
+            ['data_ts', None, '1471910000123456', None, '6']
+        ]
+        cls = self.backend([
+            ("'counts' AS row_type", fields, cube_rows),
+            ('CROSS JOIN UNNEST', ['dimension', 'file_project', 'key1', 'key2',
+                                   'dl_count'], single_rows)
+        ])
+        for kwargs in [{'cube': True}, {'single_scan': True}]:
+            cache = Mock()
+            dq = DataQuery(None, ['foo', 'bar'], cache, backend=cls, **kwargs)
+            dq.query_one_table('downloads20160822')
+            sets = {r[0]: r for r in cache.set_many.mock_calls[0][1][0]}
+            assert sets['foo'][2]['by_version'] == {'1.0': 3, '1.1': 2}
+            assert sets['bar'][2]['by_version'] == {'0.1': 1}
+            assert sets['foo'][3] == 1471910000
+            assert sets['foo'][4]['data_ts_usec'] == 1471910000123456
+        assert len(self.service.queries) == 2
+
+    def test_dry_run(self):
+        cls = self.backend([])
+        dq = DataQuery(None, ['foo'], Mock(), backend=cls, cube=True)
+        assert cls.dry_run_query(dq._range_query(
+            datetime(2016, 8, 1), datetime(2016, 8, 3), ['foo'])) == 1048576
+        assert "TIMESTAMP('2016-08-04') AND project IN ('foo')" in \
+            self.service.queries[0]
+
+
+class TestCachingBackend(object):
+
+    closed = 'SELECT COUNT(*) FROM [the-psf:pypi.downloads20160820];'
+    open_q = 'SELECT COUNT(*) FROM [the-psf:pypi.downloads20160821];'
+
+    def setup_method(self):
+        self.backend = Mock(identity='BigQueryBackend')
+        self.backend.run_query.side_effect = lambda q: iter([
+            {'a': '1', 'b': None}, {'a': '2', 'b': 'x'}
+        ])
+
+    @freeze_time('2016-08-22 12:00:00')
+    def test_immutable(self, tmpdir):
+        cls = CachingBackend(self.backend, str(tmpdir))
+        assert cls._is_immutable(self.closed)
+        assert not cls._is_immutable(self.open_q)
+        assert not cls._is_immutable('SELECT 1;')
+        assert cls._is_immutable(
+            "SELECT 1 FROM TABLE_DATE_RANGE([the-psf:pypi.downloads], "
+            "TIMESTAMP('2016-08-01'), TIMESTAMP('2016-08-20'))"
+        )
+        assert not cls._is_immutable(
+            "SELECT 1 FROM TABLE_DATE_RANGE([the-psf:pypi.downloads], "
+            "TIMESTAMP('2016-08-01'), TIMESTAMP('2016-08-21'))"
+        )
+
+    @freeze_time('2016-08-22 12:00:00')
+    def test_cached(self, tmpdir):
+        cls = CachingBackend(self.backend, str(tmpdir))
+        expected = [{'a': '1', 'b': None}, {'a': '2', 'b': 'x'}]
+        assert list(cls.run_query(self.closed)) == expected
+        # whitespace differences don't matter
+        assert list(cls.run_query(
+            'SELECT COUNT(*)\n  FROM [the-psf:pypi.downloads20160820]'
+        )) == expected
+        assert self.backend.run_query.mock_calls == [call(self.closed)]
+        assert len(os.listdir(str(tmpdir))) == 1
+        assert cls.dry_run_query(self.closed) == 0
+        assert self.backend.dry_run_query.mock_calls == []
+
+    @freeze_time('2016-08-22 12:00:00')
+    def test_backend_identity(self, tmpdir):
+        other = Mock(identity='StandardSQLBackend:proj.dataset.table')
+        other.run_query.side_effect = lambda q: iter([{'a': '3', 'b': None}])
+        cls = CachingBackend(self.backend, str(tmpdir))
+        other_cls = CachingBackend(other, str(tmpdir))
+        assert list(cls.run_query(self.closed)) == [
+            {'a': '1', 'b': None}, {'a': '2', 'b': 'x'}
+        ]
+        assert list(other_cls.run_query(self.closed)) == [
+            {'a': '3', 'b': None}
+        ]
+        assert len(os.listdir(str(tmpdir))) == 2
+        assert list(cls.run_query(self.closed)) == [
+            {'a': '1', 'b': None}, {'a': '2', 'b': 'x'}
+        ]
+        assert list(other_cls.run_query(self.closed)) == [
+            {'a': '3', 'b': None}
+        ]
+        assert self.backend.run_query.mock_calls == [call(self.closed)]
+        assert other.run_query.mock_calls == [call(self.closed)]
+
+    def test_identity(self):
+        assert SQLiteBackend(':memory:').identity == 'SQLiteBackend::memory:'
+        with patch('%s._get_bigquery_service' % pb):
+            assert BigQueryBackend('myproj').identity == 'BigQueryBackend'
+            assert StandardSQLBackend(
+                'myproj', table='p.d.t'
+            ).identity == 'StandardSQLBackend:p.d.t'
+
+    @freeze_time('2016-08-22 12:00:00')
+    def test_mutable(self, tmpdir):
+        cls = CachingBackend(self.backend, str(tmpdir))
+        list(cls.run_query(self.open_q))
+        list(cls.run_query(self.open_q))
+        assert len(self.backend.run_query.mock_calls) == 2
+        assert os.listdir(str(tmpdir)) == []
+        self.backend.dry_run_query.return_value = 123
+        assert cls.dry_run_query(self.open_q) == 123
+
+    def test_mutable_ttl(self, tmpdir):
+        cls = CachingBackend(self.backend, str(tmpdir),
+                             mutable_ttl=timedelta(hours=1))
+        with freeze_time('2016-08-22 12:00:00'):
+            list(cls.run_query(self.open_q))
+        with freeze_time('2016-08-22 12:30:00'):
+            list(cls.run_query(self.open_q))
+        assert len(self.backend.run_query.mock_calls) == 1
+        with freeze_time('2016-08-22 13:30:00'):
+            list(cls.run_query(self.open_q))
+        assert len(self.backend.run_query.mock_calls) == 2
+
+    @freeze_time('2016-08-22 12:00:00')
+    def test_partial_read(self, tmpdir):
+        cls = CachingBackend(self.backend, str(tmpdir))
+        res = cls.run_query(self.closed)
+        next(res)
+        res.close()
+        assert os.listdir(str(tmpdir)) == []
+
+    @freeze_time('2016-08-22 12:00:00')
+    def test_error(self, tmpdir):
+        def se_run(query):
+            yield {'a': '1'}
+            raise RuntimeError('foo')
+
+        self.backend.run_query.side_effect = se_run
+        cls = CachingBackend(self.backend, str(tmpdir))
+        with pytest.raises(RuntimeError):
+            list(cls.run_query(self.closed))
+        assert os.listdir(str(tmpdir)) == []
+
+    @freeze_time('2016-08-22 12:00:00')
+    def test_evict_once(self, tmpdir):
+        with patch('%s.CachingBackend.evict' % pbm) as mock_evict:
+            cls = CachingBackend(self.backend, str(tmpdir))
+            assert mock_evict.mock_calls == [call()]
+            for x in range(3):
+                list(cls.run_query(
+                    'SELECT %d FROM [the-psf:pypi.downloads20160820];' % x
+                ))
+            assert mock_evict.mock_calls == [call()]
+        assert len(os.listdir(str(tmpdir))) == 3
+
+    @freeze_time('2016-08-22 12:00:00')
+    def test_evict(self, tmpdir):
+        cls = CachingBackend(self.backend, str(tmpdir))
+        queries = [
+            'SELECT %d FROM [the-psf:pypi.downloads20160820];' % x
+            for x in range(4)
+        ]
+        for idx, q in enumerate(queries):
+            list(cls.run_query(q))
+            mtime = 1471867200 - 1000 + idx
+            os.utime(cls._path_for_query(q), (mtime, mtime))
+        # use the oldest, so it's the most recently used
+        os.utime(cls._path_for_query(queries[0]), (1471867190, 1471867190))
+        cls.max_bytes = 250
+        cls.evict()
+        remaining = [
+            q for q in queries if os.path.exists(cls._path_for_query(q))
+        ]
+        assert queries[0] in remaining
+        assert queries[1] not in remaining
+        assert sum([
+            os.path.getsize(cls._path_for_query(q)) for q in remaining
+        ]) <= 250
+        cls.max_age = timedelta(seconds=1)
+        cls.evict()
+        assert os.listdir(str(tmpdir)) == []
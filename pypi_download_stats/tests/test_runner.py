@@ -36,10 +36,14 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 """
 
 import sys
+import argparse
 import logging
 
+import pytest
+
 from pypi_download_stats.runner import (
-    set_log_level_format, set_log_debug, set_log_info
+    set_log_level_format, set_log_debug, set_log_info, print_query_plan,
+    _dimension_list
 )
 
 # https://code.google.com/p/mock/issues/detail?id=249
@@ -88,3 +92,39 @@ class TestRunner(object):
         assert mock_logger.mock_calls == [
             call.setLevel(5)
         ]
+
+
+class TestPrintQueryPlan(object):
+
+    def test_print(self, capsys):
+        print_query_plan([
+            {'target': 'downloads20160822', 'description': 'by_version',
+             'bytes': 2048},
+            {'target': 'downloads20160821', 'description': 'by_version',
+             'bytes': None},
+            {'target': '2016-08-01 to 2016-08-03',
+             'description': 'all breakdowns', 'bytes': 1024 ** 4}
+        ])
+        out, err = capsys.readouterr()
+        assert out == 'downloads20160822 by_version: 2.0 KiB\n' \
+                      'downloads20160821 by_version: table not found\n' \
+                      '2016-08-01 to 2016-08-03 all breakdowns: 1.0 TiB\n' \
+                      'Total: 3 queries, 1.0 TiB (1099511629824 bytes); ' \
+                      'estimated cost: $6.25\n'
+
+
+class TestDimensionList(object):
+
+    def test_valid(self):
+        assert _dimension_list('version, implementation,') == [
+            'by_version', 'by_implementation'
+        ]
+
+    def test_invalid(self):
+        with pytest.raises(argparse.ArgumentTypeError) as excinfo:
+            _dimension_list('version,foo')
+        assert 'invalid dimension(s) "version,foo"' in str(excinfo.value)
+
+    def test_empty(self):
+        with pytest.raises(argparse.ArgumentTypeError):
+            _dimension_list(',')
@@ -0,0 +1,90 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import sys
+
+import pytest
+
+from pypi_download_stats.serializers import (
+    SERIALIZERS, JSONSerializer, get_serializer
+)
+
+# https://code.google.com/p/mock/issues/detail?id=249
+# py>=3.4 should use unittest.mock not the mock package on pypi
+if (
+        sys.version_info[0] < 3 or
+        sys.version_info[0] == 3 and sys.version_info[1] < 4
+):
+    from mock import patch
+else:
+    from unittest.mock import patch
+
+pbm = 'pypi_download_stats.serializers'
+
+RECORD = {
+    'by_version': {'1.0': 3, None: 1},
+    'by_installer': {'pip': {'8.1.2': 2, None: 1}, None: {None: 4}},
+    'cube': {'columns': ['by_version'], 'rows': [['1.0', 3]]},
+    'cache_metadata': {'date': '20160822', 'updated': 1471910399.5}
+}
+
+
+class TestSerializers(object):
+
+    @pytest.mark.parametrize('name', list(SERIALIZERS.keys()))
+    def test_round_trip(self, name):
+        if name != 'json':
+            pytest.importorskip(name)
+        cls = get_serializer(name)
+        assert cls.name == name
+        expected = JSONSerializer().loads(JSONSerializer().dumps(RECORD))
+        assert expected['by_installer']['null'] == {'null': 4}
+        raw = cls.dumps(RECORD)
+        assert isinstance(raw, bytes)
+        assert cls.loads(raw) == expected
+
+    def test_unknown(self):
+        with pytest.raises(Exception) as excinfo:
+            get_serializer('pickle')
+        assert 'unknown cache serializer: pickle' in str(excinfo.value)
+
+    @pytest.mark.parametrize('name', ['orjson', 'msgpack'])
+    def test_missing_dependency(self, name):
+        with patch('%s.%s' % (pbm, name), None):
+            with pytest.raises(Exception) as excinfo:
+                get_serializer(name)
+        assert 'requires %s' % name in str(excinfo.value)
@@ -0,0 +1,148 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/pypi-download-stats>
+
+##################################################################################
+Copyright 2016 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of pypi-download-stats, also known as pypi-download-stats.
+
+    pypi-download-stats is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pypi-download-stats is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with pypi-download-stats.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/pypi-download-stats> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import os
+import threading
+from datetime import datetime
+
+from pypi_download_stats.diskdatacache import DiskDataCache
+from pypi_download_stats.sqlitedatacache import SQLiteDataCache
+
+
+class TestSQLiteDataCache(object):
+
+    def test_get_set(self, tmpdir):
+        cls = SQLiteDataCache(str(tmpdir.join('sub', 'cache.db')))
+        dt = datetime(2016, 8, 22)
+        assert cls.get('foo', dt) is None
+        cls.set('foo', dt, {'by_version': {'1.0': 3}}, 1471910399,
+                metadata={'table_rows': 5})
+        res = cls.get('foo', dt)
+        assert res['by_version'] == {'1.0': 3}
+        assert res['cache_metadata']['date'] == dt
+        assert res['cache_metadata']['data_ts'] == 1471910399
+        assert res['cache_metadata']['table_rows'] == 5
+        assert isinstance(res['cache_metadata']['updated'], datetime)
+        assert cls.get_dates_for_project('foo') == [dt]
+        assert cls.get_dates_for_project('bar') == []
+        cls.set('foo', dt, {'by_version': {'1.0': 4}}, 1471910400)
+        assert cls.get('foo', dt)['by_version'] == {'1.0': 4}
+        mode = cls._get_conn().execute('PRAGMA journal_mode').fetchone()[0]
+        assert mode == 'wal'
+
+    def test_set_many(self, tmpdir):
+        cls = SQLiteDataCache(str(tmpdir.join('cache.db')))
+        cls.set_many([
+            ('foo', datetime(2016, 8, 22), {'by_version': {}}, 2, None),
+            ('foo', datetime(2016, 8, 21), {'by_version': {}}, 1, None),
+            ('bar', datetime(2016, 8, 22), {'by_version': {}}, 2, None)
+        ])
+        assert cls.get_dates_for_project('foo') == [
+            datetime(2016, 8, 21), datetime(2016, 8, 22)
+        ]
+        assert cls.get_all_dates() == {
+            'foo': [datetime(2016, 8, 21), datetime(2016, 8, 22)],
+            'bar': [datetime(2016, 8, 22)]
+        }
+
+    def test_get_many_get_range(self, tmpdir):
+        cls = SQLiteDataCache(str(tmpdir.join('cache.db')))
+        cls.set_many([
+            ('foo', datetime(2016, 8, x), {'by_version': {'1.0': x}}, x, None)
+            for x in range(1, 6)
+        ] + [('bar', datetime(2016, 8, 2), {'by_version': {}}, 2, None)])
+        res = cls.get_range('foo', datetime(2016, 8, 2), datetime(2016, 8, 4))
+        assert sorted(res.keys()) == [
+            datetime(2016, 8, 2), datetime(2016, 8, 3), datetime(2016, 8, 4)
+        ]
+        assert res[datetime(2016, 8, 3)]['by_version'] == {'1.0': 3}
+        assert res[datetime(2016, 8, 3)]['cache_metadata']['date'] == \
+            datetime(2016, 8, 3)
+        assert cls.get_range(
+            'bar', datetime(2016, 8, 3), datetime(2016, 8, 4)) == {}
+        res = cls.get_many([
+            ('foo', datetime(2016, 8, 1)), ('bar', datetime(2016, 8, 2)),
+            ('bar', datetime(2016, 8, 3)), ('baz', datetime(2016, 8, 1))
+        ])
+        assert sorted(res.keys()) == [
+            ('bar', datetime(2016, 8, 2)), ('foo', datetime(2016, 8, 1))
+        ]
+        assert res[('foo', datetime(2016, 8, 1))] == cls.get(
+            'foo', datetime(2016, 8, 1))
+
+    def test_state(self, tmpdir):
+        cls = SQLiteDataCache(str(tmpdir.join('cache.db')))
+        assert cls.get_state('tables') is None
+        cls.set_state('tables', {'tables': ['downloads20160822']})
+        assert cls.get_state('tables') == {'tables': ['downloads20160822']}
+        assert cls.get_state_names() == ['tables']
+        assert cls.get_dates_for_project('tables') == []
+
+    def test_threads(self, tmpdir):
+        cls = SQLiteDataCache(str(tmpdir.join('cache.db')))
+
+        def worker(day):
+            cls.set('foo', datetime(2016, 8, day), {}, day)
+
+        threads = [
+            threading.Thread(target=worker, args=(d, )) for d in range(1, 9)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(cls.get_dates_for_project('foo')) == 8
+
+    def test_migrate(self, tmpdir):
+        disk = DiskDataCache(str(tmpdir.join('json')))
+        disk.set('foo', datetime(2016, 8, 21), {'by_version': {'1.0': 1}}, 1)
+        disk.set('foo', datetime(2016, 8, 22), {'by_version': {'1.0': 2}}, 2,
+                 metadata={'table_rows': 5})
+        disk.set('bar', datetime(2016, 8, 22), {'by_version': {}}, 2)
+        disk.set_state('tables', {'tables': ['downloads20160822']})
+        tmpdir.join('json', 'baz_20160822.json').write('not json')
+        cls = SQLiteDataCache(str(tmpdir.join('cache.db')))
+        assert cls.migrate(disk) == 3
+        for proj, dates in disk.get_all_dates().items():
+            if proj == 'baz':
+                continue
+            assert cls.get_dates_for_project(proj) == dates
+            for dt in dates:
+                assert cls.get(proj, dt) == disk.get(proj, dt)
+        assert cls.get_dates_for_project('baz') == []
+        assert cls.get_state('tables') == {'tables': ['downloads20160822']}
+        assert os.path.exists(str(tmpdir.join('json', 'foo_20160822.json')))
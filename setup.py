@@ -81,10 +81,17 @@ setup(
                 'badges for PyPI packages',
     long_description=long_description,
     install_requires=requires,
+    extras_require={
+        'parquet': ['pyarrow'],
+        'zstd': ['zstandard'],
+        'orjson': ['orjson'],
+        'msgpack': ['msgpack'],
+    },
     keywords="pypi warehouse download stats badge",
     classifiers=classifiers,
     entry_points="""
     [console_scripts]
     pypi-download-stats = pypi_download_stats.runner:main
+    pypi-download-stats-ingest = pypi_download_stats.ingest:main
     """,
 )